@@ -1,26 +1,55 @@
+import time
+
 import streamlit as st
 
 from crypto_llm.chainer import LlmChainer
-from crypto_llm.storage import FileStorage
+from crypto_llm.ingestion import PREPARING_MESSAGE
+from crypto_llm.storage import get_storage
 
 from dotenv import load_dotenv
 
 load_dotenv("./.env")
 
+# как часто и как долго ждать, пока whitepaper индексируется в фоне
+POLL_INTERVAL = 3
+MAX_WAIT = 600
+# сколько популярных криптовалют индексировать заранее
+PREFETCH_TOP = 20
+
 
-@st.cache_data
+@st.cache_resource
 def initialize_storage():
-    # Создаем экземпляр вашего класса LlmChainer
-    chainer = LlmChainer()
+    # Создаем экземпляр вашего класса LlmChainer; faiss и клиент модели
+    # загрузятся при первом запросе, которому они нужны
+    chainer = LlmChainer(lazy=True, background_ingestion=True)
 
-    # Загружаем список криптовалют
-    storage = FileStorage()
+    # Загружаем список криптовалют (общий для всего процесса экземпляр)
+    storage = get_storage()
     storage.save_cmc_info()
     crypto_list = storage.show_all_currency_names()
 
+    # популярные whitepapers индексируются в фоне до первых вопросов
+    chainer.prefetch(top=PREFETCH_TOP)
+
     return chainer, storage, crypto_list
 
 
+def wait_for_whitepaper(currency_name: str) -> str:
+    """
+    Polls the background ingestion of a whitepaper until it is ready, failed
+    or MAX_WAIT seconds passed.
+    """
+    # запрос посчитает вызов цепочки после ожидания, опрос только читает статус
+    status = chainer.ingestion_status(currency_name, count_request=False)
+    if status in ("queued", "running"):
+        with st.spinner("Whitepaper обрабатывается, это займет несколько минут..."):
+            deadline = time.monotonic() + MAX_WAIT
+            while status in ("queued", "running") and time.monotonic() < deadline:
+                time.sleep(POLL_INTERVAL)
+                status = chainer.poll_ingestion(currency_name)
+    return status
+
+
 # Инициализируем данные
 chainer, storage, crypto_list = initialize_storage()
 
@@ -36,14 +65,30 @@ question = st.text_input("Введите ваш вопрос по криптов
 # Кнопка для получения ответа
 if st.button("Получить ответ"):
     if question:
-        # Получаем ответ по введенному вопросу
-        answer = chainer.run_chain(selected_crypto, question)
-        st.write("Ответ:", answer)
+        status = wait_for_whitepaper(selected_crypto)
+        if status in ("queued", "running"):
+            st.info(PREPARING_MESSAGE)
+        else:
+            # Выводим ответ по введенному вопросу по мере генерации
+            st.write("Ответ:")
+            answer = st.write_stream(chainer.stream_chain(selected_crypto, question))
+            if not answer:
+                st.warning("Не удалось найти whitepaper по криптовалюте.")
     else:
         st.warning("Пожалуйста, введите вопрос.")
 
 # Кнопка для получения резюме
 if st.button("Получить summary по криптовалюте"):
-    # Получаем резюме
-    summary = chainer.run_chain(selected_crypto, is_summary=True)
-    st.write("Summary:", summary)
+    status = "ready"
+    if chainer.cached_summary(selected_crypto) is None:
+        status = wait_for_whitepaper(selected_crypto)
+    if status in ("queued", "running"):
+        st.info(PREPARING_MESSAGE)
+    else:
+        # Выводим резюме по мере генерации
+        st.write("Summary:")
+        summary = st.write_stream(
+            chainer.stream_chain(selected_crypto, is_summary=True)
+        )
+        if not summary:
+            st.warning("Не удалось найти whitepaper по криптовалюте.")
@@ -0,0 +1,98 @@
+"""
+Recall against size of the FAISS index types on a synthetic catalog.
+
+Chunks of every synthetic whitepaper are embedded with HashEmbeddings and
+indexed as "flat", "fp16" and "ivfpq"; held-out questions that are not in
+any index are searched in each of them and compared with the exact search.
+Indexes of real whitepapers are compared with
+`python -m crypto_llm.compression report`.
+
+    python -m benchmarks.compression --output compression.json --baseline prev.json
+"""
+
+import argparse
+import json
+import logging
+import random
+import sys
+import time
+from typing import Dict
+
+import numpy as np
+
+from benchmarks.corpus import make_question, make_text
+from benchmarks.fakes import HashEmbeddings
+from benchmarks.run import compare, git_commit
+from crypto_llm.compression import INDEX_TYPES, IndexBuilder, recall_report
+
+
+def run(args: argparse.Namespace) -> Dict:
+    rng = random.Random(args.seed)
+    embedder = HashEmbeddings(dim=args.dim)
+    datasets = []
+    for paper in range(args.papers):
+        # размеры документов разные, чтобы часть из них была мала для IVF-PQ
+        n_chunks = rng.randint(args.chunks // 4, args.chunks * 2)
+        vectors = np.array(
+            embedder.embed_documents(
+                [make_text(rng, args.words) for _ in range(n_chunks)]
+            ),
+            dtype="float32",
+        )
+        queries = np.array(
+            embedder.embed_documents([make_question(rng) for _ in range(args.queries)]),
+            dtype="float32",
+        )
+        datasets.append((vectors, queries))
+
+    builders = [
+        IndexBuilder(
+            index_type, pq_m=args.pq_m, min_ivfpq_vectors=args.min_ivfpq_vectors
+        )
+        for index_type in INDEX_TYPES
+    ]
+    return {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "git_commit": git_commit(),
+            "params": {k: v for k, v in vars(args).items() if k != "baseline"},
+            "vectors": sum(len(vectors) for vectors, _ in datasets),
+        },
+        **recall_report(datasets, builders, k=args.k),
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="FAISS index types benchmark")
+    parser.add_argument("--papers", type=int, default=10)
+    parser.add_argument("--chunks", type=int, default=2000, help="chunks per paper")
+    parser.add_argument("--words", type=int, default=80, help="words per chunk")
+    parser.add_argument("--queries", type=int, default=50, help="queries per paper")
+    parser.add_argument("--dim", type=int, default=1024, help="embedding size")
+    parser.add_argument("--k", type=int, default=8)
+    parser.add_argument("--pq-m", type=int, default=64)
+    parser.add_argument("--min-ivfpq-vectors", type=int, default=2048)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="compression_results.json")
+    parser.add_argument("--baseline", default=None, help="results to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+
+    results = run(args)
+    with open(args.output, "w") as fp:
+        json.dump(results, fp, indent=2, ensure_ascii=False)
+    print(json.dumps(results, indent=2, ensure_ascii=False))
+
+    if args.baseline:
+        with open(args.baseline, "r") as fp:
+            baseline = json.load(fp)
+        regressions = compare(results, baseline, args.tolerance)
+        for regression in regressions:
+            print("REGRESSION " + regression)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
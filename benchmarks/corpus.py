@@ -0,0 +1,95 @@
+import os
+import random
+from typing import List, Tuple
+
+# слова whitepaper-подобного текста, из них же собираются вопросы
+VOCABULARY = (
+    "blockchain consensus validator stake token ledger block transaction fee "
+    "network node protocol smart contract governance supply emission reward "
+    "shard layer bridge oracle wallet signature hash proof security finality "
+    "throughput latency liquidity market exchange staking delegation slashing "
+    "epoch upgrade treasury vote proposal mining difficulty peer gossip state "
+    "account address virtual machine gas rollup privacy zero knowledge audit"
+).split()
+
+
+def make_text(rng: random.Random, n_words: int) -> str:
+    return " ".join(rng.choice(VOCABULARY) for _ in range(n_words))
+
+
+def make_question(rng: random.Random) -> str:
+    return "What is the " + make_text(rng, 4) + "?"
+
+
+def write_pdf(path: str, pages: List[str], line_words: int = 12) -> None:
+    """
+    Writes a minimal PDF with one Helvetica text stream per page.
+    """
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>"]
+    kids = " ".join(f"{3 + 2 * i} 0 R" for i in range(len(pages)))
+    objects.append(f"<< /Type /Pages /Kids [{kids}] /Count {len(pages)} >>")
+    font_id = 3 + 2 * len(pages)
+    for i, text in enumerate(pages):
+        words = text.split()
+        lines = [
+            " ".join(words[start : start + line_words])
+            for start in range(0, len(words), line_words)
+        ]
+        stream = (
+            "BT /F1 10 Tf 12 TL 72 760 Td "
+            + " ".join(f"({line}) Tj T*" for line in lines)
+            + " ET"
+        )
+        objects.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+            f"/Contents {4 + 2 * i} 0 R "
+            f"/Resources << /Font << /F1 {font_id} 0 R >> >> >>"
+        )
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+    objects.append("<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+
+    out, offsets = "%PDF-1.4\n", []
+    for i, obj in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += f"{i} 0 obj\n{obj}\nendobj\n"
+    xref = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n"
+    out += "".join(f"{offset:010d} 00000 n \n" for offset in offsets)
+    out += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\n"
+    out += f"startxref\n{xref}\n%%EOF\n"
+    with open(path, "w", encoding="latin-1") as fp:
+        fp.write(out)
+
+
+def make_corpus(
+    path: str,
+    n_papers: int = 20,
+    pages_per_paper: int = 10,
+    words_per_page: int = 400,
+    seed: int = 0,
+) -> List[Tuple[str, str, str]]:
+    """
+    Generates synthetic whitepaper PDFs.
+
+    Args:
+        path (str): directory for the PDFs
+        n_papers (int): number of whitepapers
+        pages_per_paper (int): pages in every whitepaper
+        words_per_page (int): words on every page
+        seed (int): seed of the text generator
+
+    Returns:
+        List[Tuple[str, str, str]]: (currency name, symbol, PDF path) triples
+    """
+    os.makedirs(path, exist_ok=True)
+    rng = random.Random(seed)
+    coins = []
+    for i in range(n_papers):
+        name, symbol = f"Synthetic Coin {i}", f"SYN{i}"
+        file_path = os.path.join(path, f"syn{i}.pdf")
+        write_pdf(
+            file_path,
+            [make_text(rng, words_per_page) for _ in range(pages_per_paper)],
+        )
+        coins.append((name, symbol, file_path))
+    return coins
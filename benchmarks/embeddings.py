@@ -0,0 +1,152 @@
+"""
+Throughput of the embedding backends.
+
+The local CPU backend runs a tiny randomly initialized BERT that is created
+in a temporary directory, so no model has to be downloaded (or a real model
+given with --model-path), in fp32 and int8 and with every --threads value.
+The remote backend is imitated by HashEmbeddings sleeping --remote-latency
+seconds per API call of --batch-size texts.
+
+    python -m benchmarks.embeddings --output embeddings.json --baseline prev.json
+
+Needs the optional dependencies of the local backend: pip install '.[local]'
+"""
+
+import argparse
+import importlib.util
+import json
+import logging
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+from benchmarks.corpus import VOCABULARY, make_text
+from benchmarks.fakes import HashEmbeddings
+from benchmarks.run import compare, git_commit, latency_stats
+from langchain_core.embeddings import Embeddings
+
+
+def make_tiny_model(path: str, hidden_size: int = 64, layers: int = 2) -> str:
+    """
+    Saves a randomly initialized BERT with a word-level vocabulary of the
+    synthetic corpus to `path`.
+    """
+    import torch
+    from transformers import BertConfig, BertModel, BertTokenizerFast
+
+    os.makedirs(path, exist_ok=True)
+    vocab_file = os.path.join(path, "vocab.txt")
+    with open(vocab_file, "w") as fp:
+        tokens = ["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"] + sorted(
+            set(VOCABULARY)
+        )
+        fp.write("\n".join(tokens) + "\n")
+    BertTokenizerFast(vocab_file=vocab_file).save_pretrained(path)
+    config = BertConfig(
+        vocab_size=len(tokens),
+        hidden_size=hidden_size,
+        num_hidden_layers=layers,
+        num_attention_heads=2,
+        intermediate_size=4 * hidden_size,
+    )
+    torch.manual_seed(0)
+    BertModel(config).save_pretrained(path)
+    return path
+
+
+def throughput(embedder: Embeddings, texts: List[str], batch_size: int) -> Dict:
+    batch_times = []
+    for start in range(0, len(texts), batch_size):
+        batch = texts[start : start + batch_size]
+        begin = time.perf_counter()
+        embedder.embed_documents(batch)
+        batch_times.append(time.perf_counter() - begin)
+    elapsed = sum(batch_times)
+    return {
+        "elapsed_s": elapsed,
+        "texts_per_s": len(texts) / elapsed,
+        "batch": latency_stats(batch_times),
+    }
+
+
+def run(args: argparse.Namespace) -> Dict:
+    from crypto_llm.embedder import LocalEmbeddings
+
+    rng = random.Random(args.seed)
+    texts = [make_text(rng, args.words) for _ in range(args.texts)]
+    model_dir = None
+    model_path = args.model_path
+    if model_path is None:
+        model_dir = tempfile.mkdtemp(prefix="crypto_llm_tiny_model_")
+        model_path = make_tiny_model(model_dir)
+
+    results = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "git_commit": git_commit(),
+            "params": {k: v for k, v in vars(args).items() if k != "baseline"},
+        },
+        "remote": throughput(
+            HashEmbeddings(latency=args.remote_latency), texts, args.batch_size
+        ),
+    }
+    for quantize in (False, True):
+        for threads in args.threads:
+            embedder = LocalEmbeddings(
+                model_path,
+                batch_size=args.batch_size,
+                quantize=quantize,
+                threads=threads,
+            )
+            # первый прогон прогревает аллокатор и ядра torch
+            embedder.embed_documents(texts[: args.batch_size])
+            name = f"local_{'int8' if quantize else 'fp32'}_threads_{threads}"
+            results[name] = throughput(embedder, texts, args.batch_size)
+
+    if model_dir is not None:
+        shutil.rmtree(model_dir, ignore_errors=True)
+    return results
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Embedding backends benchmark")
+    parser.add_argument("--texts", type=int, default=2000)
+    parser.add_argument("--words", type=int, default=80, help="words per text")
+    parser.add_argument("--batch-size", type=int, default=50)
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, os.cpu_count()])
+    parser.add_argument(
+        "--remote-latency", type=float, default=0.3, help="seconds per API call"
+    )
+    parser.add_argument("--model-path", default=None, help="defaults to a tiny BERT")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="embeddings_results.json")
+    parser.add_argument("--baseline", default=None, help="results to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+
+    if not all(importlib.util.find_spec(name) for name in ("torch", "transformers")):
+        print("torch and transformers are required: pip install '.[local]'")
+        return 2
+
+    results = run(args)
+    with open(args.output, "w") as fp:
+        json.dump(results, fp, indent=2, ensure_ascii=False)
+    print(json.dumps(results, indent=2, ensure_ascii=False))
+
+    if args.baseline:
+        with open(args.baseline, "r") as fp:
+            baseline = json.load(fp)
+        regressions = compare(results, baseline, args.tolerance)
+        for regression in regressions:
+            print("REGRESSION " + regression)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
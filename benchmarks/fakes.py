@@ -0,0 +1,97 @@
+import hashlib
+import time
+from types import SimpleNamespace
+from typing import List, Tuple
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+
+
+class HashEmbeddings(Embeddings):
+    """
+    Deterministic stand-in for NVIDIAEmbeddings.
+
+    The vector of a text is the normalized sum of pseudo-random vectors of its
+    words, so texts sharing words are close and retrieval results are
+    meaningful. `latency` seconds are slept per call to imitate the API.
+    """
+
+    def __init__(self, dim: int = 1024, latency: float = 0.0):
+        self.dim = dim
+        self.latency = latency
+        self.model = f"hash-embeddings-{dim}"
+        self._words = {}
+
+    def _word(self, word: str) -> np.ndarray:
+        vector = self._words.get(word)
+        if vector is None:
+            seed = int.from_bytes(hashlib.md5(word.encode()).digest()[:4], "little")
+            vector = np.random.default_rng(seed).standard_normal(self.dim)
+            self._words[word] = vector.astype("float32")
+        return self._words[word]
+
+    def _embed(self, text: str) -> List[float]:
+        vector = np.zeros(self.dim, dtype="float32")
+        for word in text.lower().split():
+            vector += self._word(word)
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if self.latency:
+            time.sleep(self.latency)
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        if self.latency:
+            time.sleep(self.latency)
+        return self._embed(text)
+
+
+class FakeCMCClient:
+    """
+    Stand-in for coinmarketcapapi.CoinMarketCapAPI serving a synthetic listing
+    whose technical docs point to the local corpus PDFs.
+    """
+
+    def __init__(self, coins: List[Tuple[str, str, str]]):
+        """
+        Args:
+            coins (List[Tuple[str, str, str]]): (name, symbol, pdf path) triples
+        """
+        self.coins = coins
+        self.by_symbol = {symbol: (name, symbol, link) for name, symbol, link in coins}
+        self.calls = 0
+
+    def cryptocurrency_listings_latest(self, start: int = 1, limit: int = 100):
+        self.calls += 1
+        data = [
+            {"id": i, "name": name, "symbol": symbol, "cmc_rank": i}
+            for i, (name, symbol, _) in enumerate(self.coins, 1)
+        ]
+        return SimpleNamespace(data=data[start - 1 : start - 1 + limit])
+
+    def cryptocurrency_info(self, symbol: str, skip_invalid: bool = False):
+        self.calls += 1
+        data = {}
+        for sym in symbol.split(","):
+            if sym not in self.by_symbol:
+                continue
+            name, sym, link = self.by_symbol[sym]
+            data[sym] = [
+                {
+                    "name": name,
+                    "symbol": sym,
+                    "description": f"{name} is a synthetic currency.",
+                    "urls": {"technical_doc": [link]},
+                }
+            ]
+        return SimpleNamespace(data=data)
+
+
+def fake_llm(answer: str = "Синтетический ответ.") -> FakeListChatModel:
+    """
+    Stand-in for ChatNVIDIA that answers instantly with a fixed text.
+    """
+    return FakeListChatModel(responses=[answer])
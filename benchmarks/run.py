@@ -0,0 +1,304 @@
+"""
+Offline benchmark of the ingestion, indexing and question answering pipeline.
+
+NVIDIAEmbeddings, ChatNVIDIA and the CoinMarketCap API are replaced by
+deterministic stand-ins and whitepapers by a synthetic PDF corpus, so the
+numbers measure only the code of this repository. Results are written as
+JSON and can be compared with the results of a previous release:
+
+    python -m benchmarks.run --output bench.json --baseline bench_prev.json
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.corpus import make_corpus, make_question
+from benchmarks.fakes import FakeCMCClient, HashEmbeddings, fake_llm
+from crypto_llm.chainer import LlmChainer
+from crypto_llm.loader import CMCLoader
+from crypto_llm.metrics import get_tracer
+from crypto_llm.scheduler import RequestScheduler
+from crypto_llm.storage import FileStorage
+from crypto_llm.vectorizer import FAISSVectorizer
+
+# у заглушек нет лимитов, планировщик не должен тормозить замеры
+UNLIMITED = {"cmc": {"rate": 1e9, "burst": 1e9}}
+
+# метрики с этими окончаниями лучше, когда они меньше
+LOWER_IS_BETTER = ("_ms", "_s", "_mb")
+HIGHER_IS_BETTER = ("_per_s", "recall", "compression")
+# параметры, от которых результаты зависят
+CORPUS_PARAMS = ("papers", "pages", "words", "queries", "summaries", "dim", "seed")
+
+
+def latency_stats(samples: List[float]) -> Dict[str, float]:
+    """
+    p50, p99 and mean of latencies given in seconds, in milliseconds.
+    """
+    samples_ms = np.asarray(samples) * 1000
+    return {
+        "p50_ms": float(np.percentile(samples_ms, 50)),
+        "p99_ms": float(np.percentile(samples_ms, 99)),
+        "mean_ms": float(samples_ms.mean()),
+    }
+
+
+def timed(fn: Callable, *args, **kwargs) -> float:
+    start = time.perf_counter()
+    fn(*args, **kwargs)
+    return time.perf_counter() - start
+
+
+def peak_rss_mb(who: int = resource.RUSAGE_SELF) -> float:
+    # ru_maxrss в килобайтах на Linux и в байтах на macOS
+    scale = 1024**2 if sys.platform == "darwin" else 1024
+    return resource.getrusage(who).ru_maxrss / scale
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],
+            text=True,
+            stderr=subprocess.DEVNULL,
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args: argparse.Namespace) -> Dict:
+    data_path = args.data_path or tempfile.mkdtemp(prefix="crypto_llm_bench_") + "/"
+    os.environ["DATA_PATH"] = data_path
+    for directory in ("sources/cmc", "embeddings", "summaries"):
+        os.makedirs(data_path + directory, exist_ok=True)
+    rng = random.Random(args.seed)
+
+    coins = make_corpus(
+        data_path + "corpus",
+        n_papers=args.papers,
+        pages_per_paper=args.pages,
+        words_per_page=args.words,
+        seed=args.seed,
+    )
+    names = [name for name, _, _ in coins]
+    pd.DataFrame({"names": names}).to_csv(
+        data_path + "sources/cmc/pdf_correct_names.csv", index=False
+    )
+    results = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "git_commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "params": {k: v for k, v in vars(args).items() if k != "baseline"},
+        }
+    }
+    memory = {}
+
+    # CMC: листинг и детальная информация через заглушку API
+    cmc_loader = CMCLoader(scheduler=RequestScheduler(limits=UNLIMITED))
+    cmc_loader.cmc_client = FakeCMCClient(coins)
+    start = time.perf_counter()
+    storage = FileStorage(cmc_loader=cmc_loader)
+    storage.get_symbols_by_names(names)
+    storage.save_cmc_info()
+    results["cmc"] = {
+        "elapsed_s": time.perf_counter() - start,
+        "api_calls": cmc_loader.cmc_client.calls,
+    }
+    memory["cmc_mb"] = peak_rss_mb()
+
+    # загрузка, разбор и нарезка PDF
+    links = storage.get_all_pdf_whitepapers()
+    start = time.perf_counter()
+    ingested = storage.wp_loader.get_info_parallel(
+        links, parse_workers=args.parse_workers, resume=False
+    )
+    elapsed = time.perf_counter() - start
+    n_chunks = sum(result.n_chunks for result in ingested)
+    corpus_mb = sum(os.path.getsize(link) for _, _, link in coins) / 1024**2
+    results["ingestion"] = {
+        "papers": len(ingested),
+        "failed": sum(result.status == "failed" for result in ingested),
+        "chunks": n_chunks,
+        "elapsed_s": elapsed,
+        "papers_per_s": len(ingested) / elapsed,
+        "chunks_per_s": n_chunks / elapsed,
+        "mb_per_s": corpus_mb / elapsed,
+    }
+    memory["ingestion_mb"] = peak_rss_mb()
+
+    # построение индексов faiss
+    vectorizer = FAISSVectorizer(
+        storage=storage,
+        embedder=HashEmbeddings(dim=args.dim, latency=args.embed_latency),
+    )
+    build_times = [timed(vectorizer.calc_and_save_embedding, name) for name in names]
+    results["index_build"] = {
+        "elapsed_s": sum(build_times),
+        "chunks_per_s": n_chunks / sum(build_times),
+        **latency_stats(build_times),
+    }
+    memory["index_build_mb"] = peak_rss_mb()
+
+    # загрузка индексов с диска без кэша
+    load_times = [
+        timed(vectorizer.load_index, vectorizer.embedding_path + name) for name in names
+    ]
+    results["index_load"] = latency_stats(load_times)
+    memory["index_load_mb"] = peak_rss_mb()
+
+    # поиск по прогретым индексам
+    retrievers = {name: vectorizer.get_retriever(name) for name in names}
+    queries = [(rng.choice(names), make_question(rng)) for _ in range(args.queries)]
+    retrieval_times = [timed(retrievers[name].invoke, query) for name, query in queries]
+    results["retrieval"] = latency_stats(retrieval_times)
+    for mode in ("lexical", "hybrid"):
+        retrievers = {name: vectorizer.get_retriever(name, mode=mode) for name in names}
+        mode_times = [timed(retrievers[name].invoke, query) for name, query in queries]
+        results["retrieval_" + mode] = latency_stats(mode_times)
+    results["query_embeddings"] = vectorizer.embedder.stats()
+    memory["retrieval_mb"] = peak_rss_mb()
+
+    # run_chain с мгновенной моделью: всё время - накладные расходы пайплайна
+    chainer = LlmChainer(llm=fake_llm(), vectorizer=vectorizer)
+    get_tracer().memory.clear()
+    questions = [(rng.choice(names), make_question(rng)) for _ in range(args.queries)]
+    chain_times = [
+        timed(chainer.run_chain, name, question) for name, question in questions
+    ]
+    summary_names = names[: args.summaries]
+    summary_times = [
+        timed(chainer.run_chain, name, is_summary=True) for name in summary_names
+    ]
+    cached_summary_times = [
+        timed(chainer.run_chain, name, is_summary=True) for name in summary_names
+    ]
+    results["run_chain"] = {
+        "question": latency_stats(chain_times),
+        "summary": latency_stats(summary_times),
+        "summary_cached": latency_stats(cached_summary_times),
+        "answer_cache": chainer.answer_cache.stats(),
+        "stages": get_tracer().memory.summary(),
+    }
+    memory["run_chain_mb"] = peak_rss_mb()
+
+    # потоковая загрузка: разбор страниц идет параллельно с эмбеддингом
+    stream_embedder = HashEmbeddings(dim=args.dim, latency=args.embed_latency)
+    # другое имя модели, чтобы не брать векторы из кэша эмбеддингов
+    stream_embedder.model += "-stream"
+    stream_vectorizer = FAISSVectorizer(storage=storage, embedder=stream_embedder)
+    start = time.perf_counter()
+    streamed = sum(
+        stream_vectorizer.stream_embedding(name, link) for name, _, link in coins
+    )
+    elapsed = time.perf_counter() - start
+    results["streaming_ingestion"] = {
+        "chunks": streamed,
+        "elapsed_s": elapsed,
+        "papers_per_s": len(coins) / elapsed,
+        "chunks_per_s": streamed / elapsed,
+    }
+    memory["streaming_ingestion_mb"] = peak_rss_mb()
+
+    results["memory"] = {
+        "peak_rss_mb": peak_rss_mb(),
+        "children_peak_rss_mb": peak_rss_mb(resource.RUSAGE_CHILDREN),
+        "peak_rss_by_stage": memory,
+    }
+    if not args.keep_data:
+        shutil.rmtree(data_path, ignore_errors=True)
+    return results
+
+
+def flatten(results: Dict, prefix: str = "") -> Dict[str, float]:
+    flat = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, prefix + key + "."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[prefix + key] = value
+    return flat
+
+
+def compare(results: Dict, baseline: Dict, tolerance: float = 0.2) -> List[str]:
+    """
+    Lists the metrics that got worse than in `baseline` by more than
+    `tolerance` (a fraction of the baseline value).
+    """
+    current, previous = flatten(results), flatten(baseline)
+    regressions = []
+    for key, value in current.items():
+        old = previous.get(key)
+        if key.startswith("meta.") or not old:
+            continue
+        change = (value - old) / old
+        if key.endswith(HIGHER_IS_BETTER):
+            worse = -change
+        elif key.endswith(LOWER_IS_BETTER):
+            worse = change
+        else:
+            continue
+        if worse > tolerance:
+            regressions.append(f"{key}: {old:.4g} -> {value:.4g} ({change:+.0%})")
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Offline crypto_llm benchmarks")
+    parser.add_argument("--papers", type=int, default=20)
+    parser.add_argument("--pages", type=int, default=10)
+    parser.add_argument("--words", type=int, default=400, help="words per page")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--summaries", type=int, default=5)
+    parser.add_argument("--dim", type=int, default=1024, help="embedding size")
+    parser.add_argument(
+        "--embed-latency", type=float, default=0.0, help="seconds per embed call"
+    )
+    parser.add_argument("--parse-workers", type=int, default=None)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--data-path", default=None, help="defaults to a temp dir")
+    parser.add_argument("--keep-data", action="store_true")
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--baseline", default=None, help="results to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+    if not args.verbose:
+        logging.disable(logging.INFO)
+
+    results = run(args)
+    with open(args.output, "w") as fp:
+        json.dump(results, fp, indent=2, ensure_ascii=False)
+    print(json.dumps(results, indent=2, ensure_ascii=False))
+
+    if args.baseline:
+        with open(args.baseline, "r") as fp:
+            baseline = json.load(fp)
+        params = baseline["meta"]["params"]
+        for key in CORPUS_PARAMS:
+            if params.get(key) != getattr(args, key):
+                print(f"WARNING baseline has {key}={params.get(key)}")
+        regressions = compare(results, baseline, args.tolerance)
+        for regression in regressions:
+            print("REGRESSION " + regression)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,154 @@
+"""
+Startup benchmark: import time of the package and time to the first response
+served from the summary cache, each measured in a fresh interpreter.
+
+The cached response must not load FAISS, the NVIDIA clients or the
+CoinMarketCap client; the benchmark fails if it does.
+
+    python -m benchmarks.startup --output startup.json --baseline startup_prev.json
+"""
+
+import argparse
+import json
+import logging
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+from benchmarks.run import compare, git_commit, latency_stats
+from crypto_llm.chainer import LlmChainer
+
+# модули, которых не должно быть в процессе после ответа из кэша
+HEAVY_MODULES = (
+    "faiss",
+    "langchain_community",
+    "langchain_nvidia_ai_endpoints",
+    "coinmarketcapapi",
+    "pandas",
+)
+
+CURRENCY = "Synthetic Coin"
+
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import crypto_llm.chainer
+imported = time.perf_counter()
+chainer = crypto_llm.chainer.LlmChainer(lazy=True)
+created = time.perf_counter()
+summary = chainer.run_chain({currency!r}, is_summary=True)
+answered = time.perf_counter()
+print(json.dumps({{
+    "import_s": imported - start,
+    "init_s": created - imported,
+    "first_response_s": answered - created,
+    "total_s": answered - start,
+    "cached": summary is not None,
+    "heavy_modules": sorted(
+        {{name.split(".")[0] for name in sys.modules}} & set({heavy!r})
+    ),
+}}))
+"""
+
+FULL_IMPORT = """
+import time
+start = time.perf_counter()
+import crypto_llm.vectorizer, crypto_llm.model, crypto_llm.storage
+print(time.perf_counter() - start)
+"""
+
+
+def probe(code: str, env: Dict[str, str]) -> str:
+    result = subprocess.run(
+        [sys.executable, "-c", code],
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return result.stdout.strip().splitlines()[-1]
+
+
+def run(args: argparse.Namespace) -> Dict:
+    data_path = tempfile.mkdtemp(prefix="crypto_llm_startup_") + "/"
+    os.environ["DATA_PATH"] = data_path
+    os.makedirs(data_path + "summaries", exist_ok=True)
+    LlmChainer(lazy=True).save_summary(CURRENCY, "Синтетическое саммари.")
+
+    # без ключей API: ответ из кэша не должен ходить в сеть
+    env = {
+        key: value
+        for key, value in os.environ.items()
+        if key not in ("NVIDIA_API_KEY", "CMC_API_KEY")
+    }
+    env["PYTHONPATH"] = os.pathsep.join(
+        filter(None, [os.getcwd(), env.get("PYTHONPATH")])
+    )
+    code = PROBE.format(currency=CURRENCY, heavy=HEAVY_MODULES)
+
+    samples: Dict[str, List[float]] = {}
+    heavy_modules, cached = set(), True
+    process_times = []
+    for _ in range(args.runs):
+        start = time.perf_counter()
+        sample = json.loads(probe(code, env))
+        process_times.append(time.perf_counter() - start)
+        heavy_modules.update(sample.pop("heavy_modules"))
+        cached = cached and sample.pop("cached")
+        for key, value in sample.items():
+            samples.setdefault(key, []).append(value)
+    full_import = [float(probe(FULL_IMPORT, env)) for _ in range(args.runs)]
+
+    results = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "git_commit": git_commit(),
+            "params": {"runs": args.runs},
+        },
+        "lazy": {key[:-2]: latency_stats(value) for key, value in samples.items()},
+        "process": latency_stats(process_times),
+        "full_import": latency_stats(full_import),
+        "cached": cached,
+        "heavy_modules": sorted(heavy_modules),
+    }
+    shutil.rmtree(data_path, ignore_errors=True)
+    return results
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="crypto_llm startup benchmark")
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--output", default="startup_results.json")
+    parser.add_argument("--baseline", default=None, help="results to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+
+    results = run(args)
+    with open(args.output, "w") as fp:
+        json.dump(results, fp, indent=2, ensure_ascii=False)
+    print(json.dumps(results, indent=2, ensure_ascii=False))
+
+    failed = False
+    if not results["cached"]:
+        print("FAILED the summary was not served from the cache")
+        failed = True
+    if results["heavy_modules"]:
+        print("FAILED cached response loaded " + ", ".join(results["heavy_modules"]))
+        failed = True
+    if args.baseline:
+        with open(args.baseline, "r") as fp:
+            baseline = json.load(fp)
+        regressions = compare(results, baseline, args.tolerance)
+        for regression in regressions:
+            print("REGRESSION " + regression)
+        failed = failed or bool(regressions)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
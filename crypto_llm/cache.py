@@ -0,0 +1,253 @@
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+from crypto_llm.locks import swap_lock
+
+logging.basicConfig(
+    level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+)
+logger = logging.getLogger(__name__)
+
+
+class StaleIndexError(RuntimeError):
+    """
+    Raised when a saved index refers to a version of the chunk store that has
+    been deleted, i.e. the index files were replaced while they were read.
+    """
+
+
+def dir_signature(path: str) -> Tuple:
+    """
+    Returns (file name, mtime, size) of every file in a directory, used to
+    detect that an index on disk has been rewritten.
+    """
+    signature = []
+    # не читаем папку посреди замены ее новой версией
+    with swap_lock(path):
+        for file_name in sorted(os.listdir(path)):
+            stat = os.stat(os.path.join(path, file_name))
+            signature.append((file_name, stat.st_mtime_ns, stat.st_size))
+    return tuple(signature)
+
+
+class VectorStoreCache:
+    """
+    LRU cache of loaded vector stores keyed by currency name.
+
+    Entries are evicted when either `max_entries` or `max_bytes` is exceeded.
+    The size of an entry is approximated by the size of its index files on
+    disk, and an entry is reloaded when those files change.
+    """
+
+    def __init__(self, max_entries: int = 32, max_bytes: int = 1024**3):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(
+        self, name: str, path: str, load: Callable[[str], Any], retry: bool = True
+    ) -> Any:
+        """
+        Returns the vector store stored in `path`, calling `load(path)` on a miss.
+
+        Args:
+            name (str): cache key, the currency name
+            path (str): directory with the saved index
+            load (Callable): loads the vector store from `path`
+            retry (bool): load once more if `load` raises StaleIndexError
+
+        Returns:
+            Any: the loaded vector store
+        """
+        signature = dir_signature(path)
+        with self.lock:
+            entry = self.entries.get(name)
+            if entry is not None and entry["signature"] == signature:
+                self.entries.move_to_end(name)
+                self.hits += 1
+                return entry["value"]
+            if entry is not None:
+                logger.info("Index files changed for: %s, reloading", name)
+                self._remove(name)
+            self.misses += 1
+
+        try:
+            value = load(path)
+        except StaleIndexError as e:
+            if not retry:
+                raise
+            # индекс заменили, пока мы его читали: читаем новую версию
+            logger.info("Index of %s changed while loading, reloading. %s", name, e)
+            return self.get(name, path, load, retry=False)
+        size = sum(item[2] for item in signature)
+        with self.lock:
+            if name in self.entries:
+                self._remove(name)
+            self.entries[name] = {"value": value, "signature": signature, "size": size}
+            self.total_bytes += size
+            self._evict()
+        return value
+
+    def invalidate(self, name: str) -> None:
+        with self.lock:
+            if name in self.entries:
+                self._remove(name)
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+            self.total_bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            requests = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / requests if requests else 0.0,
+                "evictions": self.evictions,
+                "entries": len(self.entries),
+                "bytes": self.total_bytes,
+            }
+
+    def _remove(self, name: str) -> None:
+        entry = self.entries.pop(name)
+        self.total_bytes -= entry["size"]
+
+    def _evict(self) -> None:
+        # самый свежий элемент не вытесняем, даже если он один больше бюджета
+        while len(self.entries) > 1 and (
+            len(self.entries) > self.max_entries or self.total_bytes > self.max_bytes
+        ):
+            name = next(iter(self.entries))
+            self._remove(name)
+            self.evictions += 1
+            logger.debug("Evicted index from cache: %s", name)
+
+
+class AnswerCache:
+    """
+    Semantic cache of answers to questions about a currency.
+
+    A stored answer is returned when a new question about the same currency
+    has cosine similarity of at least `threshold` to a past question and the
+    currency index has not been rebuilt since. Entries are evicted by LRU
+    when there are more than `max_entries` and expire after `ttl` seconds.
+    """
+
+    def __init__(
+        self, threshold: float = 0.95, max_entries: int = 4096, ttl: int = 86400
+    ):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries: "OrderedDict[int, Dict[str, Any]]" = OrderedDict()
+        self.by_currency: Dict[str, set] = {}
+        self.next_id = 0
+        self.hits = 0
+        self.misses = 0
+        # лучшие найденные сходства, по ним подбирается threshold
+        self.best_similarities = deque(maxlen=1000)
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def _normalize(embedding: List[float]) -> np.ndarray:
+        vector = np.asarray(embedding, dtype="float32")
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def get(
+        self, currency_name: str, embedding: List[float], version: Any = None
+    ) -> Optional[str]:
+        """
+        Returns the answer to the most similar past question, or None.
+
+        Args:
+            currency_name (str): currency the question is about
+            embedding (List[float]): embedding of the question
+            version (Any): version of the currency index, entries stored for
+                another version are dropped
+        """
+        query = self._normalize(embedding)
+        now = time.time()
+        with self.lock:
+            best_id, best_similarity = None, -1.0
+            for entry_id in list(self.by_currency.get(currency_name, ())):
+                entry = self.entries[entry_id]
+                if entry["version"] != version or now - entry["created"] > self.ttl:
+                    self._remove(entry_id)
+                    continue
+                similarity = float(np.dot(query, entry["embedding"]))
+                if similarity > best_similarity:
+                    best_id, best_similarity = entry_id, similarity
+            if best_id is not None:
+                self.best_similarities.append(best_similarity)
+            if best_id is not None and best_similarity >= self.threshold:
+                self.entries.move_to_end(best_id)
+                self.hits += 1
+                logger.info(
+                    "Answer cache hit for: %s, similarity %.3f",
+                    currency_name,
+                    best_similarity,
+                )
+                return self.entries[best_id]["answer"]
+            self.misses += 1
+            return None
+
+    def put(
+        self,
+        currency_name: str,
+        embedding: List[float],
+        answer: str,
+        version: Any = None,
+    ) -> None:
+        with self.lock:
+            entry_id = self.next_id
+            self.next_id += 1
+            self.entries[entry_id] = {
+                "currency": currency_name,
+                "embedding": self._normalize(embedding),
+                "answer": answer,
+                "version": version,
+                "created": time.time(),
+            }
+            self.by_currency.setdefault(currency_name, set()).add(entry_id)
+            while len(self.entries) > self.max_entries:
+                self._remove(next(iter(self.entries)))
+
+    def invalidate(self, currency_name: str) -> None:
+        with self.lock:
+            for entry_id in list(self.by_currency.get(currency_name, ())):
+                self._remove(entry_id)
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            requests = self.hits + self.misses
+            similarities = sorted(self.best_similarities)
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / requests if requests else 0.0,
+                "entries": len(self.entries),
+                "threshold": self.threshold,
+                "best_similarity_p50": (
+                    similarities[len(similarities) // 2] if similarities else None
+                ),
+            }
+
+    def _remove(self, entry_id: int) -> None:
+        entry = self.entries.pop(entry_id)
+        currency_ids = self.by_currency[entry["currency"]]
+        currency_ids.discard(entry_id)
+        if not currency_ids:
+            del self.by_currency[entry["currency"]]
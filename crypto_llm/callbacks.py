@@ -0,0 +1,119 @@
+import threading
+import time
+from typing import Callable, Dict
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+from crypto_llm.metrics import Span, Tracer
+
+
+class SpanCallbackHandler(BaseCallbackHandler):
+    """
+    Records the retriever, LLM, context formatting and prompt steps of a
+    LangChain run as spans, for sync, async and streaming calls alike.
+    """
+
+    # вызываем сразу, а не в executor, иначе длительности смещаются
+    run_inline = True
+    CHAIN_STAGES = {
+        "format_docs": "format_docs",
+        "map_summaries": "map_summaries",
+        "global_retrieval": "retrieval",
+        "hybrid_retrieval": "retrieval",
+        "lexical_retrieval": "retrieval",
+    }
+
+    def __init__(
+        self,
+        tracer: Tracer,
+        parent: str = None,
+        count_tokens: Callable[[str], int] = None,
+    ):
+        self.tracer = tracer
+        self.parent = parent
+        self.count_tokens = count_tokens
+        self.runs: Dict[UUID, tuple] = {}
+        self.lock = threading.Lock()
+
+    def _start(self, run_id: UUID, name: str) -> None:
+        with self.lock:
+            self.runs[run_id] = (Span(name, self.parent), time.perf_counter())
+
+    def _end(self, run_id: UUID, error: BaseException = None, **attributes) -> None:
+        with self.lock:
+            item = self.runs.pop(run_id, None)
+        if item is None:
+            return
+        span, start = item
+        span.duration = time.perf_counter() - start
+        span.set(**attributes)
+        if error is not None:
+            span.error = type(error).__name__
+        self.tracer.record(span)
+
+    def _text_counters(self, prefix: str, text: str) -> Dict[str, int]:
+        counters = {prefix + "_chars": len(text)}
+        if self.count_tokens is not None:
+            counters[prefix + "_tokens"] = self.count_tokens(text)
+        return counters
+
+    def on_retriever_start(self, serialized, query, *, run_id, **kwargs) -> None:
+        self._start(run_id, "retrieval")
+
+    @staticmethod
+    def _documents_counters(documents) -> Dict[str, int]:
+        return {
+            "chunks": len(documents),
+            "chunk_chars": sum(len(doc.page_content) for doc in documents),
+        }
+
+    def on_retriever_end(self, documents, *, run_id, **kwargs) -> None:
+        self._end(run_id, **self._documents_counters(documents))
+
+    def on_retriever_error(self, error, *, run_id, **kwargs) -> None:
+        self._end(run_id, error)
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs) -> None:
+        self._start(run_id, "llm")
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs) -> None:
+        self._start(run_id, "llm")
+
+    def on_llm_new_token(self, token, *, run_id, **kwargs) -> None:
+        with self.lock:
+            item = self.runs.get(run_id)
+            if item is not None and "first_token_s" not in item[0].attributes:
+                item[0].attributes["first_token_s"] = time.perf_counter() - item[1]
+
+    def on_llm_end(self, response, *, run_id, **kwargs) -> None:
+        text = "".join(
+            generation.text
+            for generations in response.generations
+            for generation in generations
+        )
+        self._end(run_id, **self._text_counters("answer", text))
+
+    def on_llm_error(self, error, *, run_id, **kwargs) -> None:
+        self._end(run_id, error)
+
+    def on_chain_start(self, serialized, inputs, *, run_id, **kwargs) -> None:
+        name = kwargs.get("name") or (serialized or {}).get("name") or ""
+        if name in self.CHAIN_STAGES:
+            self._start(run_id, self.CHAIN_STAGES[name])
+        elif name.endswith("PromptTemplate"):
+            self._start(run_id, "prompt")
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs) -> None:
+        if run_id not in self.runs:
+            return
+        if hasattr(outputs, "to_string"):
+            self._end(run_id, **self._text_counters("prompt", outputs.to_string()))
+        elif isinstance(outputs, str):
+            self._end(run_id, **self._text_counters("context", outputs))
+        elif isinstance(outputs, list):
+            self._end(run_id, **self._documents_counters(outputs))
+        else:
+            self._end(run_id)
+
+    def on_chain_error(self, error, *, run_id, **kwargs) -> None:
+        self._end(run_id, error)
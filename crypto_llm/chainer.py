@@ -1,11 +1,22 @@
+import asyncio
+import hashlib
 import os
 import logging
-from typing import List, Any
-from langchain.schema import StrOutputParser
-from langchain_core.runnables import RunnablePassthrough
-from crypto_llm.vectorizer import FAISSVectorizer
-from crypto_llm.prompter import QuestionPrompter, SummaryPrompter
-from crypto_llm.model import NvidiaModel
+import threading
+import weakref
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Any, Dict, Iterator, List, Optional
+from crypto_llm.cache import AnswerCache
+from crypto_llm.ingestion import PREPARING_MESSAGE, IngestionQueue
+from crypto_llm.metrics import Span, get_tracer
+from crypto_llm.packer import ContextPacker, PackedContext, estimate_tokens
+from crypto_llm.summaries import SummaryKey, SummaryStore, whitepaper_digest
+
+if TYPE_CHECKING:
+    from crypto_llm.vectorizer import FAISSVectorizer
+
+# langchain, faiss и клиенты NVIDIA импортируются при первом использовании:
+# ответ из кэша саммари не должен их загружать
 
 logging.basicConfig(
     level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
@@ -13,26 +24,333 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
+@dataclass
+class PreparedChain:
+    """
+    Outcome of the steps before the LLM call: the chain to call, or the
+    answer if no call is needed.
+    """
+
+    chain: Any = None
+    answer: Optional[str] = None
+    # эмбеддинг вопроса и версия индекса для кэша ответов
+    embedding: Optional[List[float]] = None
+    version: Optional[str] = None
+
+
+@dataclass(frozen=True)
+class SummaryConfig:
+    """
+    How summaries are generated and cached.
+
+    Attributes:
+        mode (str): "stuff" puts the chunks into one summary prompt,
+            "map_reduce" summarizes batches of chunks in parallel and then
+            summarizes the partial summaries
+        context_tokens (int): token budget of the context of a "stuff" summary
+        batch_tokens (int): token budget of one map_reduce batch
+        parallelism (int): max number of parallel map calls
+        ttl (float, optional): lifetime of a cached summary in seconds, None
+            for no limit
+        cache_size (int, optional): max number of cached summaries, None for
+            no limit
+    """
+
+    mode: str = "stuff"
+    context_tokens: int = 16000
+    batch_tokens: int = 4000
+    parallelism: int = 4
+    ttl: Optional[float] = None
+    cache_size: Optional[int] = None
+
+    def __post_init__(self):
+        if self.mode not in ("stuff", "map_reduce"):
+            raise ValueError(f"Unknown summary mode: {self.mode}")
+
+
+@dataclass(frozen=True)
+class RetrievalConfig:
+    """
+    How the context of a question is retrieved.
+
+    Attributes:
+        mode (str): "vector", "lexical" (BM25 only, the question is not
+            embedded and the answer cache is skipped) or "hybrid"
+        k (int): number of chunks retrieved for a question
+        context_tokens (int): token budget of the context of a question
+    """
+
+    mode: str = "vector"
+    k: int = 8
+    context_tokens: int = 3000
+
+    def __post_init__(self):
+        if self.mode not in ("vector", "lexical", "hybrid"):
+            raise ValueError(f"Unknown retrieval mode: {self.mode}")
+
+
 class LlmChainer:
     def __init__(
         self,
         llm_name: str = "meta/llama-3.1-405b-instruct",
+        max_concurrency: int = 32,
+        request_timeout: float = 180,
+        llm=None,
+        vectorizer: "FAISSVectorizer" = None,
+        summary: SummaryConfig = None,
+        retrieval: RetrievalConfig = None,
+        answer_cache: AnswerCache = None,
+        log_payloads: bool = False,
+        lazy: bool = False,
+        background_ingestion: bool = False,
+        ingestion_workers: int = 2,
     ):
+        """
+        Args:
+            llm: chat model to use instead of the NVIDIA model
+            vectorizer (FAISSVectorizer): vectorizer to use instead of a new one
+            summary (SummaryConfig, optional): summary settings
+            retrieval (RetrievalConfig, optional): retrieval settings
+            answer_cache (AnswerCache, optional): semantic cache of answers to
+                use instead of a default one
+            log_payloads (bool): log questions, prompts and answers in full,
+                otherwise only their length is logged
+            lazy (bool): create the vectorizer and the LLM client on first use,
+                so that the start and answers from the summary cache don't
+                load FAISS and the NVIDIA clients
+            background_ingestion (bool): index whitepapers that are not
+                indexed yet in a background queue; until then run_chain
+                returns PREPARING_MESSAGE instead of waiting
+            ingestion_workers (int): worker threads of the ingestion queue
+        """
+        self.summary = summary or SummaryConfig()
+        self.retrieval = retrieval or RetrievalConfig()
         self.summary_path = os.getenv("DATA_PATH") + "summaries/"
-        self.vectorizer = FAISSVectorizer()
-        self.llm = NvidiaModel(llm_name).get_model()
+        self.whitepaper_path = os.getenv("DATA_PATH") + "sources/whitepapers/"
+        self.embedding_path = os.getenv("DATA_PATH") + "embeddings/"
+        self.summary_store = SummaryStore(
+            self.summary_path + "summaries.sqlite",
+            ttl=self.summary.ttl,
+            max_entries=self.summary.cache_size,
+        )
+        self.max_concurrency = max_concurrency
+        # семафор привязывается к event loop при первом использовании
+        self._semaphores = weakref.WeakKeyDictionary()
+        self.request_timeout = request_timeout
+        self.llm_name = llm_name
+        self.lazy = lazy
+        self._init_lock = threading.Lock()
+        self._vectorizer = vectorizer
+        self._llm = llm
+        # имя модели для ключа кэша саммари, не создавая клиента
+        self.model_name = self.llm_model_name(llm) if llm else llm_name
+        self.answer_cache = answer_cache or AnswerCache()
+        self.log_payloads = log_payloads
+        self.packer = ContextPacker(max_tokens=self.retrieval.context_tokens)
+        self.tracer = get_tracer()
+        self.ingestion = None
+        if background_ingestion:
+            self.ingestion = IngestionQueue(
+                self.ingest,
+                os.getenv("DATA_PATH") + "jobs/ingestion.sqlite",
+                ready=self.index_exists,
+                workers=ingestion_workers,
+            )
+            # задачи, поставленные до перезапуска, продолжаются сразу
+            self.ingestion.start()
+        if not lazy:
+            self.load()
         logger.info("LlmChainer initialized with retriever and LLM.")
 
+    def load(self) -> None:
+        """
+        Creates the vectorizer and the LLM client right away instead of on
+        first use.
+        """
+        self.vectorizer.load()
+        self._llm = self.llm
+
+    @property
+    def vectorizer(self) -> "FAISSVectorizer":
+        if self._vectorizer is None:
+            with self._init_lock:
+                if self._vectorizer is None:
+                    from crypto_llm.vectorizer import FAISSVectorizer
+
+                    self._vectorizer = FAISSVectorizer(lazy=self.lazy)
+        return self._vectorizer
+
+    @vectorizer.setter
+    def vectorizer(self, vectorizer: "FAISSVectorizer") -> None:
+        self._vectorizer = vectorizer
+
+    @property
+    def llm(self):
+        if self._llm is None:
+            with self._init_lock:
+                if self._llm is None:
+                    from crypto_llm.model import NvidiaModel
+
+                    self._llm = NvidiaModel(self.llm_name).get_model()
+        return self._llm
+
+    @llm.setter
+    def llm(self, llm) -> None:
+        self._llm = llm
+        self.model_name = self.llm_model_name(llm)
+
     @staticmethod
-    def format_docs(docs: List[Any]) -> str:
-        formatted_docs = "\n\n".join([d.page_content for d in docs])
+    def llm_model_name(llm) -> str:
+        return getattr(llm, "model", None) or type(llm).__name__
+
+    def pack_docs(self, docs: List[Any], **kwargs) -> PackedContext:
+        """
+        Packs retrieved chunks with the context packer and reports the saved
+        tokens on the current span.
+        """
+        packed = self.packer.pack(docs, **kwargs)
+        logger.info(
+            "Packed %d of %d chunks into %d tokens, %d tokens saved",
+            packed.chunks,
+            len(docs),
+            packed.tokens,
+            packed.tokens_saved,
+        )
+        span = self.tracer.current()
+        if span is not None:
+            span.set(
+                context_tokens=packed.tokens,
+                context_tokens_saved=packed.tokens_saved,
+                chunks_packed=packed.chunks,
+                chunks_dropped=packed.dropped + packed.duplicates,
+            )
+        return packed
+
+    def format_docs(self, docs: List[Any]) -> str:
+        formatted_docs = self.pack_docs(docs).text
         logger.debug("Formatted documents: %s", formatted_docs)
         return formatted_docs
 
-    def create_chain(self, retriever, prompt):
+    def format_summary_docs(self, docs: List[Any]) -> str:
+        docs = self.sample_docs(docs, self.summary.context_tokens)
+        return self.pack_docs(
+            docs, max_tokens=self.summary.context_tokens, order="document"
+        ).text
+
+    @staticmethod
+    def sample_docs(docs: List[Any], max_tokens: int) -> List[Any]:
+        """
+        Takes evenly spaced chunks of a whitepaper, in document order, that
+        fit into `max_tokens`, so a summary covers the whole document rather
+        than its first pages.
+        """
+        total = sum(estimate_tokens(doc.page_content) for doc in docs)
+        if total <= max_tokens:
+            return docs
+        n = max(1, len(docs) * max_tokens // total)
+        return [docs[i * len(docs) // n] for i in range(n)]
+
+    def log_payload(self, message: str, payload: Any) -> None:
+        if self.log_payloads:
+            logger.info(message, payload)
+        else:
+            logger.info(message, f"<{len(str(payload))} chars>")
+
+    def run_config(self) -> dict:
+        """
+        Config of a chain call that records its stages as spans.
+        """
+        from crypto_llm.callbacks import SpanCallbackHandler
+
+        parent = self.tracer.current()
+        handler = SpanCallbackHandler(
+            self.tracer, parent.name if parent else None, estimate_tokens
+        )
+        return {"callbacks": [handler]}
+
+    def batch_texts(self, texts: List[str]) -> List[List[str]]:
+        """
+        Groups texts into batches that fit into `summary.batch_tokens`.
+        """
+        batches, batch, batch_tokens = [], [], 0
+        for text in texts:
+            tokens = estimate_tokens(text)
+            if batch and batch_tokens + tokens > self.summary.batch_tokens:
+                batches.append(batch)
+                batch, batch_tokens = [], 0
+            batch.append(text)
+            batch_tokens += tokens
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def truncate_texts(self, texts: List[str], separator: str = "\n\n") -> List[str]:
+        """
+        Cuts every text to an equal share of `summary.batch_tokens`, so that
+        the joined texts fit into one batch and still cover the whole document.
+        """
+        joined = separator.join(texts)
+        chars_per_token = len(joined) / estimate_tokens(joined)
+        chars = int(self.summary.batch_tokens * chars_per_token)
+        share = max(0, chars - len(separator) * (len(texts) - 1)) // len(texts)
+        return [text[:share] for text in texts]
+
+    def map_summaries(self, docs: List[Any]) -> str:
+        """
+        Map step of map_reduce summarization: summarizes token-budgeted batches
+        of chunks in parallel until the partial summaries fit into one batch.
+        Chunks that already fit into one batch are returned as is. If the
+        partial summaries are too long to be grouped into fewer batches, they
+        are truncated instead of being summarized again.
+
+        Returns:
+            str: partial summaries, the context for the final SummaryPrompter call
+        """
+        # чанки идут в порядке текста, а не в порядке релевантности
+        from langchain_core.output_parsers import StrOutputParser
+        from crypto_llm.prompter import MapSummaryPrompter
+
+        texts = self.pack_docs(docs, max_tokens=None, order="document").fragments
+        map_chain = MapSummaryPrompter().get_prompt() | self.llm | StrOutputParser()
+        rounds = 0
+        while estimate_tokens("\n\n".join(texts)) > self.summary.batch_tokens:
+            batches = self.batch_texts(texts)
+            # каждый текст занимает батч целиком: новый раунд не сократит их число
+            if rounds and len(batches) >= len(texts):
+                logger.warning(
+                    "Partial summaries don't fit into %d tokens after %d rounds, "
+                    "truncating %d texts",
+                    self.summary.batch_tokens,
+                    rounds,
+                    len(texts),
+                )
+                texts = self.truncate_texts(texts)
+                break
+            logger.info("Summarizing %d batches of %d texts", len(batches), len(texts))
+            texts = map_chain.batch(
+                [{"context": "\n\n".join(batch)} for batch in batches],
+                config={"max_concurrency": self.summary.parallelism},
+            )
+            rounds += 1
+            if len(batches) == 1:
+                break
+        return "\n\n".join(texts)
+
+    def create_chain(self, retriever, prompt, is_summary: bool = False):
+        from langchain_core.output_parsers import StrOutputParser
+        from langchain_core.runnables import RunnableLambda, RunnablePassthrough
+
         logger.info("Creating chain.")
+        if is_summary and self.summary.mode == "map_reduce":
+            context = retriever | self.map_summaries
+        elif is_summary:
+            context = retriever | RunnableLambda(
+                self.format_summary_docs, name="format_docs"
+            )
+        else:
+            context = retriever | self.format_docs
         chain = (
-            {"context": retriever | self.format_docs, "question": RunnablePassthrough()}
+            {"context": context, "question": RunnablePassthrough()}
             | prompt
             | self.llm
             | StrOutputParser()
@@ -40,43 +358,355 @@ class LlmChainer:
         logger.info("Chain created.")
         return chain
 
+    def summary_prompt(self):
+        from crypto_llm.prompter import SummaryPrompter
+
+        return SummaryPrompter().get_prompt()
+
+    def question_prompt(self):
+        from crypto_llm.prompter import QuestionPrompter
+
+        return QuestionPrompter().get_prompt()
+
+    def summary_prompt_hash(self) -> str:
+        """
+        Hash of everything in the summary prompt that changes the result.
+        """
+        from crypto_llm.prompter import MapSummaryPrompter, SummaryPrompter
+
+        parts = [self.summary.mode, SummaryPrompter.template_hash()]
+        if self.summary.mode == "map_reduce":
+            parts.append(MapSummaryPrompter.template_hash())
+        return hashlib.sha1("\n".join(parts).encode()).hexdigest()
+
+    def summary_key(self, currency_name: str) -> SummaryKey:
+        # путь хранилища чанков тот же, что у WhitePaperLoader.chunks_path
+        return SummaryKey(
+            currency=currency_name,
+            whitepaper=whitepaper_digest(
+                self.whitepaper_path + currency_name + ".chunks"
+            ),
+            prompt=self.summary_prompt_hash(),
+            model=self.model_name,
+        )
+
     def check_summary_exists(self, currency_name: str) -> bool:
         logger.info("Checking if summary exists for: %s", currency_name)
-        return os.path.exists(self.summary_path + currency_name + ".txt")
+        return self.cached_summary(currency_name) is not None
 
     def get_summary(self, currency_name: str) -> str:
         logger.info("Getting summary for: %s", currency_name)
-        with open(self.summary_path + currency_name + ".txt", "r") as f:
-            return f.read()
+        return self.cached_summary(currency_name)
+
+    def cached_summary(self, currency_name: str) -> Optional[str]:
+        key = self.summary_key(currency_name)
+        summary = self.summary_store.get(key)
+        if summary is None:
+            summary = self.import_legacy_summary(key)
+        return summary
+
+    def cached_summaries(self, currency_names: List[str]) -> Dict[str, str]:
+        """
+        Reads the cached summaries of many currencies with one query.
+
+        Returns:
+            Dict[str, str]: summary by currency name, for the cached ones
+        """
+        return self.summary_store.get_many(
+            [self.summary_key(name) for name in currency_names]
+        )
+
+    def import_legacy_summary(self, key: SummaryKey) -> Optional[str]:
+        """
+        Moves a summary saved by older versions as summaries/<name>.txt into
+        the summary store under the current key. The key needs the version of
+        the whitepaper, so a whitepaper pickled by older versions is converted
+        to a chunk store first, and without any whitepaper the summary waits
+        until it is ingested.
+        """
+        legacy_path = self.summary_path + key.currency + ".txt"
+        if not os.path.exists(legacy_path):
+            return None
+        if not key.whitepaper:
+            if not os.path.exists(self.whitepaper_path + key.currency + ".pkl"):
+                return None
+            from crypto_llm.loader import WhitePaperLoader
+
+            WhitePaperLoader().load_info(key.currency)
+            key = self.summary_key(key.currency)
+        with open(legacy_path, "r") as f:
+            summary = f.read()
+        self.summary_store.put(key, summary)
+        os.remove(legacy_path)
+        logger.info("Moved %s to the summary store", legacy_path)
+        return summary
 
     def save_summary(self, currency_name: str, summary: str) -> None:
         logger.info("Saving summary for: %s", currency_name)
-        with open(self.summary_path + currency_name + ".txt", "w") as f:
-            f.write(summary)
+        self.summary_store.put(self.summary_key(currency_name), summary)
 
-    def run_chain(
-        self, currency_name: str, question: str = " ", is_summary: bool = False
-    ) -> str:
-        logger.info("Running chain with question: %s", question)
+    def index_exists(self, currency_name: str) -> bool:
+        # проверка по файлам, чтобы ответ о подготовке не загружал faiss
+        if os.path.exists(self.embedding_path + currency_name):
+            return True
+        # общий индекс проверяем, только если векторизатор уже создан
+        vectorizer = self._vectorizer
+        return vectorizer is not None and vectorizer.in_global_index(currency_name)
+
+    def ingest(self, currency_name: str) -> bool:
+        vectorizer = self.vectorizer
+        if vectorizer.in_global_index(currency_name):
+            return True
+        return vectorizer.calc_and_save_embedding(currency_name)
+
+    def ingestion_status(self, currency_name: str, count_request: bool = True) -> str:
+        """
+        Queues the ingestion of a whitepaper that is not indexed yet and
+        counts the request towards the prefetched currencies.
+
+        Args:
+            currency_name (str): the currency
+            count_request (bool): False if the user action is counted by a
+                later chain call
+
+        Returns:
+            str: "ready" if the currency can be answered (always without
+                background ingestion), "queued" or "running" while its
+                whitepaper is prepared, "failed" if it could not be ingested
+        """
+        if self.ingestion is None:
+            return "ready"
+        return self.ingestion.submit(currency_name, count=count_request)
+
+    def poll_ingestion(self, currency_name: str) -> Optional[str]:
+        """
+        Status of a queued whitepaper for the UI to poll: unlike
+        ingestion_status() it neither queues nor counts anything.
+
+        Returns:
+            Optional[str]: the statuses of ingestion_status(), None if the
+                currency was never queued
+        """
+        if self.ingestion is None:
+            return "ready"
+        status = self.ingestion.status(currency_name)
+        return "ready" if status == "done" else status
+
+    def prefetch(self, currency_names: List[str] = None, top: int = 20) -> Dict:
+        """
+        Queues whitepapers before they are asked about: the most requested
+        currencies first, then those at the top of pdf_correct_names.csv.
+
+        Args:
+            currency_names (List[str], optional): currencies to prefetch
+                instead of the top ones
+            top (int): number of currencies to prefetch
+
+        Returns:
+            Dict[str, int]: number of currencies by status
+        """
+        if self.ingestion is None:
+            raise ValueError("Prefetch needs background_ingestion=True")
+        if currency_names is None:
+            names = self.ingestion.most_requested(top)
+            names += self.vectorizer.storage.show_all_currency_names()
+            currency_names = list(dict.fromkeys(names))[:top]
+        return self.ingestion.prefetch(currency_names)
+
+    def lookup_answer(self, currency_name: str, question: str):
+        """
+        Looks up an answer to a similar question in the answer cache.
+
+        Returns:
+            Tuple: cached answer or None, question embedding or None if the
+                question was not embedded, index version.
+        """
+        version = self.vectorizer.index_version(currency_name)
+        if self.retrieval.mode == "lexical":
+            return None, None, version
+        if self.retrieval.mode == "hybrid":
+            # при недоступном эмбеддере отвечаем без кэша, поиск пойдет по BM25
+            embedding = self.vectorizer.embed_query(question)
+            if embedding is None:
+                return None, None, version
+        else:
+            embedding = self.vectorizer.embedder.embed_query(question)
+        answer = self.answer_cache.get(currency_name, embedding, version)
+        return answer, embedding, version
+
+    def _prepare_chain(
+        self, currency_name: str, question: str, is_summary: bool, span: Span
+    ) -> PreparedChain:
+        """
+        Steps shared by run_chain, stream_chain and arun_chain before the LLM
+        call: the summary cache, the ingestion status, the retriever, the
+        answer cache and the chain. Sets the outcome on `span` if the answer
+        needs no LLM call.
+        """
+        if is_summary:
+            with self.tracer.span("summary_cache"):
+                summary = self.cached_summary(currency_name)
+            if summary is not None:
+                span.set(outcome="cached")
+                return PreparedChain(answer=summary)
+        status = self.ingestion_status(currency_name)
+        if status != "ready":
+            span.set(outcome=status)
+            return PreparedChain(
+                answer=PREPARING_MESSAGE if status != "failed" else None
+            )
         retriever = self.vectorizer.get_retriever(
-            name=currency_name, is_summary=is_summary
+            name=currency_name,
+            is_summary=is_summary,
+            k=self.retrieval.k,
+            mode=self.retrieval.mode,
         )
         if not retriever:
             logger.warning("Retriever not found for: %s", currency_name)
-            return None
+            span.set(outcome="not_found")
+            return PreparedChain()
+        embedding = version = None
         if is_summary:
-            if self.check_summary_exists(currency_name):
-                return self.get_summary(currency_name)
-            prompt = SummaryPrompter().get_prompt()
+            prompt = self.summary_prompt()
         else:
-            prompt = QuestionPrompter().get_prompt()
-        logger.info("Running chain with prompt: %s", prompt)
-        chain = self.create_chain(retriever, prompt)
-        result = chain.invoke(question)
-        logger.info("Chain run completed with result: %s", result)
+            with self.tracer.span("answer_cache"):
+                cached, embedding, version = self.lookup_answer(currency_name, question)
+            if cached is not None:
+                span.set(outcome="cached")
+                return PreparedChain(answer=cached)
+            prompt = self.question_prompt()
+        chain = self.create_chain(retriever, prompt, is_summary)
+        return PreparedChain(chain, embedding=embedding, version=version)
+
+    def _finish_chain(
+        self,
+        currency_name: str,
+        is_summary: bool,
+        prepared: PreparedChain,
+        result: str,
+        span: Span,
+    ) -> None:
+        """
+        Saves a generated summary or answer to its cache.
+        """
+        span.set(outcome="generated")
         if is_summary:
             self.save_summary(currency_name, result)
-        return result
+        elif prepared.embedding is not None:
+            self.answer_cache.put(
+                currency_name, prepared.embedding, result, prepared.version
+            )
+
+    def run_chain(
+        self, currency_name: str, question: str = " ", is_summary: bool = False
+    ) -> str:
+        with self.tracer.span("run_chain", is_summary=is_summary) as span:
+            self.log_payload("Running chain with question: %s", question)
+            prepared = self._prepare_chain(currency_name, question, is_summary, span)
+            if prepared.chain is None:
+                return prepared.answer
+            result = prepared.chain.invoke(question, config=self.run_config())
+            self.log_payload("Chain run completed with result: %s", result)
+            self._finish_chain(currency_name, is_summary, prepared, result, span)
+            return result
+
+    def stream_chain(
+        self, currency_name: str, question: str = " ", is_summary: bool = False
+    ) -> Iterator[str]:
+        """
+        Streaming version of run_chain: yields the answer token by token.
+        A generated summary is saved to the cache once the stream is finished.
+
+        Args:
+            currency_name (str): The name of the currency.
+            question (str, optional): The question to answer.
+            is_summary (bool, optional): Generate a summary instead of an answer.
+
+        Yields:
+            str: answer tokens, or the whole cached summary at once.
+        """
+        with self.tracer.span("stream_chain", is_summary=is_summary) as span:
+            self.log_payload("Streaming chain with question: %s", question)
+            prepared = self._prepare_chain(currency_name, question, is_summary, span)
+            if prepared.chain is None:
+                if prepared.answer is not None:
+                    yield prepared.answer
+                return
+            tokens = []
+            for token in prepared.chain.stream(question, config=self.run_config()):
+                tokens.append(token)
+                yield token
+            result = "".join(tokens)
+            self.log_payload("Chain stream completed with result: %s", result)
+            self._finish_chain(currency_name, is_summary, prepared, result, span)
+
+    async def arun_chain(
+        self,
+        currency_name: str,
+        question: str = " ",
+        is_summary: bool = False,
+        timeout: float = None,
+    ) -> str:
+        """
+        Async version of run_chain. At most `max_concurrency` requests run at
+        once, the rest wait for a free slot.
+
+        Args:
+            currency_name (str): The name of the currency.
+            question (str, optional): The question to answer.
+            is_summary (bool, optional): Generate a summary instead of an answer.
+            timeout (float, optional): Seconds to wait for the answer, including
+                the wait for a free slot. Defaults to `request_timeout`.
+
+        Returns:
+            str: The answer, None if there is no whitepaper for the currency,
+                or PREPARING_MESSAGE while it is ingested in background.
+
+        Raises:
+            asyncio.TimeoutError: if the answer is not ready in time.
+        """
+        return await asyncio.wait_for(
+            self._arun_chain(currency_name, question, is_summary),
+            timeout or self.request_timeout,
+        )
+
+    def semaphore(self) -> asyncio.Semaphore:
+        """
+        Limit of concurrent arun_chain calls in the running event loop.
+        """
+        loop = asyncio.get_running_loop()
+        with self._init_lock:
+            semaphore = self._semaphores.get(loop)
+            if semaphore is None:
+                semaphore = asyncio.Semaphore(self.max_concurrency)
+                self._semaphores[loop] = semaphore
+        return semaphore
+
+    async def _arun_chain(
+        self, currency_name: str, question: str, is_summary: bool
+    ) -> str:
+        async with self.semaphore():
+            with self.tracer.span("arun_chain", is_summary=is_summary) as span:
+                self.log_payload("Running async chain with question: %s", question)
+                # поиск индекса может скачивать и эмбеддить whitepaper, не блокируем loop
+                prepared = await asyncio.to_thread(
+                    self._prepare_chain, currency_name, question, is_summary, span
+                )
+                if prepared.chain is None:
+                    return prepared.answer
+                result = await prepared.chain.ainvoke(
+                    question, config=self.run_config()
+                )
+                self.log_payload("Async chain run completed with result: %s", result)
+                await asyncio.to_thread(
+                    self._finish_chain,
+                    currency_name,
+                    is_summary,
+                    prepared,
+                    result,
+                    span,
+                )
+                return result
 
 
 # Пример использования класса LlmChainer
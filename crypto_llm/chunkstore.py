@@ -0,0 +1,363 @@
+import hashlib
+import json
+import logging
+import mmap
+import os
+import re
+import shutil
+import tempfile
+import threading
+from collections import defaultdict
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+import numpy as np
+from langchain_community.docstore.base import AddableMixin, Docstore
+from langchain_core.documents import Document
+from crypto_llm.cache import StaleIndexError
+from crypto_llm.locks import path_lock
+
+logging.basicConfig(
+    level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+)
+logger = logging.getLogger(__name__)
+
+CURRENT_FILE = "CURRENT"
+
+_version_re = re.compile(r"^[0-9a-f]{40}$")
+
+
+def chunk_ids(docs: Iterable[Document]) -> List[str]:
+    """
+    Content-addressed chunk ids: hash of the chunk text plus the number of
+    the occurrence, so repeated chunks in one whitepaper keep distinct ids.
+    """
+    seen = defaultdict(int)
+    return [_chunk_id(doc.page_content, seen) for doc in docs]
+
+
+def _chunk_id(text: str, seen: Dict[str, int]) -> str:
+    digest = hashlib.sha1(text.encode()).hexdigest()
+    chunk_id = f"{digest}-{seen[digest]}"
+    seen[digest] += 1
+    return chunk_id
+
+
+class ChunkStore:
+    """
+    Read-only store of text chunks in a compact memory-mapped format.
+
+    A store is a directory with `text.bin`, the UTF-8 texts of all chunks
+    written back to back, `offsets.npy`, the byte range and metadata number
+    of every chunk, `meta.json` with the chunk ids and the distinct
+    metadata dicts, and `digest`, the sha1 of `meta.json`. Texts are decoded
+    only when a chunk is requested, so an open store keeps just its id table
+    in memory.
+
+    The chunks of a whitepaper are kept in versions: `<name>.chunks/<digest>/`
+    is a store and `<name>.chunks/CURRENT` names the latest one. A new
+    version does not replace the files an existing index refers to, old
+    versions are removed by prune() once no index needs them. Stores written
+    before versioning sit directly in `<name>.chunks/`.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(os.path.join(path, "meta.json"), "r") as fp:
+            meta = json.load(fp)
+        self.ids: List[str] = meta["ids"]
+        self.metadata: List[Dict] = meta["metadata"]
+        self.positions = {chunk_id: i for i, chunk_id in enumerate(self.ids)}
+        self.offsets = np.load(os.path.join(path, "offsets.npy"), mmap_mode="r")
+        self._text = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def write(
+        cls, path: str, docs: Iterable[Document], ids: List[str] = None
+    ) -> "ChunkStore":
+        """
+        Writes chunks to a new store, replacing the store in `path` atomically.
+
+        Args:
+            path (str): directory of the store
+            docs (Iterable[Document]): the chunks, consumed one at a time
+            ids (List[str], optional): chunk ids, defaults to chunk_ids(docs)
+
+        Returns:
+            ChunkStore: the written store
+        """
+        with ChunkStoreWriter(path) as writer:
+            if ids is None:
+                writer.add(docs)
+            else:
+                docs, ids = list(docs), list(ids)
+                if len(ids) != len(docs):
+                    raise ValueError("Number of ids does not match number of chunks")
+                writer.add(docs, ids)
+            return writer.commit()
+
+    @classmethod
+    def open(cls, path: str) -> "ChunkStore":
+        """
+        Opens the current version of the store in `path`.
+        """
+        return cls(cls.current_path(path) or path)
+
+    @staticmethod
+    def current_path(path: str) -> Optional[str]:
+        """
+        Returns:
+            Optional[str]: directory of the current version of the store in
+                `path`, None if there is no store
+        """
+        try:
+            with open(os.path.join(path, CURRENT_FILE), "r") as fp:
+                return os.path.join(path, fp.read().strip())
+        except FileNotFoundError:
+            pass
+        if os.path.exists(os.path.join(path, "meta.json")):
+            return path
+        return None
+
+    @classmethod
+    def exists(cls, path: str) -> bool:
+        return cls.current_path(path) is not None
+
+    @classmethod
+    def prune(cls, keep: str) -> int:
+        """
+        Deletes the versions of a store except the current one and `keep`,
+        the version an index refers to.
+
+        Args:
+            keep (str): directory of a version, or the store itself for a
+                store written before versioning
+
+        Returns:
+            int: number of deleted versions
+        """
+        keep = os.path.normpath(keep)
+        is_version = _version_re.match(os.path.basename(keep))
+        root = os.path.dirname(keep) if is_version else keep
+        deleted = 0
+        with path_lock(root):
+            kept = {keep, os.path.normpath(cls.current_path(root) or keep)}
+            for name in os.listdir(root):
+                version_path = os.path.join(root, name)
+                if _version_re.match(name) and version_path not in kept:
+                    shutil.rmtree(version_path, ignore_errors=True)
+                    deleted += 1
+            if root not in kept and os.path.exists(os.path.join(root, "meta.json")):
+                # хранилище до версионирования лежит прямо в корне
+                for name in ("meta.json", "offsets.npy", "text.bin", "digest"):
+                    if os.path.exists(os.path.join(root, name)):
+                        os.remove(os.path.join(root, name))
+                deleted += 1
+        return deleted
+
+    def _buffer(self):
+        if self._text is None:
+            with self._lock:
+                if self._text is None:
+                    with open(os.path.join(self.path, "text.bin"), "rb") as fp:
+                        # пустой файл нельзя отобразить в память
+                        if os.fstat(fp.fileno()).st_size == 0:
+                            self._text = b""
+                        else:
+                            self._text = mmap.mmap(
+                                fp.fileno(), 0, access=mmap.ACCESS_READ
+                            )
+        return self._text
+
+    def pin(self) -> "ChunkStore":
+        """
+        Maps the texts into memory right away instead of on first read. The
+        mapped files stay readable after prune() deletes the version.
+        """
+        self._buffer()
+        return self
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __contains__(self, chunk_id: str) -> bool:
+        return chunk_id in self.positions
+
+    def __getitem__(self, position: int) -> Document:
+        start, end, metadata_id = (int(value) for value in self.offsets[position])
+        return Document(
+            id=self.ids[position],
+            page_content=self._buffer()[start:end].decode("utf-8"),
+            metadata=dict(self.metadata[metadata_id]),
+        )
+
+    def __iter__(self) -> Iterator[Document]:
+        for position in range(len(self.ids)):
+            yield self[position]
+
+    def get(self, chunk_id: str) -> Optional[Document]:
+        position = self.positions.get(chunk_id)
+        return None if position is None else self[position]
+
+    def documents(self) -> List[Document]:
+        return list(self)
+
+    def batches(self, size: int) -> Iterator[Tuple[List[str], List[Document]]]:
+        """
+        Yields the ids and the chunks of the store, `size` chunks at a time.
+        """
+        for start in range(0, len(self.ids), size):
+            end = min(start + size, len(self.ids))
+            yield self.ids[start:end], [self[i] for i in range(start, end)]
+
+
+class ChunkStoreWriter:
+    """
+    Writes a new ChunkStore batch by batch: texts go straight to disk and only
+    the id and offset tables are kept in memory. The store becomes the
+    current version of the store in `path` on commit(); leaving the `with`
+    block without a commit discards what was written.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        # у каждого писателя своя временная папка: параллельная запись той же
+        # монеты не удаляет чужие файлы
+        os.makedirs(path, exist_ok=True)
+        self.tmp_path = tempfile.mkdtemp(dir=path, prefix=".", suffix=".tmp")
+        self.ids: List[str] = []
+        self.offsets: List[Tuple[int, int, int]] = []
+        self.metadata: List[Dict] = []
+        self._metadata_ids: Dict[str, int] = {}
+        self._seen: Dict[str, int] = defaultdict(int)
+        self._position = 0
+        self._text = open(os.path.join(self.tmp_path, "text.bin"), "wb")
+
+    def __enter__(self) -> "ChunkStoreWriter":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        if not self._text.closed:
+            self.abort()
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def add(self, docs: Iterable[Document], ids: List[str] = None) -> List[str]:
+        """
+        Appends chunks to the store.
+
+        Args:
+            docs (Iterable[Document]): the chunks
+            ids (List[str], optional): chunk ids, by default content-addressed
+                as in chunk_ids, counting the chunks added before
+
+        Returns:
+            List[str]: ids of the added chunks
+        """
+        added = []
+        for i, doc in enumerate(docs):
+            chunk_id = (
+                _chunk_id(doc.page_content, self._seen) if ids is None else ids[i]
+            )
+            data = doc.page_content.encode("utf-8")
+            self._text.write(data)
+            # метаданные чанков одной страницы совпадают, храним их один раз
+            key = json.dumps(doc.metadata, sort_keys=True, default=str)
+            if key not in self._metadata_ids:
+                self._metadata_ids[key] = len(self.metadata)
+                self.metadata.append(json.loads(key))
+            self.offsets.append(
+                (self._position, self._position + len(data), self._metadata_ids[key])
+            )
+            self._position += len(data)
+            self.ids.append(chunk_id)
+            added.append(chunk_id)
+        return added
+
+    def commit(self) -> ChunkStore:
+        self._text.close()
+        offsets = np.array(self.offsets, dtype="int64").reshape(-1, 3)
+        np.save(os.path.join(self.tmp_path, "offsets.npy"), offsets)
+        meta = json.dumps(
+            {"ids": self.ids, "metadata": self.metadata}, ensure_ascii=False
+        ).encode("utf-8")
+        with open(os.path.join(self.tmp_path, "meta.json"), "wb") as fp:
+            fp.write(meta)
+        # версия содержимого: по ней кэш саммари понимает, что whitepaper обновился
+        digest = hashlib.sha1(meta).hexdigest()
+        with open(os.path.join(self.tmp_path, "digest"), "w") as fp:
+            fp.write(digest)
+
+        version_path = os.path.join(self.path, digest)
+        with path_lock(self.path):
+            if os.path.exists(version_path):
+                # такая версия уже записана
+                shutil.rmtree(self.tmp_path, ignore_errors=True)
+            else:
+                os.replace(self.tmp_path, version_path)
+            # указатель на версию меняется атомарно, старые версии остаются
+            current_tmp = os.path.join(self.tmp_path + "." + CURRENT_FILE)
+            with open(current_tmp, "w") as fp:
+                fp.write(digest)
+            os.replace(current_tmp, os.path.join(self.path, CURRENT_FILE))
+        return ChunkStore(version_path)
+
+    def abort(self) -> None:
+        self._text.close()
+        shutil.rmtree(self.tmp_path, ignore_errors=True)
+
+
+class ChunkDocstore(Docstore, AddableMixin):
+    """
+    LangChain docstore backed by a ChunkStore, so a FAISS index refers to the
+    chunks of its whitepaper instead of pickling its own copy of them. The
+    path is that of one version of the store, so rewriting the whitepaper
+    does not change the chunks an existing index finds. The version is opened
+    when the docstore is created or unpickled, so a loaded index keeps
+    reading it after prune(); if it is already gone, StaleIndexError is
+    raised and the index has to be loaded again.
+
+    Documents added under ids the store already has are not copied. Other
+    added documents and deletions are kept in memory and pickled with the
+    docstore, together with the path of the store.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.added: Dict[str, Document] = {}
+        self.deleted = set()
+        try:
+            self.store = ChunkStore(path).pin()
+        except FileNotFoundError:
+            # в другой версии хранилища те же id могут означать другие чанки
+            raise StaleIndexError(f"Chunk store version not found: {path}") from None
+
+    def add(self, texts: Dict[str, Document]) -> None:
+        for chunk_id, doc in texts.items():
+            self.deleted.discard(chunk_id)
+            if chunk_id not in self.store:
+                self.added[chunk_id] = doc
+
+    def delete(self, ids: List) -> None:
+        for chunk_id in ids:
+            self.added.pop(chunk_id, None)
+            if chunk_id in self.store:
+                self.deleted.add(chunk_id)
+
+    def search(self, search: str) -> Union[str, Document]:
+        if search in self.added:
+            return self.added[search]
+        if search not in self.deleted:
+            doc = self.store.get(search)
+            if doc is not None:
+                return doc
+        return f"ID {search} not found."
+
+    def __getstate__(self) -> Dict:
+        return {"path": self.path, "added": self.added, "deleted": self.deleted}
+
+    def __setstate__(self, state: Dict) -> None:
+        self.__init__(state["path"])
+        self.added = state["added"]
+        self.deleted = state["deleted"]
@@ -0,0 +1,226 @@
+import argparse
+import json
+import logging
+import os
+import time
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Tuple
+
+import faiss
+import numpy as np
+
+logging.basicConfig(
+    level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+)
+logger = logging.getLogger(__name__)
+
+INDEX_TYPES = ("flat", "fp16", "ivfpq")
+
+
+def index_type_of(index: faiss.Index) -> str:
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexIVFPQ):
+        return "ivfpq"
+    if isinstance(index, faiss.IndexScalarQuantizer):
+        return "fp16"
+    if isinstance(index, faiss.IndexFlat):
+        return "flat"
+    return type(index).__name__
+
+
+def index_vectors(index: faiss.Index) -> np.ndarray:
+    """
+    Vectors of an index in id order, decoded from the codes for compressed
+    indexes, so they are only approximately the original ones.
+    """
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        # без прямого отображения IVF не находит вектор по id
+        ivf.make_direct_map()
+    return index.reconstruct_n(0, index.ntotal)
+
+
+def index_bytes(index: faiss.Index) -> int:
+    """
+    Size of the index as saved to disk, close to its size in memory.
+    """
+    return len(faiss.serialize_index(index))
+
+
+@dataclass(frozen=True)
+class IndexBuilder:
+    """
+    Creates the FAISS index of a whitepaper from its vectors.
+
+    "flat" keeps the float32 vectors and searches exactly, "fp16" stores them
+    as float16 (half the size, practically the same recall), "ivfpq" splits
+    every vector into `pq_m` parts encoded with one byte each and searches
+    the `nprobe` nearest of `nlist` clusters. IVF-PQ needs training, so
+    documents with fewer than `min_ivfpq_vectors` chunks get "fp16" instead.
+    All types use the L2 distance of FAISS.from_documents.
+    """
+
+    index_type: str = "flat"
+    pq_m: int = 64
+    nlist: int = 1024
+    nprobe: int = 16
+    min_ivfpq_vectors: int = 2048
+
+    def __post_init__(self):
+        if self.index_type not in INDEX_TYPES:
+            raise ValueError(f"Unknown index type: {self.index_type}")
+
+    def build(self, vectors: np.ndarray) -> faiss.Index:
+        vectors = np.ascontiguousarray(vectors, dtype="float32")
+        n, dim = vectors.shape
+        index_type = self.index_type
+        if index_type == "ivfpq" and n < self.min_ivfpq_vectors:
+            logger.info("Too few vectors for IVF-PQ (%d), using fp16", n)
+            index_type = "fp16"
+        if index_type == "flat":
+            index = faiss.IndexFlatL2(dim)
+        elif index_type == "fp16":
+            index = faiss.IndexScalarQuantizer(dim, faiss.ScalarQuantizer.QT_fp16)
+        else:
+            # число частей PQ должно делить размерность
+            pq_m = next(m for m in range(min(self.pq_m, dim), 0, -1) if dim % m == 0)
+            # IVF нельзя обучить на числе векторов меньше числа кластеров
+            nlist = max(1, min(self.nlist, int(np.sqrt(n))))
+            index = faiss.IndexIVFPQ(faiss.IndexFlatL2(dim), dim, nlist, pq_m, 8)
+            index.nprobe = min(self.nprobe, nlist)
+            index.train(vectors)
+        index.add(vectors)
+        return index
+
+
+def recall_at_k(
+    index: faiss.Index, exact: faiss.Index, queries: np.ndarray, k: int
+) -> float:
+    """
+    Share of the exact `k` nearest neighbours that `index` finds.
+    """
+    k = min(k, exact.ntotal)
+    _, expected = exact.search(queries, k)
+    _, found = index.search(queries, k)
+    hits = sum(len(set(e) & set(f)) for e, f in zip(expected, found))
+    return hits / (len(queries) * k) if len(queries) and k else 1.0
+
+
+def recall_report(
+    datasets: Iterable[Tuple[np.ndarray, np.ndarray]],
+    builders: List[IndexBuilder],
+    k: int = 8,
+) -> Dict[str, Dict[str, float]]:
+    """
+    Compares index types on (vectors, held-out queries) pairs, one pair per
+    whitepaper: total size, recall@k against the exact search and the search
+    latency, so the recall lost for the memory saved is visible.
+
+    Returns:
+        Dict: metrics by index type
+    """
+    totals = {
+        b.index_type: {"bytes": 0, "vectors": 0, "hits": 0.0, "queries": 0}
+        for b in builders
+    }
+    search_times = {b.index_type: [] for b in builders}
+    for vectors, queries in datasets:
+        queries = np.ascontiguousarray(queries, dtype="float32")
+        exact = faiss.IndexFlatL2(vectors.shape[1])
+        exact.add(np.ascontiguousarray(vectors, dtype="float32"))
+        for builder in builders:
+            index = builder.build(vectors)
+            total = totals[builder.index_type]
+            total["bytes"] += index_bytes(index)
+            total["vectors"] += len(vectors)
+            if len(queries):
+                start = time.perf_counter()
+                recall = recall_at_k(index, exact, queries, k)
+                search_times[builder.index_type].append(
+                    (time.perf_counter() - start) / len(queries)
+                )
+                total["hits"] += recall * len(queries)
+                total["queries"] += len(queries)
+
+    flat_bytes = max(1, totals.get("flat", {}).get("bytes", 0))
+    report = {}
+    for index_type, total in totals.items():
+        times = search_times[index_type]
+        report[index_type] = {
+            "size_mb": total["bytes"] / 1024**2,
+            "bytes_per_vector": total["bytes"] / max(1, total["vectors"]),
+            "recall": total["hits"] / total["queries"] if total["queries"] else 1.0,
+            "search_ms": 1000 * float(np.mean(times)) if times else 0.0,
+        }
+        if "flat" in totals:
+            report[index_type]["compression"] = flat_bytes / max(1, total["bytes"])
+    return report
+
+
+def holdout_split(
+    vectors: np.ndarray, holdout: float, rng: np.random.Generator
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Takes a `holdout` share of the chunk vectors out of the index to use them
+    as queries that are not in the index themselves.
+    """
+    n_queries = int(len(vectors) * holdout)
+    if len(vectors) - n_queries < 1:
+        return vectors, vectors[:0]
+    order = rng.permutation(len(vectors))
+    return vectors[order[n_queries:]], vectors[order[:n_queries]]
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    from crypto_llm.vectorizer import FAISSVectorizer
+
+    load_dotenv("./.env")
+    parser = argparse.ArgumentParser(description="Convert or compare FAISS indexes")
+    parser.add_argument("command", choices=("convert", "report"))
+    parser.add_argument("names", nargs="*", help="currencies, defaults to all")
+    parser.add_argument("--index-type", choices=INDEX_TYPES, default="fp16")
+    parser.add_argument("--pq-m", type=int, default=64)
+    parser.add_argument("--min-ivfpq-vectors", type=int, default=2048)
+    parser.add_argument("--k", type=int, default=8)
+    parser.add_argument("--holdout", type=float, default=0.1)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_intermixed_args()
+
+    vectorizer = FAISSVectorizer(lazy=True)
+    names = args.names or vectorizer.index_names()
+    if args.command == "convert":
+        builder = IndexBuilder(
+            args.index_type,
+            pq_m=args.pq_m,
+            min_ivfpq_vectors=args.min_ivfpq_vectors,
+        )
+        before, after = 0, 0
+        for name in names:
+            old_bytes, new_bytes = vectorizer.convert_index(name, builder)
+            before, after = before + old_bytes, after + new_bytes
+        print(json.dumps({"indexes": len(names), "bytes": [before, after]}))
+    else:
+        rng = np.random.default_rng(args.seed)
+        datasets = (
+            holdout_split(
+                index_vectors(
+                    faiss.read_index(
+                        os.path.join(vectorizer.embedding_path, name, "index.faiss")
+                    )
+                ),
+                args.holdout,
+                rng,
+            )
+            for name in names
+        )
+        builders = [
+            IndexBuilder(
+                index_type,
+                pq_m=args.pq_m,
+                min_ivfpq_vectors=args.min_ivfpq_vectors,
+            )
+            for index_type in INDEX_TYPES
+        ]
+        report = recall_report(datasets, builders, k=args.k)
+        print(json.dumps(report, indent=2))
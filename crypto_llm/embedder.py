@@ -0,0 +1,290 @@
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Dict, List
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from crypto_llm.scheduler import RequestScheduler, get_scheduler
+
+logging.basicConfig(
+    level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+)
+logger = logging.getLogger(__name__)
+
+
+class ScheduledEmbeddings(Embeddings):
+    """
+    Sends the calls of an embedder through the request scheduler.
+    """
+
+    def __init__(
+        self,
+        embedder: Embeddings,
+        endpoint: str = "nvidia_embed",
+        scheduler: RequestScheduler = None,
+    ):
+        self.embedder = embedder
+        self.model = getattr(embedder, "model", type(embedder).__name__)
+        self.endpoint = endpoint
+        self.scheduler = scheduler or get_scheduler()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.scheduler.call(self.endpoint, self.embedder.embed_documents, texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.scheduler.call(self.endpoint, self.embedder.embed_query, text)
+
+
+class LocalEmbeddings(Embeddings):
+    """
+    Embeds texts on the CPU with a transformers model loaded from a local
+    directory, so indexing works without the embeddings API.
+
+    Texts are sorted by length and embedded in batches of `batch_size`, which
+    keeps padding small. With `quantize` the linear layers are dynamically
+    quantized to int8: faster on CPU at a small loss of accuracy, so the
+    vectors are cached under a separate model name.
+    """
+
+    def __init__(
+        self,
+        model_path: str,
+        model_name: str = None,
+        batch_size: int = 32,
+        max_length: int = 512,
+        quantize: bool = False,
+        threads: int = None,
+        pooling: str = "pooler",
+        normalize: bool = True,
+    ):
+        """
+        Args:
+            model_path (str): directory with the model and its tokenizer
+            model_name (str, optional): name of the model in the embeddings
+                cache, defaults to the directory name
+            batch_size (int): texts per forward pass
+            max_length (int): texts are truncated to this many tokens
+            quantize (bool): quantize the linear layers to int8
+            threads (int, optional): number of torch threads; the setting is
+                process-wide. Defaults to the torch default
+            pooling (str): "pooler" uses the pooler output of the model (as
+                LaBSE does) and falls back to "mean" without one, "cls" takes
+                the first token, "mean" averages the tokens
+            normalize (bool): L2-normalize the vectors
+        """
+        try:
+            import torch
+            from transformers import AutoModel, AutoTokenizer
+        except ImportError as e:
+            raise ImportError(
+                "Local embeddings need torch and transformers: "
+                "pip install 'crypto_llm[local]'"
+            ) from e
+        if pooling not in ("pooler", "cls", "mean"):
+            raise ValueError(f"Unknown pooling: {pooling}")
+        if threads:
+            torch.set_num_threads(threads)
+        self.tokenizer = AutoTokenizer.from_pretrained(
+            model_path, local_files_only=True
+        )
+        encoder = AutoModel.from_pretrained(model_path, local_files_only=True)
+        encoder.eval()
+        if quantize:
+            encoder = torch.ao.quantization.quantize_dynamic(
+                encoder, {torch.nn.Linear}, dtype=torch.qint8
+            )
+        self.encoder = encoder
+        # имя модели - ключ кэша эмбеддингов, int8 дает другие векторы
+        self.model = (model_name or os.path.basename(os.path.normpath(model_path))) + (
+            "-int8" if quantize else ""
+        )
+        self.batch_size = batch_size
+        self.max_length = max_length
+        self.pooling = pooling
+        self.normalize = normalize
+        # параллелизм уже внутри torch, одновременные батчи только мешают друг другу
+        self.lock = threading.Lock()
+        logger.info("Loaded local embeddings model %s from %s", self.model, model_path)
+
+    def _pool(self, output, attention_mask):
+        if (
+            self.pooling == "pooler"
+            and getattr(output, "pooler_output", None) is not None
+        ):
+            return output.pooler_output
+        if self.pooling == "cls":
+            return output.last_hidden_state[:, 0]
+        mask = attention_mask.unsqueeze(-1).to(output.last_hidden_state.dtype)
+        return (output.last_hidden_state * mask).sum(1) / mask.sum(1).clamp(min=1e-9)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        import torch
+
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        vectors: List[List[float]] = [None] * len(texts)
+        with self.lock, torch.inference_mode():
+            for start in range(0, len(order), self.batch_size):
+                batch = order[start : start + self.batch_size]
+                inputs = self.tokenizer(
+                    [texts[i] for i in batch],
+                    padding=True,
+                    truncation=True,
+                    max_length=self.max_length,
+                    return_tensors="pt",
+                )
+                embeddings = self._pool(
+                    self.encoder(**inputs), inputs["attention_mask"]
+                )
+                if self.normalize:
+                    embeddings = torch.nn.functional.normalize(embeddings, dim=1)
+                for i, vector in zip(batch, embeddings.tolist()):
+                    vectors[i] = vector
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Embeddings wrapper with a persistent cache of document vectors.
+
+    Vectors are stored in SQLite keyed by the hash of the model name and the
+    chunk text, so identical chunks of different whitepapers and unchanged
+    chunks of a re-ingested whitepaper are embedded only once. Cache misses
+    are sent to the underlying embedder in batches of `batch_size`. The last
+    `query_cache_size` query vectors are kept in memory.
+    """
+
+    def __init__(
+        self,
+        embedder: Embeddings,
+        path: str,
+        model_name: str = None,
+        batch_size: int = 50,
+        query_cache_size: int = 256,
+    ):
+        self.embedder = embedder
+        self.model_name = model_name or getattr(
+            embedder, "model", type(embedder).__name__
+        )
+        self.batch_size = batch_size
+        self.reused = 0
+        self.computed = 0
+        self.query_cache_size = query_cache_size
+        self.queries: "OrderedDict[str, List[float]]" = OrderedDict()
+        self.query_hits = 0
+        self.query_misses = 0
+        self.lock = threading.Lock()
+        # кэш общий для процессов индексации: ждем записи другого процесса
+        # вместо ошибки "database is locked", читатели не блокируют писателя
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB)"
+        )
+        self.conn.commit()
+
+    def key(self, text: str) -> str:
+        return hashlib.sha256((self.model_name + "\0" + text).encode()).hexdigest()
+
+    def _lookup(self, keys: List[str]) -> Dict[str, List[float]]:
+        found = {}
+        with self.lock:
+            # SQLite ограничивает число параметров в одном запросе
+            for start in range(0, len(keys), 500):
+                part = keys[start : start + 500]
+                rows = self.conn.execute(
+                    "SELECT key, vector FROM embeddings WHERE key IN (%s)"
+                    % ",".join("?" * len(part)),
+                    part,
+                ).fetchall()
+                for key, vector in rows:
+                    found[key] = np.frombuffer(vector, dtype="float32").tolist()
+        return found
+
+    def _store(self, items: Dict[str, List[float]]) -> None:
+        with self.lock:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+                [
+                    (key, np.asarray(vector, dtype="float32").tobytes())
+                    for key, vector in items.items()
+                ],
+            )
+            self.conn.commit()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys = [self.key(text) for text in texts]
+        vectors = self._lookup(list(set(keys)))
+        reused = sum(key in vectors for key in keys)
+
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in vectors:
+                missing[key] = text
+        missing_keys = list(missing)
+        for start in range(0, len(missing_keys), self.batch_size):
+            batch_keys = missing_keys[start : start + self.batch_size]
+            batch = self.embedder.embed_documents([missing[key] for key in batch_keys])
+            computed = dict(zip(batch_keys, batch))
+            self._store(computed)
+            vectors.update(computed)
+
+        with self.lock:
+            self.reused += reused
+            self.computed += len(missing_keys)
+        logger.info(
+            "Embedded %d texts: %d reused from cache, %d computed",
+            len(texts),
+            reused,
+            len(missing_keys),
+        )
+        return [vectors[key] for key in keys]
+
+    def _cached_query(self, text: str) -> List[float]:
+        with self.lock:
+            vector = self.queries.get(text)
+            if vector is not None:
+                self.queries.move_to_end(text)
+                self.query_hits += 1
+            else:
+                self.query_misses += 1
+            return vector
+
+    def _store_query(self, text: str, vector: List[float]) -> None:
+        if not self.query_cache_size:
+            return
+        with self.lock:
+            self.queries[text] = vector
+            self.queries.move_to_end(text)
+            while len(self.queries) > self.query_cache_size:
+                self.queries.popitem(last=False)
+
+    def embed_query(self, text: str) -> List[float]:
+        # вопрос эмбеддится и для кэша ответов, и для поиска по индексу
+        vector = self._cached_query(text)
+        if vector is None:
+            vector = self.embedder.embed_query(text)
+            self._store_query(text, vector)
+        return vector
+
+    async def aembed_query(self, text: str) -> List[float]:
+        vector = self._cached_query(text)
+        if vector is None:
+            vector = await self.embedder.aembed_query(text)
+            self._store_query(text, vector)
+        return vector
+
+    def stats(self) -> Dict[str, int]:
+        with self.lock:
+            return {
+                "reused": self.reused,
+                "computed": self.computed,
+                "query_hits": self.query_hits,
+                "query_misses": self.query_misses,
+            }
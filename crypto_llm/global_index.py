@@ -0,0 +1,224 @@
+import logging
+import os
+import pickle
+import shutil
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import faiss
+import numpy as np
+from langchain_core.documents import Document
+from crypto_llm.chunkstore import ChunkStore
+from crypto_llm.compression import index_vectors
+
+logging.basicConfig(
+    level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+)
+logger = logging.getLogger(__name__)
+
+
+class GlobalIndex:
+    """
+    One ANN index over the whitepaper chunks of all currencies.
+
+    Currencies are split into `n_shards` contiguous groups, each group is an
+    HNSW or IVF index. The chunks of a currency take a contiguous id range
+    inside its shard, so a per-currency search is an exact range-filtered
+    search of one shard, and a search across all coins merges the top-k of
+    every shard.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        index_type: str = "hnsw",
+        n_shards: int = 4,
+        hnsw_m: int = 32,
+        ef_search: int = 64,
+        nlist: int = 1024,
+        nprobe: int = 16,
+    ):
+        if index_type not in ("hnsw", "ivf"):
+            raise ValueError(f"Unknown index type: {index_type}")
+        self.path = path
+        self.index_type = index_type
+        self.n_shards = n_shards
+        self.hnsw_m = hnsw_m
+        self.ef_search = ef_search
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.shards: List[faiss.Index] = []
+        self.docs: List[Sequence[Document]] = []
+        self.currencies: Dict[str, Tuple[int, int, int]] = {}
+
+    def __contains__(self, currency_name: str) -> bool:
+        return currency_name in self.currencies
+
+    def _create_index(self, vectors: np.ndarray) -> faiss.Index:
+        dim = vectors.shape[1]
+        if self.index_type == "hnsw":
+            index = faiss.IndexHNSWFlat(dim, self.hnsw_m)
+        else:
+            # IVF нельзя обучить на числе векторов меньше числа кластеров
+            nlist = max(1, min(self.nlist, int(np.sqrt(len(vectors)))))
+            index = faiss.IndexIVFFlat(faiss.IndexFlatL2(dim), dim, nlist)
+            index.train(vectors)
+        index.add(vectors)
+        return index
+
+    def _save_shard(
+        self,
+        path: str,
+        shard_id: int,
+        shard_vectors: List[np.ndarray],
+        shard_docs: List[Document],
+        shard_ids: List[str],
+    ) -> None:
+        vectors = np.vstack(shard_vectors).astype("float32")
+        index = self._create_index(vectors)
+        faiss.write_index(index, os.path.join(path, f"shard_{shard_id}.faiss"))
+        ChunkStore.write(
+            os.path.join(path, f"docs_{shard_id}.chunks"),
+            shard_docs,
+            ids=shard_ids,
+        )
+        logger.info("Built shard %d with %d vectors", shard_id, len(vectors))
+
+    def build(self, stores: Iterable[Tuple[str, object]], n_currencies: int) -> None:
+        """
+        Builds the index from already computed per-currency FAISS stores,
+        reusing their vectors instead of embedding the chunks again.
+
+        Args:
+            stores (Iterable): (currency name, langchain FAISS store) pairs
+            n_currencies (int): number of pairs, used to split them into shards
+
+        Returns:
+            None.
+        """
+        tmp_path = self.path.rstrip("/") + ".tmp"
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+
+        per_shard = max(1, -(-n_currencies // self.n_shards))
+        currencies = {}
+        shard_id, offset = 0, 0
+        shard_vectors, shard_docs, shard_ids = [], [], []
+        for name, store in stores:
+            ntotal = store.index.ntotal
+            if ntotal == 0:
+                continue
+            shard_vectors.append(index_vectors(store.index))
+            for i in range(ntotal):
+                docstore_id = store.index_to_docstore_id[i]
+                doc = store.docstore.search(docstore_id)
+                metadata = dict(doc.metadata, currency=name)
+                shard_docs.append(
+                    Document(page_content=doc.page_content, metadata=metadata)
+                )
+                shard_ids.append(f"{name}/{docstore_id}")
+            currencies[name] = (shard_id, offset, offset + ntotal)
+            offset += ntotal
+            if len(shard_vectors) == per_shard:
+                self._save_shard(
+                    tmp_path, shard_id, shard_vectors, shard_docs, shard_ids
+                )
+                shard_id, offset = shard_id + 1, 0
+                shard_vectors, shard_docs, shard_ids = [], [], []
+        if shard_vectors:
+            self._save_shard(tmp_path, shard_id, shard_vectors, shard_docs, shard_ids)
+            shard_id += 1
+
+        with open(os.path.join(tmp_path, "meta.pkl"), "wb") as fp:
+            pickle.dump(
+                {
+                    "index_type": self.index_type,
+                    "n_shards": shard_id,
+                    "currencies": currencies,
+                },
+                fp,
+            )
+        shutil.rmtree(self.path, ignore_errors=True)
+        os.replace(tmp_path, self.path)
+        logger.info("Global index saved for %d currencies", len(currencies))
+        self.load()
+
+    def exists(self) -> bool:
+        return os.path.exists(os.path.join(self.path, "meta.pkl"))
+
+    def load(self) -> None:
+        with open(os.path.join(self.path, "meta.pkl"), "rb") as fp:
+            meta = pickle.load(fp)
+        self.index_type = meta["index_type"]
+        self.currencies = meta["currencies"]
+        self.shards, self.docs = [], []
+        for shard_id in range(meta["n_shards"]):
+            self.shards.append(
+                faiss.read_index(os.path.join(self.path, f"shard_{shard_id}.faiss"))
+            )
+            docs_path = os.path.join(self.path, f"docs_{shard_id}.chunks")
+            if ChunkStore.exists(docs_path):
+                # пересборка удаляет файлы, загруженный индекс читает свои
+                self.docs.append(ChunkStore.open(docs_path).pin())
+            else:
+                # индекс собран до появления хранилища чанков
+                with open(docs_path[: -len(".chunks")] + ".pkl", "rb") as fp:
+                    self.docs.append(pickle.load(fp))
+        logger.info(
+            "Global index loaded: %d shards, %d currencies",
+            len(self.shards),
+            len(self.currencies),
+        )
+
+    def _search_shard(
+        self,
+        shard_id: int,
+        query: np.ndarray,
+        k: int,
+        id_range: Optional[Tuple[int, int]] = None,
+    ) -> List[Tuple[float, int, int]]:
+        index = self.shards[shard_id]
+        if id_range is not None:
+            # точный поиск только по чанкам одной криптовалюты
+            selector = faiss.IDSelectorRange(*id_range)
+            if self.index_type == "hnsw":
+                index = faiss.downcast_index(index.storage)
+                params = faiss.SearchParameters(sel=selector)
+            else:
+                params = faiss.SearchParametersIVF(sel=selector, nprobe=index.nlist)
+        elif self.index_type == "hnsw":
+            params = faiss.SearchParametersHNSW(efSearch=max(self.ef_search, k))
+        else:
+            params = faiss.SearchParametersIVF(nprobe=self.nprobe)
+        distances, ids = index.search(query, k, params=params)
+        return [
+            (float(dist), shard_id, int(i))
+            for dist, i in zip(distances[0], ids[0])
+            if i != -1
+        ]
+
+    def search(
+        self, embedding: List[float], k: int = 8, currency_name: str = None
+    ) -> List[Tuple[Document, float]]:
+        """
+        Searches the index for the chunks closest to a query embedding.
+
+        Args:
+            embedding (List[float]): query embedding
+            k (int): number of chunks to return
+            currency_name (str, optional): restrict the search to one currency
+
+        Returns:
+            List[Tuple[Document, float]]: chunks with their L2 distances
+        """
+        query = np.array([embedding], dtype="float32")
+        if currency_name is not None:
+            if currency_name not in self.currencies:
+                return []
+            shard_id, lo, hi = self.currencies[currency_name]
+            hits = self._search_shard(shard_id, query, min(k, hi - lo), (lo, hi))
+        else:
+            hits = []
+            for shard_id in range(len(self.shards)):
+                hits.extend(self._search_shard(shard_id, query, k))
+            hits = sorted(hits)[:k]
+        return [(self.docs[shard_id][i], dist) for dist, shard_id, i in hits]
@@ -0,0 +1,324 @@
+import argparse
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+from crypto_llm.metrics import get_tracer
+
+logging.basicConfig(
+    level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+)
+logger = logging.getLogger(__name__)
+
+PREPARING_MESSAGE = (
+    "Whitepaper по этой криптовалюте еще обрабатывается. "
+    "Ответ будет доступен через несколько минут."
+)
+
+# запросы пользователей обгоняют предзагрузку
+REQUEST_PRIORITY = 1
+PREFETCH_PRIORITY = 0
+
+
+class IngestionQueue:
+    """
+    Background ingestion of whitepapers: download, parsing and embedding run
+    on `workers` threads instead of inside the user request.
+
+    Jobs are kept in a SQLite database in WAL mode, so queued jobs survive a
+    restart and several processes can share the queue: a job is claimed by a
+    conditional update, only one worker wins it. Jobs left "running" by a
+    crashed process are queued again after `stale_after` seconds, failed jobs
+    are retried when requested again after `retry_after` seconds.
+    """
+
+    def __init__(
+        self,
+        ingest: Callable[[str], bool],
+        path: str,
+        ready: Callable[[str], bool] = None,
+        workers: int = 2,
+        retry_after: float = 3600,
+        stale_after: float = 3600,
+        poll_interval: float = 2.0,
+    ):
+        """
+        Args:
+            ingest (Callable): indexes a currency, returns False if it has no
+                whitepaper
+            path (str): database file
+            ready (Callable, optional): True if a currency is indexed already,
+                checked before a job is queued; a finished job whose index is
+                gone is queued again
+            workers (int): number of worker threads
+            retry_after (float): seconds before a failed job can run again
+            stale_after (float): seconds after which a "running" job is
+                considered lost
+            poll_interval (float): seconds between checks for jobs queued by
+                other processes
+        """
+        self.ingest = ingest
+        self.path = path
+        self.ready = ready
+        self.workers = workers
+        self.retry_after = retry_after
+        self.stale_after = stale_after
+        self.poll_interval = poll_interval
+        self.lock = threading.Lock()
+        self.tracer = get_tracer()
+        self._threads: List[threading.Thread] = []
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "name TEXT PRIMARY KEY, status TEXT NOT NULL, "
+            "priority INTEGER NOT NULL, requests INTEGER NOT NULL DEFAULT 0, "
+            "attempts INTEGER NOT NULL DEFAULT 0, error TEXT, "
+            "created REAL NOT NULL, updated REAL NOT NULL)"
+        )
+        self.conn.execute(
+            "CREATE INDEX IF NOT EXISTS jobs_queue ON jobs (status, priority, created)"
+        )
+        self.conn.commit()
+
+    def start(self) -> None:
+        """
+        Starts the worker threads, once. Jobs queued before a restart are
+        picked up right away.
+        """
+        with self.lock:
+            if self._threads:
+                return
+            self._stop.clear()
+            self._threads = [
+                threading.Thread(target=self._work, name=f"ingestion_{i}", daemon=True)
+                for i in range(self.workers)
+            ]
+        self.requeue_stale()
+        for thread in self._threads:
+            thread.start()
+        logger.info("Ingestion queue started with %d workers", self.workers)
+
+    def stop(self, timeout: float = None) -> None:
+        """
+        Stops the workers after their current jobs, queued jobs stay queued.
+        """
+        self._stop.set()
+        self._wakeup.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def submit(
+        self, name: str, priority: int = REQUEST_PRIORITY, count: bool = True
+    ) -> str:
+        """
+        Queues the ingestion of a currency unless it is indexed, queued or
+        running already. A user request raises the priority of a queued
+        prefetch job and counts towards most_requested(). A finished job is
+        queued again if `ready` reports that its index has been deleted.
+
+        Args:
+            name (str): the currency
+            priority (int): REQUEST_PRIORITY or PREFETCH_PRIORITY
+            count (bool): count a user request, False if the same user
+                action is counted elsewhere
+
+        Returns:
+            str: "ready", "queued", "running" or "failed"
+        """
+        now = time.time()
+        requested = int(count and priority >= REQUEST_PRIORITY)
+        ready = self.ready(name) if self.ready is not None else None
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT status, updated FROM jobs WHERE name=?", (name,)
+            ).fetchone()
+            if row is None:
+                status = "done" if ready else "queued"
+                self.conn.execute(
+                    "INSERT INTO jobs (name, status, priority, requests, created, "
+                    "updated) VALUES (?, ?, ?, ?, ?, ?)",
+                    (name, status, priority, requested, now, now),
+                )
+            else:
+                status, updated = row
+                if ready and status != "running":
+                    status = "done"
+                elif status == "done" and ready is False:
+                    # индекс удален после сборки
+                    logger.info("Index of %s is missing, queueing it again", name)
+                    status = "queued"
+                elif status == "failed" and now - updated >= self.retry_after:
+                    status = "queued"
+                self.conn.execute(
+                    "UPDATE jobs SET status=?, requests=requests+?, "
+                    "priority=MAX(priority, ?), updated=CASE WHEN status=? "
+                    "THEN updated ELSE ? END WHERE name=?",
+                    (status, requested, priority, status, now, name),
+                )
+            self.conn.commit()
+        if status == "done":
+            return "ready"
+        if status == "queued":
+            self.start()
+            self._wakeup.set()
+        return status
+
+    def prefetch(self, names: List[str]) -> Dict[str, int]:
+        """
+        Queues currencies ahead of user requests, behind the jobs of users.
+
+        Returns:
+            Dict[str, int]: number of currencies by status
+        """
+        counts: Dict[str, int] = {}
+        for name in names:
+            status = self.submit(name, priority=PREFETCH_PRIORITY)
+            counts[status] = counts.get(status, 0) + 1
+        logger.info("Prefetching %d currencies: %s", len(names), counts)
+        return counts
+
+    def status(self, name: str) -> Optional[str]:
+        """
+        Status of the job of a currency without queueing it, for polling.
+
+        Returns:
+            Optional[str]: "done", "queued", "running" or "failed", None if
+                the currency was never submitted
+        """
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT status FROM jobs WHERE name=?", (name,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def most_requested(self, n: int) -> List[str]:
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT name FROM jobs WHERE requests > 0 AND status != 'failed' "
+                "ORDER BY requests DESC, name LIMIT ?",
+                (n,),
+            ).fetchall()
+        return [name for (name,) in rows]
+
+    def pending(self) -> int:
+        with self.lock:
+            return self.conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE status IN ('queued', 'running')"
+            ).fetchone()[0]
+
+    def join(self, timeout: float = None) -> bool:
+        """
+        Waits until no job is queued or running.
+
+        Returns:
+            bool: False if jobs are still pending after `timeout` seconds
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.pending():
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(min(self.poll_interval, 0.1))
+        return True
+
+    def stats(self) -> Dict[str, int]:
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT status, COUNT(*) FROM jobs GROUP BY status"
+            ).fetchall()
+        return dict(rows)
+
+    def requeue_stale(self) -> int:
+        """
+        Queues again the jobs of workers that died without finishing them.
+
+        Returns:
+            int: number of requeued jobs
+        """
+        with self.lock:
+            requeued = self.conn.execute(
+                "UPDATE jobs SET status='queued' WHERE status='running' "
+                "AND updated < ?",
+                (time.time() - self.stale_after,),
+            ).rowcount
+            self.conn.commit()
+        if requeued:
+            logger.warning("Requeued %d stale ingestion jobs", requeued)
+        return requeued
+
+    def claim(self) -> Optional[str]:
+        """
+        Marks the next queued job as running.
+
+        Returns:
+            str: the currency of the job, None if the queue is empty
+        """
+        with self.lock:
+            while True:
+                row = self.conn.execute(
+                    "SELECT name FROM jobs WHERE status='queued' "
+                    "ORDER BY priority DESC, created LIMIT 1"
+                ).fetchone()
+                if row is None:
+                    return None
+                # другой процесс мог забрать задачу между запросами
+                claimed = self.conn.execute(
+                    "UPDATE jobs SET status='running', attempts=attempts+1, "
+                    "updated=? WHERE name=? AND status='queued'",
+                    (time.time(), row[0]),
+                ).rowcount
+                self.conn.commit()
+                if claimed:
+                    return row[0]
+
+    def run_job(self, name: str) -> None:
+        with self.tracer.span("ingestion_job") as span:
+            try:
+                status = "done" if self.ingest(name) else "failed"
+                error = None if status == "done" else "whitepaper not found"
+            except Exception as e:
+                logger.warning(f"Error ingesting {name}. " + str(e))
+                status, error = "failed", str(e)
+            span.set(outcome=status)
+        with self.lock:
+            self.conn.execute(
+                "UPDATE jobs SET status=?, error=?, updated=? WHERE name=?",
+                (status, error, time.time(), name),
+            )
+            self.conn.commit()
+        logger.info("Ingestion of %s finished: %s", name, status)
+
+    def _work(self) -> None:
+        while not self._stop.is_set():
+            name = self.claim()
+            if name is None:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+                continue
+            self.run_job(name)
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    from crypto_llm.chainer import LlmChainer
+
+    load_dotenv("./.env")
+    parser = argparse.ArgumentParser(description="Ingest whitepapers in background")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--top", type=int, default=50, help="currencies to prefetch")
+    parser.add_argument("names", nargs="*", help="defaults to the top currencies")
+    args = parser.parse_args()
+
+    chainer = LlmChainer(
+        lazy=True, background_ingestion=True, ingestion_workers=args.workers
+    )
+    print(chainer.prefetch(args.names or None, top=args.top))
+    chainer.ingestion.join()
+    print(chainer.ingestion.stats())
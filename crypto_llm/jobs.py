@@ -0,0 +1,168 @@
+import argparse
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, List, Optional, Tuple
+
+from tqdm import tqdm
+
+from crypto_llm.ingestion import PREPARING_MESSAGE
+
+logging.basicConfig(
+    level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+)
+logger = logging.getLogger(__name__)
+
+
+class SummaryPrecomputeJob:
+    """
+    Generates summaries for the whole catalog ahead of the first user request.
+
+    Progress is appended to a checkpoint file, so an interrupted run resumes
+    where it stopped. Currencies with a cached summary are skipped, currencies
+    that failed in a previous run are skipped unless `retry_failed` is set.
+    With background ingestion a whitepaper that is not indexed yet is waited
+    for up to `ingestion_timeout` seconds; if it is still not ready, the
+    currency is left pending and summarized by the next run.
+    """
+
+    def __init__(
+        self,
+        chainer,
+        workers: int = 4,
+        retry_failed: bool = False,
+        ingestion_timeout: float = 600,
+        poll_interval: float = 2.0,
+    ):
+        self.chainer = chainer
+        self.workers = workers
+        self.retry_failed = retry_failed
+        self.ingestion_timeout = ingestion_timeout
+        self.poll_interval = poll_interval
+        self.path = os.getenv("DATA_PATH") + "jobs/"
+        self.checkpoint_path = self.path + "summary_precompute.jsonl"
+        self.lock = threading.Lock()
+        os.makedirs(self.path, exist_ok=True)
+
+    def load_checkpoint(self) -> Dict[str, str]:
+        state = {}
+        if os.path.exists(self.checkpoint_path):
+            with open(self.checkpoint_path, "r") as fp:
+                for line in fp:
+                    try:
+                        item = json.loads(line)
+                    except json.JSONDecodeError:
+                        # последняя строка могла не дописаться при падении
+                        continue
+                    state[item["name"]] = item["status"]
+        return state
+
+    def save_checkpoint(self, name: str, status: str, error: str = None) -> None:
+        with self.lock:
+            with open(self.checkpoint_path, "a") as fp:
+                item = {"name": name, "status": status, "error": error}
+                fp.write(json.dumps(item, ensure_ascii=False) + "\n")
+
+    def wait_for_ingestion(self, name: str) -> bool:
+        """
+        Waits until the background ingestion of a whitepaper is finished.
+
+        Returns:
+            bool: True if the whitepaper is ready
+        """
+        deadline = time.monotonic() + self.ingestion_timeout
+        status = self.chainer.poll_ingestion(name)
+        while status in ("queued", "running") and time.monotonic() < deadline:
+            time.sleep(self.poll_interval)
+            status = self.chainer.poll_ingestion(name)
+        return status == "ready"
+
+    def summarize(self, name: str) -> Tuple[str, Optional[str]]:
+        """
+        Returns:
+            Tuple[str, Optional[str]]: "done", "pending" if the whitepaper is
+                still being ingested or "failed", and the reason of a failure
+        """
+        status, error = "done", None
+        try:
+            summary = self.chainer.run_chain(name, is_summary=True)
+            # сообщение о подготовке - не саммари, ждем индекс и пробуем снова
+            if summary == PREPARING_MESSAGE and self.wait_for_ingestion(name):
+                summary = self.chainer.run_chain(name, is_summary=True)
+            if summary is None:
+                status, error = "failed", "whitepaper not found"
+            elif summary == PREPARING_MESSAGE:
+                status = "pending"
+        except Exception as e:
+            logger.warning(f"Error generating summary for {name}. " + str(e))
+            status, error = "failed", str(e)
+        self.save_checkpoint(name, status, error)
+        return status, error
+
+    def run(self, currency_names: List[str] = None) -> Dict:
+        """
+        Generates missing summaries on a pool of `workers` threads.
+
+        Args:
+            currency_names (List[str], optional): currencies to summarize.
+                Defaults to FileStorage.show_all_currency_names().
+
+        Returns:
+            Dict: counts of done and skipped currencies, failure reasons by
+                currency, currencies whose whitepapers are still being
+                ingested and throughput
+        """
+        if currency_names is None:
+            currency_names = self.chainer.vectorizer.storage.show_all_currency_names()
+        state = self.load_checkpoint()
+        cached = self.chainer.cached_summaries(currency_names)
+        todo = [
+            name
+            for name in currency_names
+            if name not in cached and (self.retry_failed or state.get(name) != "failed")
+        ]
+        report = {
+            "done": 0,
+            "failed": {},
+            "pending": [],
+            "skipped": len(currency_names) - len(todo),
+        }
+        logger.info(f"Precomputing {len(todo)} summaries, {report['skipped']} skipped")
+
+        start = time.time()
+        with ThreadPoolExecutor(self.workers) as pool:
+            futures = {pool.submit(self.summarize, name): name for name in todo}
+            for future in tqdm(as_completed(futures), total=len(futures)):
+                status, error = future.result()
+                if status == "failed":
+                    report["failed"][futures[future]] = error
+                elif status == "pending":
+                    report["pending"].append(futures[future])
+                else:
+                    report["done"] += 1
+        report["elapsed"] = time.time() - start
+        report["per_minute"] = (
+            60 * len(todo) / report["elapsed"] if report["elapsed"] else 0.0
+        )
+        logger.info(f"Summary precompute finished: {report}")
+        return report
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    from crypto_llm.chainer import LlmChainer
+
+    load_dotenv("./.env")
+    parser = argparse.ArgumentParser(description="Precompute currency summaries")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--retry-failed", action="store_true")
+    parser.add_argument("names", nargs="*", help="currencies, defaults to all")
+    args = parser.parse_args()
+
+    job = SummaryPrecomputeJob(
+        LlmChainer(), workers=args.workers, retry_failed=args.retry_failed
+    )
+    print(job.run(args.names or None))
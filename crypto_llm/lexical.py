@@ -0,0 +1,133 @@
+import logging
+import os
+import re
+from collections import Counter
+from typing import List, Tuple
+
+import numpy as np
+
+logging.basicConfig(
+    level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+)
+logger = logging.getLogger(__name__)
+
+LEXICAL_FILE = "bm25.npz"
+
+_token_re = re.compile(r"\w+")
+
+
+def tokenize(text: str) -> List[str]:
+    # тикеры и термины вроде "PoH" ищутся без учета регистра
+    return _token_re.findall(text.lower())
+
+
+class LexicalIndex:
+    """
+    BM25 inverted index over the chunks of one whitepaper.
+
+    The BM25 weight of every (term, chunk) pair is computed when the index is
+    built, so a search only sums the weights of the query terms. Postings are
+    stored as CSR arrays: the postings of `terms[i]` are
+    `docs[offsets[i]:offsets[i + 1]]` with `weights` alongside.
+    """
+
+    def __init__(
+        self,
+        ids: np.ndarray,
+        terms: np.ndarray,
+        offsets: np.ndarray,
+        docs: np.ndarray,
+        weights: np.ndarray,
+    ):
+        self.ids = ids
+        self.terms = terms
+        self.offsets = offsets
+        self.docs = docs
+        self.weights = weights
+
+    @classmethod
+    def build(
+        cls, ids: List[str], texts: List[str], k1: float = 1.5, b: float = 0.75
+    ) -> "LexicalIndex":
+        """
+        Args:
+            ids (List[str]): docstore ids of the chunks
+            texts (List[str]): texts of the chunks
+            k1 (float): BM25 term frequency saturation
+            b (float): BM25 length normalization
+
+        Returns:
+            LexicalIndex: the index
+        """
+        counts = [Counter(tokenize(text)) for text in texts]
+        lengths = np.array([sum(c.values()) for c in counts], dtype="float32")
+        avg_length = float(lengths.mean()) if len(lengths) and lengths.sum() else 1.0
+        postings = {}
+        for doc, doc_counts in enumerate(counts):
+            for term, tf in doc_counts.items():
+                postings.setdefault(term, []).append((doc, tf))
+
+        terms = sorted(postings)
+        offsets = np.zeros(len(terms) + 1, dtype="int64")
+        docs, weights = [], []
+        n_docs = len(texts)
+        for i, term in enumerate(terms):
+            term_docs = np.array([doc for doc, _ in postings[term]], dtype="int32")
+            tf = np.array([tf for _, tf in postings[term]], dtype="float32")
+            idf = np.log(1 + (n_docs - len(term_docs) + 0.5) / (len(term_docs) + 0.5))
+            norm = k1 * (1 - b + b * lengths[term_docs] / avg_length)
+            docs.append(term_docs)
+            weights.append((idf * tf * (k1 + 1) / (tf + norm)).astype("float32"))
+            offsets[i + 1] = offsets[i] + len(term_docs)
+        return cls(
+            ids=np.array(ids, dtype=str),
+            terms=np.array(terms, dtype=str),
+            offsets=offsets,
+            docs=np.concatenate(docs) if docs else np.zeros(0, dtype="int32"),
+            weights=(
+                np.concatenate(weights) if weights else np.zeros(0, dtype="float32")
+            ),
+        )
+
+    @staticmethod
+    def exists(path: str) -> bool:
+        return os.path.exists(os.path.join(path, LEXICAL_FILE))
+
+    @classmethod
+    def load(cls, path: str) -> "LexicalIndex":
+        with np.load(os.path.join(path, LEXICAL_FILE), allow_pickle=False) as data:
+            return cls(**{key: data[key] for key in data.files})
+
+    def save(self, path: str) -> None:
+        # имя оканчивается на .npz, иначе np.savez допишет расширение сам
+        tmp_path = os.path.join(path, "tmp_" + LEXICAL_FILE)
+        np.savez(
+            tmp_path,
+            ids=self.ids,
+            terms=self.terms,
+            offsets=self.offsets,
+            docs=self.docs,
+            weights=self.weights,
+        )
+        os.replace(tmp_path, os.path.join(path, LEXICAL_FILE))
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def search(self, query: str, k: int = 8) -> List[Tuple[str, float]]:
+        """
+        Returns the docstore ids and BM25 scores of the `k` best chunks that
+        contain at least one query term.
+        """
+        scores = np.zeros(len(self.ids), dtype="float32")
+        for term in set(tokenize(query)):
+            i = np.searchsorted(self.terms, term)
+            if i == len(self.terms) or self.terms[i] != term:
+                continue
+            start, end = self.offsets[i], self.offsets[i + 1]
+            scores[self.docs[start:end]] += self.weights[start:end]
+        matched = np.flatnonzero(scores)
+        if len(matched) > k:
+            matched = matched[np.argpartition(-scores[matched], k - 1)[:k]]
+        matched = matched[np.argsort(-scores[matched], kind="stable")]
+        return [(str(self.ids[i]), float(scores[i])) for i in matched]
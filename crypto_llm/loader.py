@@ -2,14 +2,25 @@ import abc
 import coinmarketcapapi
 import pandas as pd
 import os
+import hashlib
+import json
+import requests
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    wait,
+)
+from dataclasses import dataclass
 from tqdm import tqdm
-from time import sleep
 import logging
 import pickle
-from typing import List
+from typing import Dict, Iterable, Iterator, List, Optional
 from langchain_community.document_loaders import PyPDFLoader
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_core.documents import Document
+from crypto_llm.chunkstore import ChunkStore
+from crypto_llm.scheduler import RequestScheduler, get_scheduler
 
 # Настройка логирования
 logging.basicConfig(
@@ -32,6 +43,40 @@ class BaseLoader(abc.ABC):
         pass
 
 
+@dataclass
+class IngestResult:
+    name: str
+    link: str
+    status: str  # "done", "skipped" или "failed"
+    n_chunks: int = 0
+    error: str = None
+
+
+def iter_chunks(
+    file_path: str, source: str, splitter: RecursiveCharacterTextSplitter
+) -> Iterator[Document]:
+    """
+    Parses a local PDF page by page and yields its chunks, so only one page
+    is held in memory whatever the size of the document.
+    """
+    for page in PyPDFLoader(file_path).lazy_load():
+        # сплиттер и так режет каждую страницу отдельно
+        for doc in splitter.split_documents([page]):
+            doc.metadata["source"] = source
+            yield doc
+
+
+def parse_and_split(
+    file_path: str, source: str, splitter_params: Dict, chunks_path: str
+) -> int:
+    """
+    Parses a local PDF and writes its chunks to a chunk store. Runs in a
+    worker process; only the number of chunks is sent back.
+    """
+    splitter = RecursiveCharacterTextSplitter(**splitter_params)
+    return len(ChunkStore.write(chunks_path, iter_chunks(file_path, source, splitter)))
+
+
 class WhitePaperLoader(BaseLoader):
     def __init__(
         self,
@@ -40,43 +85,238 @@ class WhitePaperLoader(BaseLoader):
         is_separator_regex: bool = False,
     ):
         self.path = os.getenv("DATA_PATH") + "sources/whitepapers/"
-        self.splitter = RecursiveCharacterTextSplitter(
-            chunk_size=chunk_size,
-            chunk_overlap=chunk_overlap,
-            is_separator_regex=is_separator_regex,
-        )
+        self.download_path = self.path + "downloads/"
+        self.ingest_state_path = self.path + "ingest_state.jsonl"
+        self.splitter_params = {
+            "chunk_size": chunk_size,
+            "chunk_overlap": chunk_overlap,
+            "is_separator_regex": is_separator_regex,
+        }
+        self.splitter = RecursiveCharacterTextSplitter(**self.splitter_params)
 
     def get_info(self, name: str, link: str) -> bool:
         try:
-            data = PyPDFLoader(link).load()
-            data = self.split_text(data)
-            self.save_info(name, data)
+            file_path = self.download(link)
+            try:
+                self.save_info(name, self.iter_chunks(file_path, link))
+            finally:
+                if file_path != link:
+                    os.remove(file_path)
             return True
         except Exception as e:
             logger.warning(f"Error fetching info for {link}. " + str(e))
             return False
 
-    def get_info_batch(self, list_of_links: List):
+    def get_info_batch(self, list_of_links: List, parallel: bool = False, **kwargs):
+        if parallel:
+            return self.get_info_parallel(list_of_links, **kwargs)
         for name, link in tqdm(list_of_links):
             self.get_info(name, link)
 
+    def get_info_parallel(
+        self,
+        list_of_links: List,
+        download_workers: int = 8,
+        parse_workers: int = None,
+        max_pending: int = 32,
+        resume: bool = True,
+        timeout: int = 60,
+    ) -> List[IngestResult]:
+        """
+        Ingests whitepapers concurrently: downloads run on a thread pool,
+        PDF parsing and splitting on a process pool.
+
+        Args:
+            list_of_links (List): (name, link) pairs, link is a URL or a local path
+            download_workers (int): size of the download thread pool
+            parse_workers (int): size of the parsing process pool, defaults to
+                the number of CPUs
+            max_pending (int): max number of whitepapers downloaded or being
+                downloaded but not yet parsed
+            resume (bool): skip whitepapers ingested by a previous run
+            timeout (int): download timeout in seconds
+
+        Returns:
+            List[IngestResult]: result for every (name, link) pair
+        """
+        state = self.load_ingest_state() if resume else {}
+        results = []
+        todo = []
+        for name, link in list_of_links:
+            if resume and state.get(name) == link and self.has_info(name):
+                results.append(IngestResult(name, link, "skipped"))
+            else:
+                todo.append((name, link))
+        logger.info(f"Ingesting {len(todo)} whitepapers, {len(results)} skipped")
+
+        pending = iter(todo)
+        downloads, parses = {}, {}
+        progress = tqdm(total=len(todo))
+        with (
+            ThreadPoolExecutor(download_workers) as io_pool,
+            ProcessPoolExecutor(parse_workers) as cpu_pool,
+        ):
+
+            def submit_downloads():
+                while len(downloads) + len(parses) < max_pending:
+                    item = next(pending, None)
+                    if item is None:
+                        return
+                    future = io_pool.submit(self.download, item[1], timeout)
+                    downloads[future] = item
+
+            submit_downloads()
+            while downloads or parses:
+                done, _ = wait(
+                    list(downloads) + list(parses), return_when=FIRST_COMPLETED
+                )
+                for future in done:
+                    if future in downloads:
+                        name, link = downloads.pop(future)
+                        try:
+                            file_path = future.result()
+                        except Exception as e:
+                            results.append(self._failed(name, link, "download", e))
+                            progress.update()
+                            continue
+                        future = cpu_pool.submit(
+                            parse_and_split,
+                            file_path,
+                            link,
+                            self.splitter_params,
+                            self.chunks_path(name),
+                        )
+                        parses[future] = (name, link, file_path)
+                    else:
+                        name, link, file_path = parses.pop(future)
+                        try:
+                            n_chunks = future.result()
+                            self.remove_legacy_info(name)
+                            self.save_ingest_state(name, link)
+                            results.append(
+                                IngestResult(name, link, "done", n_chunks=n_chunks)
+                            )
+                        except Exception as e:
+                            results.append(self._failed(name, link, "parse", e))
+                        finally:
+                            if file_path != link:
+                                os.remove(file_path)
+                        progress.update()
+                submit_downloads()
+        progress.close()
+
+        failed = sum(result.status == "failed" for result in results)
+        logger.info(f"Ingestion finished, {failed} of {len(results)} failed")
+        return results
+
+    @staticmethod
+    def _failed(name: str, link: str, stage: str, e: Exception) -> IngestResult:
+        logger.warning(f"Error ingesting {link} at {stage} stage. " + str(e))
+        return IngestResult(name, link, "failed", error=f"{stage}: {e}")
+
+    def download(self, link: str, timeout: int = 60) -> str:
+        """
+        Downloads a PDF to the downloads directory. Local paths are returned as is.
+        """
+        if os.path.exists(link):
+            return link
+        os.makedirs(self.download_path, exist_ok=True)
+        file_path = (
+            self.download_path + hashlib.sha1(link.encode()).hexdigest() + ".pdf"
+        )
+        with requests.get(link, stream=True, timeout=timeout) as response:
+            response.raise_for_status()
+            with open(file_path, "wb") as fp:
+                for chunk in response.iter_content(chunk_size=1 << 16):
+                    fp.write(chunk)
+        return file_path
+
+    def load_ingest_state(self) -> Dict[str, str]:
+        """
+        Returns name -> link of the whitepapers ingested by previous runs.
+        """
+        state = {}
+        if os.path.exists(self.ingest_state_path):
+            with open(self.ingest_state_path, "r") as fp:
+                for line in fp:
+                    try:
+                        item = json.loads(line)
+                    except json.JSONDecodeError:
+                        # последняя строка могла не дописаться при падении
+                        continue
+                    state[item["name"]] = item["link"]
+        return state
+
+    def save_ingest_state(self, name: str, link: str) -> None:
+        with open(self.ingest_state_path, "a") as fp:
+            fp.write(json.dumps({"name": name, "link": link}) + "\n")
+
     def split_text(self, data: List[Document]) -> List[Document]:
         return self.splitter.split_documents(data)
 
-    def save_info(self, name: str, data: List[Document]):
-        with open(self.path + name + ".pkl", "wb") as fp:
-            pickle.dump(data, fp)
+    def iter_chunks(self, file_path: str, source: str = None) -> Iterator[Document]:
+        return iter_chunks(file_path, source or file_path, self.splitter)
+
+    def chunks_path(self, name: str) -> str:
+        return self.path + name + ".chunks"
+
+    def has_info(self, name: str) -> bool:
+        return ChunkStore.exists(self.chunks_path(name)) or os.path.exists(
+            self.path + name + ".pkl"
+        )
+
+    def load_info(self, name: str) -> Optional[ChunkStore]:
+        """
+        Opens the chunk store of a whitepaper, converting a pickled list of
+        chunks saved by older versions on first access.
+
+        Returns:
+            Optional[ChunkStore]: None if the whitepaper was not ingested
+        """
+        path = self.chunks_path(name)
+        if not ChunkStore.exists(path):
+            legacy_path = self.path + name + ".pkl"
+            if not os.path.exists(legacy_path):
+                return None
+            with open(legacy_path, "rb") as fp:
+                data = pickle.load(fp)
+            self.save_info(name, data)
+            logger.info(f"Converted {legacy_path} to a chunk store")
+        return ChunkStore.open(path)
+
+    def save_info(self, name: str, data: Iterable[Document]) -> ChunkStore:
+        store = ChunkStore.write(self.chunks_path(name), data)
+        self.remove_legacy_info(name)
+        return store
+
+    def remove_legacy_info(self, name: str) -> None:
+        if os.path.exists(self.path + name + ".pkl"):
+            os.remove(self.path + name + ".pkl")
 
 
 class CMCLoader(BaseLoader):
-    def __init__(self):
+    def __init__(self, scheduler: RequestScheduler = None):
         self.cmc_client = coinmarketcapapi.CoinMarketCapAPI(os.getenv("CMC_API_KEY"))
+        self.scheduler = scheduler or get_scheduler()
         logger.info("CMCLoader initialized")
 
-    def get_cmc_list(self, start: int = 1, limit: int = 5) -> pd.DataFrame:
+    def get_cmc_list(
+        self,
+        start: int = 1,
+        limit: int = 5,
+        sleep_time: int = 35,
+        iters_wait: int = 2,
+    ) -> pd.DataFrame:
         logger.info(f"Fetching CMC list with limit {limit}")
-        response = self.cmc_client.cryptocurrency_listings_latest(
-            start=start, limit=limit
+        # листинг стоит 1 кредит за каждые 200 монет
+        response = self.scheduler.call(
+            "cmc",
+            self.cmc_client.cryptocurrency_listings_latest,
+            start=start,
+            limit=limit,
+            cost=-(-limit // 200),
+            retries=iters_wait - 1,
+            base_delay=sleep_time,
         )
         logger.info(f"Fetched {len(response.data)} items from CMC")
         return pd.DataFrame(response.data)
@@ -88,26 +328,21 @@ class CMCLoader(BaseLoader):
         sleep_time: int = 35,
         iters_wait: int = 2,
     ) -> pd.DataFrame:
-        cmc_list = None
+        chunks = []
         for start in tqdm(range(1, max_limit, step)):
-            exc_rate = 0
             try:
-                chunk = self.get_cmc_list(start, min(max_limit - start, step))
-                cmc_list = pd.concat([cmc_list, chunk])
+                chunks.append(
+                    self.get_cmc_list(
+                        start, min(max_limit - start, step), sleep_time, iters_wait
+                    )
+                )
             except Exception as e:
-                exc_rate += 1
-                logger.warning(
-                    "Error fetching cmc list info. "
-                    + f"Attempt {str(exc_rate)}. Error: {str(e)}"
+                logger.error(
+                    "Failed to fetch cmc list info "
+                    + f"after {iters_wait} attempts. Error: {str(e)}"
                 )
-                if exc_rate == iters_wait:
-                    logger.error(
-                        "Failed to fetch cmc list info."
-                        + f"after {iters_wait} attempts"
-                    )
-                    return
-                sleep(sleep_time)
-        return cmc_list
+                return
+        return pd.concat(chunks, ignore_index=True) if chunks else None
 
     @staticmethod
     def preprocess_data(data):
@@ -118,8 +353,6 @@ class CMCLoader(BaseLoader):
             i["technical_doc"] = i["technical_doc"][0] if i["technical_doc"] else " "
         return data
 
-        return data
-
     def get_info(
         self,
         cmc_detailed_info: pd.DataFrame,
@@ -132,51 +365,98 @@ class CMCLoader(BaseLoader):
 
         Args:
             sym (str): symbol to fetch info for
-            sleep_time (int): time to sleep between attempts in case of errors
+            sleep_time (int): first backoff delay between attempts in case of errors
             iters_wait (int): number of attempts to fetch info before giving up
 
         Returns:
             pd.DataFrame: DataFrame with detailed info, or None if failed to fetch
         """
         if sym not in cmc_detailed_info["symbol"].values:
-            exc_rate = 0
-            while True:
-                try:
-                    data = self.cmc_client.cryptocurrency_info(symbol=sym).data[sym]
-                    data = self.preprocess_data(data)
-                    logger.debug(f"Successfully fetched info for {sym}")
-                    cmc_detailed_info = pd.concat(
-                        [cmc_detailed_info, pd.DataFrame(data)]
-                    )
-                    return cmc_detailed_info
-                except Exception as e:
-                    exc_rate += 1
-                    logger.warning(
-                        f"Error fetching info for {sym}. "
-                        + f"Attempt {str(exc_rate)}. Error: {str(e)}"
-                    )
-                    if exc_rate == iters_wait:
-                        logger.error(
-                            f"Failed to fetch info for {sym}"
-                            + f"after {iters_wait} attempts"
-                        )
-                        return
-                    sleep(sleep_time)
+            data = self.fetch_info(sym, sleep_time=sleep_time, iters_wait=iters_wait)
+            if data is None:
+                return
+            return pd.concat([cmc_detailed_info, data])
         else:
             logger.info(f"Already fetched info for {sym}")
         return cmc_detailed_info
 
-    def get_info_by_name(
+    def fetch_info(
         self,
-        cmc_list: pd.DataFrame,
-        cmc_detailed_info: pd.DataFrame,
-        currency_name: str,
-    ):
-        sym_list = cmc_list[cmc_list["name"] == currency_name]["symbol"].tolist()
-        if sym_list:
-            return self.get_info(cmc_detailed_info=cmc_detailed_info, sym=sym_list[0])
-        else:
-            logger.warning(f"No symbol found for {currency_name}")
+        sym: str,
+        sleep_time: int = 35,
+        iters_wait: int = 2,
+    ) -> pd.DataFrame:
+        """
+        Fetches detailed info for a given symbol from CMC.
+
+        Returns:
+            pd.DataFrame: DataFrame with the new rows, or None if failed to fetch
+        """
+        try:
+            response = self.scheduler.call(
+                "cmc",
+                self.cmc_client.cryptocurrency_info,
+                symbol=sym,
+                retries=iters_wait - 1,
+                base_delay=sleep_time,
+            )
+        except Exception as e:
+            logger.error(
+                f"Failed to fetch info for {sym} "
+                + f"after {iters_wait} attempts. Error: {str(e)}"
+            )
+            return
+        items = (response.data or {}).get(sym)
+        if not items:
+            logger.warning(f"No info returned for {sym}")
+            return
+        data = self.preprocess_data(items)
+        logger.debug(f"Successfully fetched info for {sym}")
+        return pd.DataFrame(data)
+
+    def fetch_info_bulk(
+        self,
+        symbols: List[str],
+        batch_size: int = 100,
+        sleep_time: int = 35,
+        iters_wait: int = 2,
+    ) -> pd.DataFrame:
+        """
+        Fetches detailed info for many symbols, `batch_size` symbols per API call.
+
+        Args:
+            symbols (List[str]): symbols to fetch info for
+            batch_size (int): number of symbols in one request
+            sleep_time (int): first backoff delay between attempts in case of errors
+            iters_wait (int): number of attempts to fetch a batch before skipping it
+
+        Returns:
+            pd.DataFrame: DataFrame with detailed info of all fetched symbols
+        """
+        rows = []
+        for start in tqdm(range(0, len(symbols), batch_size)):
+            batch = symbols[start : start + batch_size]
+            try:
+                # skip_invalid: один неизвестный символ не валит весь запрос
+                data = self.scheduler.call(
+                    "cmc",
+                    self.cmc_client.cryptocurrency_info,
+                    symbol=",".join(batch),
+                    skip_invalid=True,
+                    cost=-(-len(batch) // 100),
+                    retries=iters_wait - 1,
+                    base_delay=sleep_time,
+                ).data
+            except Exception as e:
+                logger.error(
+                    f"Failed to fetch info for batch {start // batch_size} "
+                    + f"after {iters_wait} attempts. Error: {str(e)}"
+                )
+                continue
+            for items in data.values():
+                rows.extend(self.preprocess_data(items))
+        logger.info(f"Fetched info for {len(rows)} currencies")
+        return pd.DataFrame(rows)
 
     def get_info_batch(
         self,
@@ -184,19 +464,21 @@ class CMCLoader(BaseLoader):
         cmc_detailed_info: pd.DataFrame,
         sleep_time: int = 35,
         iters_wait: int = 2,
+        batch_size: int = 100,
     ):
         logger.info("Starting to fetch detailed info")
-        for sym in tqdm(cmc_list["symbol"].str.upper().unique()):
-            cmc_detailed_info = self.get_info(
-                cmc_list=cmc_list,
-                cmc_detailed_info=cmc_detailed_info,
-                sym=sym,
-                sleep_time=sleep_time,
-                iters_wait=iters_wait,
-            )
-
+        fetched = set(cmc_detailed_info["symbol"].str.upper())
+        symbols = [
+            sym for sym in cmc_list["symbol"].str.upper().unique() if sym not in fetched
+        ]
+        new_info = self.fetch_info_bulk(
+            symbols,
+            batch_size=batch_size,
+            sleep_time=sleep_time,
+            iters_wait=iters_wait,
+        )
         logger.info("Finished fetching detailed info")
-        return cmc_detailed_info
+        return pd.concat([cmc_detailed_info, new_info], ignore_index=True)
 
     def save_info(self):
         """
@@ -0,0 +1,75 @@
+import os
+import shutil
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterator
+
+try:
+    import fcntl
+except ImportError:
+    # на Windows блокировка только между потоками процесса
+    fcntl = None
+
+_registry_lock = threading.Lock()
+_locks: Dict[str, "_PathLock"] = {}
+
+
+class _PathLock:
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.depth = 0
+        self.fp = None
+
+
+@contextmanager
+def path_lock(path: str) -> Iterator[None]:
+    """
+    Exclusive lock of a file or directory, e.g. the index or the chunk store
+    of one currency. Threads of the process share one reentrant lock per
+    path, other processes are excluded through `<path>.lock` with flock.
+    """
+    path = os.path.abspath(path)
+    with _registry_lock:
+        lock = _locks.setdefault(path, _PathLock())
+    with lock.lock:
+        if lock.depth == 0 and fcntl is not None:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            lock.fp = open(path + ".lock", "a")
+            fcntl.flock(lock.fp, fcntl.LOCK_EX)
+        lock.depth += 1
+        try:
+            yield
+        finally:
+            lock.depth -= 1
+            if lock.depth == 0 and lock.fp is not None:
+                fcntl.flock(lock.fp, fcntl.LOCK_UN)
+                lock.fp.close()
+                lock.fp = None
+
+
+_swap_locks: Dict[str, threading.Lock] = {}
+
+
+def swap_lock(path: str) -> threading.Lock:
+    """
+    Lock held while a directory is swapped for its new version and while it
+    is read, so readers of the process never see it missing in between.
+    Unlike path_lock it is not held during a build.
+    """
+    path = os.path.abspath(path)
+    with _registry_lock:
+        return _swap_locks.setdefault(path, threading.Lock())
+
+
+def swap_dir(tmp_path: str, path: str) -> None:
+    """
+    Replaces the directory `path` with `tmp_path`. The caller holds the
+    path_lock of `path`, so concurrent writers don't remove each other's
+    directories.
+    """
+    old_path = tmp_path + ".old"
+    with swap_lock(path):
+        if os.path.exists(path):
+            os.replace(path, old_path)
+        os.replace(tmp_path, path)
+    shutil.rmtree(old_path, ignore_errors=True)
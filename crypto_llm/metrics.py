@@ -0,0 +1,250 @@
+import abc
+import logging
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterator, List, Optional
+
+import numpy as np
+
+logging.basicConfig(
+    level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+)
+logger = logging.getLogger(__name__)
+
+# границы корзин гистограммы длительностей, в секундах
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+@dataclass
+class Span:
+    """
+    Timing of one stage of a request. Numeric attributes are counters such as
+    the number of retrieved chunks, the others describe the request.
+    """
+
+    name: str
+    parent: Optional[str] = None
+    attributes: Dict[str, Any] = field(default_factory=dict)
+    started: float = field(default_factory=time.time)
+    duration: float = 0.0
+    error: Optional[str] = None
+
+    def set(self, **attributes) -> None:
+        self.attributes.update(attributes)
+
+    def counters(self) -> Dict[str, float]:
+        return {
+            key: value
+            for key, value in self.attributes.items()
+            if isinstance(value, (int, float)) and not isinstance(value, bool)
+        }
+
+
+class MetricsSink(abc.ABC):
+    @abc.abstractmethod
+    def record(self, span: Span) -> None:
+        pass
+
+
+class InMemorySink(MetricsSink):
+    """
+    Keeps the last `max_spans` spans and summarizes them by stage.
+    """
+
+    def __init__(self, max_spans: int = 10_000):
+        self.spans = deque(maxlen=max_spans)
+        self.lock = threading.Lock()
+
+    def record(self, span: Span) -> None:
+        with self.lock:
+            self.spans.append(span)
+
+    def clear(self) -> None:
+        with self.lock:
+            self.spans.clear()
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        """
+        Returns count, errors, p50/p99/max duration in milliseconds and the
+        mean of every counter for each stage.
+        """
+        with self.lock:
+            spans = list(self.spans)
+        by_stage: Dict[str, List[Span]] = {}
+        for span in spans:
+            by_stage.setdefault(span.name, []).append(span)
+        summary = {}
+        for stage, stage_spans in by_stage.items():
+            durations = np.array([span.duration for span in stage_spans]) * 1000
+            stats = {
+                "count": len(stage_spans),
+                "errors": sum(span.error is not None for span in stage_spans),
+                "p50_ms": float(np.percentile(durations, 50)),
+                "p99_ms": float(np.percentile(durations, 99)),
+                "max_ms": float(durations.max()),
+            }
+            counters: Dict[str, List[float]] = {}
+            for span in stage_spans:
+                for key, value in span.counters().items():
+                    counters.setdefault(key, []).append(value)
+            for key, values in counters.items():
+                stats[key + "_mean"] = float(np.mean(values))
+            summary[stage] = stats
+        return summary
+
+
+class PrometheusTextFileSink(MetricsSink):
+    """
+    Aggregates spans into Prometheus metrics and writes them in the text
+    exposition format to `path`, e.g. for the node_exporter textfile
+    collector. The file is rewritten at most every `flush_interval` seconds.
+    """
+
+    def __init__(
+        self, path: str, prefix: str = "crypto_llm", flush_interval: float = 10.0
+    ):
+        self.path = path
+        self.prefix = prefix
+        self.flush_interval = flush_interval
+        self.buckets: Dict[str, List[int]] = {}
+        self.sums: Dict[str, float] = {}
+        self.errors: Dict[str, int] = {}
+        self.counters: Dict[tuple, float] = {}
+        self.flushed = 0.0
+        self.lock = threading.Lock()
+
+    def record(self, span: Span) -> None:
+        with self.lock:
+            buckets = self.buckets.setdefault(
+                span.name, [0] * (len(DURATION_BUCKETS) + 1)
+            )
+            for i, bound in enumerate(DURATION_BUCKETS):
+                if span.duration <= bound:
+                    buckets[i] += 1
+            buckets[-1] += 1
+            self.sums[span.name] = self.sums.get(span.name, 0.0) + span.duration
+            if span.error is not None:
+                self.errors[span.name] = self.errors.get(span.name, 0) + 1
+            for key, value in span.counters().items():
+                self.counters[span.name, key] = (
+                    self.counters.get((span.name, key), 0.0) + value
+                )
+            if time.monotonic() - self.flushed >= self.flush_interval:
+                self._flush()
+
+    def flush(self) -> None:
+        with self.lock:
+            self._flush()
+
+    def render(self) -> str:
+        with self.lock:
+            return self._render()
+
+    def _render(self) -> str:
+        name = self.prefix + "_stage_duration_seconds"
+        lines = [f"# TYPE {name} histogram"]
+        for stage, buckets in sorted(self.buckets.items()):
+            for bound, count in zip(DURATION_BUCKETS, buckets):
+                lines.append(f'{name}_bucket{{stage="{stage}",le="{bound}"}} {count}')
+            lines.append(f'{name}_bucket{{stage="{stage}",le="+Inf"}} {buckets[-1]}')
+            lines.append(f'{name}_sum{{stage="{stage}"}} {self.sums[stage]}')
+            lines.append(f'{name}_count{{stage="{stage}"}} {buckets[-1]}')
+        name = self.prefix + "_stage_errors_total"
+        lines.append(f"# TYPE {name} counter")
+        for stage, count in sorted(self.errors.items()):
+            lines.append(f'{name}{{stage="{stage}"}} {count}')
+        name = self.prefix + "_stage_counter_total"
+        lines.append(f"# TYPE {name} counter")
+        for (stage, key), value in sorted(self.counters.items()):
+            lines.append(f'{name}{{stage="{stage}",counter="{key}"}} {value}')
+        return "\n".join(lines) + "\n"
+
+    def _flush(self) -> None:
+        # пишем во временный файл, чтобы коллектор не прочитал его наполовину
+        tmp_path = self.path + ".tmp"
+        try:
+            with open(tmp_path, "w") as fp:
+                fp.write(self._render())
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.warning(f"Error writing metrics to {self.path}. " + str(e))
+        self.flushed = time.monotonic()
+
+
+_current_span: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+
+
+class Tracer:
+    """
+    Measures the stages of a request and sends them to the metrics sinks.
+    """
+
+    def __init__(self, sinks: List[MetricsSink] = None):
+        self.memory = InMemorySink()
+        self.sinks: List[MetricsSink] = [self.memory] + list(sinks or [])
+
+    def add_sink(self, sink: MetricsSink) -> None:
+        self.sinks.append(sink)
+
+    @contextmanager
+    def span(self, name: str, **attributes) -> Iterator[Span]:
+        """
+        Times the enclosed block as a stage named `name`. Spans opened inside
+        the block get it as their parent.
+        """
+        parent = _current_span.get()
+        span = Span(name, parent.name if parent else None, attributes)
+        token = _current_span.set(span)
+        start = time.perf_counter()
+        try:
+            yield span
+        except BaseException as e:
+            # закрытый клиентом стрим ошибкой не считаем
+            if not isinstance(e, GeneratorExit):
+                span.error = type(e).__name__
+            raise
+        finally:
+            span.duration = time.perf_counter() - start
+            try:
+                _current_span.reset(token)
+            except ValueError:
+                # генератор возобновили в другом контексте
+                pass
+            self.record(span)
+
+    def current(self) -> Optional[Span]:
+        return _current_span.get()
+
+    def record(self, span: Span) -> None:
+        logger.debug(
+            "Span %s: %.1fms %s", span.name, span.duration * 1000, span.attributes
+        )
+        for sink in self.sinks:
+            try:
+                sink.record(span)
+            except Exception as e:
+                logger.warning(f"Error recording span {span.name}. " + str(e))
+
+
+_tracer = None
+_tracer_lock = threading.Lock()
+
+
+def get_tracer() -> Tracer:
+    """
+    Returns the process-wide Tracer, creating it on first use. If the
+    METRICS_TEXTFILE variable is set, metrics are also written to that file
+    in the Prometheus text format.
+    """
+    global _tracer
+    with _tracer_lock:
+        if _tracer is None:
+            _tracer = Tracer()
+            if os.getenv("METRICS_TEXTFILE"):
+                _tracer.add_sink(PrometheusTextFileSink(os.getenv("METRICS_TEXTFILE")))
+    return _tracer
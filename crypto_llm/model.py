@@ -1,7 +1,16 @@
 import abc
+import asyncio
 import logging
 import os
+import threading
+from typing import AsyncIterator, Iterator
+import aiohttp
+import requests
+from pydantic import PrivateAttr
+from requests.adapters import HTTPAdapter
+from langchain_core.outputs import ChatGenerationChunk
 from langchain_nvidia_ai_endpoints import ChatNVIDIA
+from crypto_llm.scheduler import HTTPStatusError, RequestScheduler, get_scheduler
 
 logging.basicConfig(
     level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
@@ -9,18 +18,157 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
+class HttpPool:
+    """
+    HTTP connections shared by all NVIDIA clients of the process.
+
+    The NVIDIA SDK opens a new session for every request; installing the pool
+    makes it reuse keep-alive connections instead. Sessions are still created
+    by the SDK, so its SSL verification and other settings are kept, only
+    their connection pools are replaced. Error responses raise
+    HTTPStatusError, so the request scheduler sees their status and headers.
+    """
+
+    def __init__(self, pool_size: int = 32):
+        self.pool_size = pool_size
+        # один пул соединений на сессии всех клиентов
+        self.adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session = self.pooled(requests.Session())
+        # aiohttp-коннектор привязан к event loop, поэтому храним по одному
+        # на loop и настройку SSL
+        self.connectors = {}
+        self.lock = threading.Lock()
+
+    def pooled(self, session: requests.Session) -> requests.Session:
+        """
+        Makes a session use the shared connection pool.
+        """
+        if self.raise_for_status not in session.hooks["response"]:
+            session.mount("https://", self.adapter)
+            session.mount("http://", self.adapter)
+            session.hooks["response"].append(self.raise_for_status)
+        return session
+
+    def get_session(self) -> requests.Session:
+        return self.session
+
+    def get_async_session(self, ssl=True) -> aiohttp.ClientSession:
+        """
+        Args:
+            ssl: SSL setting of the aiohttp connector, as the SDK builds it
+                from `verify_ssl`
+        """
+        loop = asyncio.get_running_loop()
+        with self.lock:
+            connector = self.connectors.get((loop, ssl))
+            if connector is None or connector.closed:
+                connector = aiohttp.TCPConnector(limit=self.pool_size, ssl=ssl)
+                self.connectors[(loop, ssl)] = connector
+        # SDK закрывает сессию после запроса, а соединения остаются в коннекторе
+        return aiohttp.ClientSession(
+            connector=connector,
+            connector_owner=False,
+            raise_for_status=self.araise_for_status,
+        )
+
+    @staticmethod
+    def raise_for_status(response: requests.Response, *args, **kwargs) -> None:
+        if response.status_code >= 400:
+            raise HTTPStatusError(response.status_code, response.headers, response.text)
+
+    @staticmethod
+    async def araise_for_status(response: aiohttp.ClientResponse) -> None:
+        if response.status >= 400:
+            raise HTTPStatusError(
+                response.status, response.headers, await response.text()
+            )
+
+    def install(self, nvidia_object) -> None:
+        """
+        Makes a ChatNVIDIA or NVIDIAEmbeddings instance use the pool.
+        """
+        client = getattr(nvidia_object, "_client", None)
+        if client is None:
+            logger.warning("Can't install HTTP pool on %s", type(nvidia_object))
+            return
+        # сессию создает фабрика SDK, пул только меняет ее соединения
+        session = self.pooled(client.get_session_fn())
+        client.get_session_fn = lambda: session
+        # SDK строит SSL-контекст из verify_ssl в своей фабрике aiohttp-сессий
+        build_ssl_context = getattr(client, "_build_ssl_context", None)
+        ssl = build_ssl_context() if build_ssl_context else True
+        client.get_async_session_fn = lambda: self.get_async_session(ssl)
+
+
+_http_pool = None
+_http_pool_lock = threading.Lock()
+
+
+def get_http_pool() -> HttpPool:
+    global _http_pool
+    with _http_pool_lock:
+        if _http_pool is None:
+            _http_pool = HttpPool()
+    return _http_pool
+
+
 class BaseModel(abc.ABC):
     @abc.abstractmethod
     def get_model(self):
         pass
 
 
+class ScheduledChatNVIDIA(ChatNVIDIA):
+    """
+    ChatNVIDIA whose requests are throttled and retried by the request
+    scheduler like the other API calls. A stream is retried only until its
+    first chunk, a later retry would repeat the text already sent.
+    """
+
+    endpoint: str = "nvidia_chat"
+    _scheduler: RequestScheduler = PrivateAttr(default_factory=get_scheduler)
+
+    def _generate(self, *args, **kwargs):
+        return self._scheduler.call(self.endpoint, super()._generate, *args, **kwargs)
+
+    async def _agenerate(self, *args, **kwargs):
+        return await self._scheduler.acall(
+            self.endpoint, super()._agenerate, *args, **kwargs
+        )
+
+    def _stream(self, *args, **kwargs) -> Iterator[ChatGenerationChunk]:
+        def start():
+            chunks = super(ScheduledChatNVIDIA, self)._stream(*args, **kwargs)
+            return next(chunks, None), chunks
+
+        first, chunks = self._scheduler.call(self.endpoint, start)
+        if first is not None:
+            yield first
+            yield from chunks
+
+    async def _astream(self, *args, **kwargs) -> AsyncIterator[ChatGenerationChunk]:
+        async def start():
+            chunks = super(ScheduledChatNVIDIA, self)._astream(*args, **kwargs)
+            try:
+                return await chunks.__anext__(), chunks
+            except StopAsyncIteration:
+                return None, chunks
+
+        first, chunks = await self._scheduler.acall(self.endpoint, start)
+        if first is not None:
+            yield first
+            async for chunk in chunks:
+                yield chunk
+
+
 class NvidiaModel(BaseModel):
     def __init__(self, model_name: str = "meta/llama-3.1-405b-instruct"):
         self.model_name = model_name
-        self.llm = ChatNVIDIA(
-            model=self.model_name, nvidia_api_key=os.getenv("NVIDIA_API_KEY")
+        self.llm = ScheduledChatNVIDIA(
+            model=self.model_name,
+            nvidia_api_key=os.getenv("NVIDIA_API_KEY"),
         )
+        get_http_pool().install(self.llm)
         logger.info("NvidiaModel initialized with model: %s", model_name)
 
     def get_model(self):
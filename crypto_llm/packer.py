@@ -0,0 +1,204 @@
+import logging
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional
+
+if TYPE_CHECKING:
+    from langchain_core.documents import Document
+
+logging.basicConfig(
+    level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+)
+logger = logging.getLogger(__name__)
+
+
+def estimate_tokens(text: str) -> int:
+    # грубая оценка без токенизатора модели: ~4 символа на токен
+    return len(text) // 4 + 1
+
+
+@dataclass
+class PackedContext:
+    text: str
+    fragments: List[str] = field(default_factory=list)
+    tokens: int = 0
+    # токены, которые дал бы простой join всех чанков, минус итоговые
+    tokens_saved: int = 0
+    chunks: int = 0
+    duplicates: int = 0
+    dropped: int = 0
+
+
+@dataclass
+class _Fragment:
+    doc: "Document"
+    text: str
+    # номер фрагмента, после которого этот шел в исходном тексте
+    previous: Optional[int] = None
+
+
+class ContextPacker:
+    """
+    Builds the LLM context from retrieved chunks within a token budget.
+
+    Chunks are taken in the order the retriever ranked them. Exact duplicates
+    are skipped, and the text that a chunk shares with an already taken
+    neighbour (the splitter overlap) is cut off, so it appears only once.
+    Chunks that don't fit into the rest of the budget are dropped.
+    """
+
+    def __init__(
+        self,
+        max_tokens: Optional[int] = 3000,
+        min_overlap: int = 20,
+        max_overlap: int = 200,
+        separator: str = "\n\n",
+        count_tokens: Callable[[str], int] = estimate_tokens,
+    ):
+        """
+        Args:
+            max_tokens (int, optional): token budget of the context, None for
+                no limit
+            min_overlap (int): shortest common text of two chunks, in chars,
+                treated as an overlap
+            max_overlap (int): longest overlap to look for, in chars; should be
+                at least the chunk_overlap of the splitter
+            separator (str): text between the chunks of the context
+            count_tokens (Callable): token counter of the model
+        """
+        self.max_tokens = max_tokens
+        self.min_overlap = min_overlap
+        self.max_overlap = max_overlap
+        self.separator = separator
+        self.count_tokens = count_tokens
+
+    def _overlap_before(
+        self, text: str, tails: Dict[str, List[int]], originals: List[str]
+    ) -> tuple:
+        """
+        Longest prefix of `text` that is a suffix of a taken chunk.
+        """
+        m = self.min_overlap
+        for length in range(min(self.max_overlap, len(text)), m - 1, -1):
+            for i in tails.get(text[length - m : length], ()):
+                if originals[i].endswith(text[:length]):
+                    return length, i
+        return 0, None
+
+    def _overlap_after(
+        self, text: str, heads: Dict[str, List[int]], originals: List[str]
+    ) -> tuple:
+        """
+        Longest suffix of `text` that is a prefix of a taken chunk.
+        """
+        m = self.min_overlap
+        for length in range(min(self.max_overlap, len(text)), m - 1, -1):
+            start = len(text) - length
+            for i in heads.get(text[start : start + m], ()):
+                if originals[i].startswith(text[start:]):
+                    return length, i
+        return 0, None
+
+    def _document_order(self, fragments: List[_Fragment]) -> List[_Fragment]:
+        """
+        Restores the order of the fragments in the whitepaper: chains of
+        overlapping neighbours are kept together and sorted by page.
+        """
+        following = {}
+        for i, fragment in enumerate(fragments):
+            if fragment.previous is not None:
+                following.setdefault(fragment.previous, i)
+        starts = [
+            i
+            for i, fragment in enumerate(fragments)
+            if fragment.previous is None or following.get(fragment.previous) != i
+        ]
+        starts.sort(
+            key=lambda i: (
+                str(fragments[i].doc.metadata.get("source", "")),
+                fragments[i].doc.metadata.get("page", 0),
+                i,
+            )
+        )
+        ordered, seen = [], set()
+        for i in starts + list(range(len(fragments))):
+            while i is not None and i not in seen:
+                seen.add(i)
+                ordered.append(fragments[i])
+                i = following.get(i)
+        return ordered
+
+    def pack(
+        self,
+        docs: List["Document"],
+        max_tokens: Optional[int] = -1,
+        order: str = "relevance",
+    ) -> PackedContext:
+        """
+        Packs chunks ranked by relevance into a context.
+
+        Args:
+            docs (List[Document]): chunks, most relevant first
+            max_tokens (int, optional): token budget, None for no limit.
+                Defaults to the budget of the packer
+            order (str): "relevance" keeps the ranking in the context,
+                "document" restores the order of the text in the whitepaper
+
+        Returns:
+            PackedContext: the context and packing statistics
+        """
+        if order not in ("relevance", "document"):
+            raise ValueError(f"Unknown order: {order}")
+        if max_tokens == -1:
+            max_tokens = self.max_tokens
+        m = self.min_overlap
+        originals, fragments = [], []
+        tails: Dict[str, List[int]] = {}
+        heads: Dict[str, List[int]] = {}
+        seen, tokens = set(), 0
+        separator_tokens = self.count_tokens(self.separator)
+        duplicates = dropped = 0
+
+        for doc in docs:
+            text = doc.page_content
+            if text in seen:
+                duplicates += 1
+                continue
+            start, previous = self._overlap_before(text, tails, originals)
+            cut, following = self._overlap_after(text, heads, originals)
+            fragment = text[start : max(start, len(text) - cut)].strip()
+            if not fragment:
+                duplicates += 1
+                continue
+            fragment_tokens = self.count_tokens(fragment) + (
+                separator_tokens if fragments else 0
+            )
+            if max_tokens is not None and tokens + fragment_tokens > max_tokens:
+                dropped += 1
+                continue
+
+            seen.add(text)
+            tokens += fragment_tokens
+            position = len(fragments)
+            fragments.append(_Fragment(doc, fragment, previous))
+            if following is not None and fragments[following].previous is None:
+                fragments[following].previous = position
+            originals.append(text)
+            if len(text) >= m:
+                tails.setdefault(text[-m:], []).append(position)
+                heads.setdefault(text[:m], []).append(position)
+
+        if order == "document":
+            fragments = self._document_order(fragments)
+        texts = [fragment.text for fragment in fragments]
+        context = self.separator.join(texts)
+        naive = self.separator.join(doc.page_content for doc in docs)
+        packed = PackedContext(
+            text=context,
+            fragments=texts,
+            tokens=self.count_tokens(context),
+            chunks=len(fragments),
+            duplicates=duplicates,
+            dropped=dropped,
+        )
+        packed.tokens_saved = max(0, self.count_tokens(naive) - packed.tokens)
+        return packed
@@ -1,16 +1,28 @@
 import abc
-from langchain.prompts.chat import ChatPromptTemplate
+import hashlib
+
+
+def chat_prompt(template: str):
+    # langchain загружаем только когда промпт действительно строится
+    from langchain_core.prompts import ChatPromptTemplate
+
+    return ChatPromptTemplate.from_template(template)
 
 
 class BasePrompter(abc.ABC):
+    template: str
+
+    @classmethod
+    def template_hash(cls) -> str:
+        return hashlib.sha1(cls.template.encode()).hexdigest()
+
     @abc.abstractmethod
     def get_prompt(self):
         pass
 
 
 class SummaryPrompter(BasePrompter):
-    def __init__(self):
-        self.template = """
+    template = """
             Ответить на вопрос, основываясь только на следующем контексте. 
             Кратко изложите наиболее важную информацию о криптовалюте, описанной в whitepaper, сосредоточившись на ее основных функциях, технологии, вариантах использования и потенциале. 
             **Ограничьте свой ответ максимум 1000 символами.** 
@@ -30,15 +42,36 @@ class SummaryPrompter(BasePrompter):
             Ответ:
             """
 
-        self.prompt = ChatPromptTemplate.from_template(self.template)
+    def __init__(self):
+        self.prompt = chat_prompt(self.template)
 
     def get_prompt(self):
         return self.prompt
 
 
-class QuestionPrompter(BasePrompter):
+class MapSummaryPrompter(BasePrompter):
+    template = """
+            Ниже приведен фрагмент whitepaper криптовалюты.
+            Кратко перечислите самые важные факты из этого фрагмента: функции, технологию, варианты использования и потенциал.
+            **Используйте только информацию из фрагмента.**
+            **Отвечайте на русском языке.**
+
+            Фрагмент:
+
+            {context}
+
+            Краткое содержание фрагмента:
+            """
+
     def __init__(self):
-        self.template = """
+        self.prompt = chat_prompt(self.template)
+
+    def get_prompt(self):
+        return self.prompt
+
+
+class QuestionPrompter(BasePrompter):
+    template = """
         Answer the question based only on the following context. Keep the answer short and concise.
         **Provide only the most relevant and concise answer.** 
         Do not generate any additional text unless explicitly asked to do so.
@@ -49,7 +82,9 @@ class QuestionPrompter(BasePrompter):
 
         Question: {question}
         """
-        self.prompt = ChatPromptTemplate.from_template(self.template)
+
+    def __init__(self):
+        self.prompt = chat_prompt(self.template)
 
     def get_prompt(self, mode="base"):
         return self.prompt
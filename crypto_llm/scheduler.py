@@ -0,0 +1,314 @@
+import asyncio
+import logging
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+import aiohttp
+import requests
+
+logging.basicConfig(
+    level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+)
+logger = logging.getLogger(__name__)
+
+# запросов в секунду, размер пачки и бюджет кредитов за период
+DEFAULT_LIMITS = {
+    # Basic план CMC: 30 запросов в минуту и 10 000 кредитов в месяц
+    "cmc": {"rate": 0.5, "burst": 5, "budget": 10_000, "period": 30 * 86400},
+    "nvidia_embed": {"rate": 40 / 60, "burst": 10},
+    "nvidia_chat": {"rate": 40 / 60, "burst": 5},
+}
+
+
+# ошибки без ответа сервера, которые имеет смысл повторить
+NETWORK_ERRORS = (
+    ConnectionError,
+    TimeoutError,
+    requests.ConnectionError,
+    requests.Timeout,
+    aiohttp.ClientConnectionError,
+)
+
+
+class BudgetExceededError(Exception):
+    pass
+
+
+class HTTPStatusError(Exception):
+    """
+    Error response of an HTTP API with its status and headers. The NVIDIA SDK
+    raises errors without the response, so the HTTP pool raises this one for
+    the scheduler to decide on retries.
+    """
+
+    def __init__(self, status_code: int, headers: Dict[str, str], message: str = ""):
+        super().__init__(f"[{status_code}] {message}".strip())
+        self.status_code = status_code
+        self.headers = headers
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, cost: float = 1.0) -> float:
+        """
+        Takes `cost` tokens and returns how long the caller must wait for them.
+        """
+        with self.lock:
+            self._refill()
+            self.tokens -= cost
+            return max(0.0, -self.tokens / self.rate)
+
+    def try_take(self, cost: float = 1.0) -> bool:
+        with self.lock:
+            self._refill()
+            if self.tokens < cost:
+                return False
+            self.tokens -= cost
+            return True
+
+
+class RequestScheduler:
+    """
+    Throttles and retries calls to external APIs.
+
+    Every endpoint has a token bucket for its request rate and an optional
+    credit budget. Network errors and responses with status 429 or 5xx are
+    retried with exponential backoff with full jitter, a Retry-After header
+    of the failed response takes precedence. Errors without a response, like
+    bugs in the caller, are not retried.
+    """
+
+    def __init__(
+        self,
+        limits: Dict[str, Dict] = None,
+        retries: int = 4,
+        base_delay: float = 1.0,
+        max_delay: float = 120.0,
+    ):
+        self.limits = limits or DEFAULT_LIMITS
+        self.retries = retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.buckets: Dict[str, TokenBucket] = {}
+        self.budgets: Dict[str, TokenBucket] = {}
+        self.stats: Dict[str, Dict[str, float]] = {}
+        self.lock = threading.Lock()
+
+    def _endpoint(self, endpoint: str):
+        with self.lock:
+            if endpoint not in self.buckets:
+                limit = self.limits.get(endpoint, {"rate": 1.0, "burst": 1})
+                self.buckets[endpoint] = TokenBucket(limit["rate"], limit["burst"])
+                if limit.get("budget"):
+                    self.budgets[endpoint] = TokenBucket(
+                        limit["budget"] / limit["period"], limit["budget"]
+                    )
+                self.stats[endpoint] = {
+                    "requests": 0,
+                    "retries": 0,
+                    "throttled": 0,
+                    "failures": 0,
+                    "queue_wait": 0.0,
+                    "queue_wait_max": 0.0,
+                }
+            return self.buckets[endpoint], self.budgets.get(endpoint)
+
+    def _count(self, endpoint: str, key: str, value: float = 1) -> None:
+        with self.lock:
+            self.stats[endpoint][key] += value
+
+    def reserve(self, endpoint: str, cost: float = 1.0) -> float:
+        """
+        Reserves a request slot and returns the time to wait before sending it.
+
+        Raises:
+            BudgetExceededError: if the credit budget of the endpoint is spent.
+        """
+        bucket, budget = self._endpoint(endpoint)
+        if budget is not None and not budget.try_take(cost):
+            raise BudgetExceededError(f"Credit budget of {endpoint} is exhausted")
+        wait = bucket.reserve(1.0)
+        with self.lock:
+            stats = self.stats[endpoint]
+            stats["requests"] += 1
+            stats["queue_wait"] += wait
+            stats["queue_wait_max"] = max(stats["queue_wait_max"], wait)
+            if wait > 0:
+                stats["throttled"] += 1
+        return wait
+
+    def acquire(self, endpoint: str, cost: float = 1.0) -> None:
+        wait = self.reserve(endpoint, cost)
+        if wait > 0:
+            time.sleep(wait)
+
+    async def aacquire(self, endpoint: str, cost: float = 1.0) -> None:
+        wait = self.reserve(endpoint, cost)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    @staticmethod
+    def _response(e: Exception):
+        """
+        Returns:
+            the failed response or HTTPStatusError with `status_code` and
+                `headers`, None if the error has no response
+        """
+        while e is not None:
+            if isinstance(e, HTTPStatusError):
+                return e
+            # requests/httpx кладут ответ в .response, coinmarketcapapi - в .rep._req
+            response = getattr(e, "response", None)
+            if response is None and getattr(e, "rep", None) is not None:
+                response = getattr(e.rep, "_req", None)
+            if response is not None:
+                return response
+            # SDK NVIDIA скрывает ошибку requests через `from None`,
+            # но она остается в __context__
+            e = e.__cause__ or e.__context__
+        return None
+
+    def is_retryable(self, e: Exception) -> bool:
+        if isinstance(e, BudgetExceededError):
+            return False
+        response = self._response(e)
+        if response is None:
+            return isinstance(e, NETWORK_ERRORS)
+        status = getattr(response, "status_code", None)
+        return status is not None and (status == 429 or status >= 500)
+
+    def retry_after(self, e: Exception) -> Optional[float]:
+        response = self._response(e)
+        value = (getattr(response, "headers", None) or {}).get("Retry-After")
+        if value is None:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+    def backoff(self, attempt: int, base_delay: float = None) -> float:
+        base_delay = self.base_delay if base_delay is None else base_delay
+        return random.uniform(0, min(self.max_delay, base_delay * 2**attempt))
+
+    def call(
+        self,
+        endpoint: str,
+        fn: Callable,
+        *args,
+        cost: float = 1.0,
+        retries: int = None,
+        base_delay: float = None,
+        **kwargs,
+    ) -> Any:
+        """
+        Calls `fn(*args, **kwargs)` within the limits of `endpoint`, retrying
+        retryable errors.
+
+        Args:
+            endpoint (str): name of the endpoint in `limits`
+            fn (Callable): the API call
+            cost (float): credits the call spends from the endpoint budget
+            retries (int): number of retries, defaults to `self.retries`
+            base_delay (float): first backoff delay, defaults to `self.base_delay`
+
+        Returns:
+            Any: result of `fn`
+        """
+        retries = self.retries if retries is None else retries
+        for attempt in range(retries + 1):
+            self.acquire(endpoint, cost)
+            try:
+                return fn(*args, **kwargs)
+            except Exception as e:
+                delay = self._retry_delay(endpoint, e, attempt, retries, base_delay)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+
+    async def acall(
+        self,
+        endpoint: str,
+        fn: Callable[..., Awaitable],
+        *args,
+        cost: float = 1.0,
+        retries: int = None,
+        base_delay: float = None,
+        **kwargs,
+    ) -> Any:
+        """
+        Async version of call() for coroutine functions.
+        """
+        retries = self.retries if retries is None else retries
+        for attempt in range(retries + 1):
+            await self.aacquire(endpoint, cost)
+            try:
+                return await fn(*args, **kwargs)
+            except Exception as e:
+                delay = self._retry_delay(endpoint, e, attempt, retries, base_delay)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+
+    def _retry_delay(
+        self,
+        endpoint: str,
+        e: Exception,
+        attempt: int,
+        retries: int,
+        base_delay: Optional[float],
+    ) -> Optional[float]:
+        """
+        Returns:
+            Optional[float]: seconds to wait before the next attempt, None if
+                the error is final
+        """
+        if attempt == retries or not self.is_retryable(e):
+            self._count(endpoint, "failures")
+            return None
+        delay = self.retry_after(e)
+        if delay is None:
+            delay = self.backoff(attempt, base_delay)
+        self._count(endpoint, "retries")
+        logger.warning(
+            f"Error calling {endpoint}, attempt {attempt + 1}. "
+            + f"Retrying in {delay:.1f}s. Error: {str(e)}"
+        )
+        return delay
+
+    def metrics(self) -> Dict[str, Dict[str, float]]:
+        with self.lock:
+            return {endpoint: dict(stats) for endpoint, stats in self.stats.items()}
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler() -> RequestScheduler:
+    """
+    Returns the process-wide RequestScheduler, creating it on first use.
+    """
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = RequestScheduler()
+    return _scheduler
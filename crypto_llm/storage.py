@@ -1,9 +1,13 @@
 import abc
 import logging
 import os
+import threading
+import time
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 from crypto_llm.loader import WhitePaperLoader, CMCLoader
-from typing import List
+from typing import Dict, List
 
 logging.basicConfig(
     level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
@@ -29,19 +33,66 @@ class BaseStorage(abc.ABC):
         pass
 
 
+# колонки, которые нужны для поиска whitepaper; остальные остаются только на диске
+CMC_LIST_COLUMNS = ["id", "name", "symbol", "cmc_rank"]
+CMC_INFO_COLUMNS = ["name", "symbol", "technical_doc", "has_pdf_whitepaper"]
+
+
+def write_parquet(df: pd.DataFrame, path: str, metadata: Dict = None) -> None:
+    """
+    Atomically writes a DataFrame to parquet, optionally with key-value
+    metadata in the file schema.
+    """
+    df = df.reset_index(drop=True).copy()
+    for column in df.select_dtypes(include="object").columns:
+        # ответы API содержат словари и списки, храним их строками как в csv
+        df[column] = df[column].astype("string")
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    if metadata:
+        table = table.replace_schema_metadata(
+            {**(table.schema.metadata or {}), **metadata}
+        )
+    tmp_path = path + ".tmp"
+    pq.write_table(table, tmp_path)
+    os.replace(tmp_path, path)
+
+
+def read_parquet(path: str, columns: List[str]) -> pa.Table:
+    """
+    Reads only the given columns that are present in a parquet file.
+    """
+    names = pq.read_schema(path).names
+    return pq.read_table(path, columns=[c for c in columns if c in names])
+
+
 class FileStorage(BaseStorage):
-    def __init__(self):
+    def __init__(
+        self,
+        cmc_list_ttl: int = 24 * 60 * 60,
+        refresh: bool = False,
+        cmc_loader: CMCLoader = None,
+    ):
+        """
+        Args:
+            cmc_list_ttl (int): max age in seconds of the CMC listing snapshot
+                before it is fetched again from the API
+            refresh (bool): ignore the snapshot and fetch the listing right away
+            cmc_loader (CMCLoader): loader to use instead of a new CMCLoader
+        """
         self.wp_loader = WhitePaperLoader()
-        self.cmc_loader = CMCLoader()
+        self.cmc_loader = cmc_loader or CMCLoader()
         self.path = os.getenv("DATA_PATH") + "sources/cmc/"
-        self.cmc_list_path = os.path.join(self.path, "cmc_list.csv")
-        self.cmc_detailed_info_path = os.path.join(self.path, "cmc_info.csv")
-        self.cmc_list = self.get_all_cmc_list()
-        self.cmc_detailed_info = (
-            pd.read_csv(self.cmc_detailed_info_path)
-            if os.path.exists(self.cmc_detailed_info_path)
-            else pd.DataFrame(columns=["symbol", "name"])
-        )
+        self.cmc_list_snapshot_path = os.path.join(self.path, "cmc_list.parquet")
+        self.cmc_detailed_info_path = os.path.join(self.path, "cmc_info.parquet")
+        self.cmc_detailed_info_csv_path = os.path.join(self.path, "cmc_info.csv")
+        self.cmc_list_ttl = cmc_list_ttl
+        # хранилище общее для процесса, а CMC-таблицы меняются на месте
+        self.lock = threading.RLock()
+        self.cmc_list = self.load_cmc_list(refresh=refresh)
+        self.cmc_detailed_info = self.load_cmc_info()
+        # новые строки со всеми колонками ответа API, ждут save_cmc_info
+        self.new_cmc_info = []
+        self.index_cmc_info()
         self.pdf_correct_names = pd.read_csv(self.path + "pdf_correct_names.csv")[
             "names"
         ].tolist()
@@ -53,55 +104,203 @@ class FileStorage(BaseStorage):
         step=5_000,
         sleep_time: int = 35,
         iters_wait: int = 2,
-    ) -> None:
-        self.cmc_list = self.cmc_loader.get_all_cmc_list(
+    ) -> pd.DataFrame:
+        """
+        Fetches the full CMC listing from the API and stores it as a snapshot.
+        """
+        cmc_list = self.cmc_loader.get_all_cmc_list(
             max_limit, step, sleep_time, iters_wait
         )
+        if cmc_list is not None:
+            self.cmc_list = cmc_list[
+                [c for c in CMC_LIST_COLUMNS if c in cmc_list.columns]
+            ].reset_index(drop=True)
+            self.save_cmc_list_snapshot()
+            self.index_cmc_list()
+        return cmc_list
+
+    def load_cmc_list(self, refresh: bool = False) -> pd.DataFrame:
+        """
+        Loads the CMC listing from the snapshot on disk if it is younger than
+        `cmc_list_ttl`, otherwise fetches it from the API.
+
+        Args:
+            refresh (bool): skip the snapshot and fetch the listing from the API
+
+        Returns:
+            pd.DataFrame: CMC listing, a stale snapshot if the API call failed,
+                an empty listing if there is no snapshot either
+        """
+        snapshot = self.load_cmc_list_snapshot()
+        if snapshot is not None and not refresh:
+            age = time.time() - snapshot["fetched_at"]
+            if age < self.cmc_list_ttl:
+                logger.info(f"Loaded CMC list snapshot, age {int(age)}s")
+                self.cmc_list = snapshot["cmc_list"]
+                self.index_cmc_list()
+                return self.cmc_list
+            logger.info(f"CMC list snapshot is stale, age {int(age)}s")
+        if self.get_all_cmc_list() is None:
+            if snapshot is not None:
+                logger.warning("Failed to refresh CMC list, using stale snapshot")
+                self.cmc_list = snapshot["cmc_list"]
+            else:
+                # первый запуск без доступа к API: работаем с пустым списком
+                logger.error("Failed to fetch CMC list and no snapshot is saved")
+                self.cmc_list = pd.DataFrame(columns=CMC_LIST_COLUMNS)
+            self.index_cmc_list()
         return self.cmc_list
 
+    def load_cmc_list_snapshot(self):
+        if not os.path.exists(self.cmc_list_snapshot_path):
+            return None
+        try:
+            table = read_parquet(self.cmc_list_snapshot_path, CMC_LIST_COLUMNS)
+            return {
+                "fetched_at": float(table.schema.metadata[b"fetched_at"]),
+                "cmc_list": table.to_pandas(),
+            }
+        except Exception as e:
+            logger.warning("Error reading CMC list snapshot. " + str(e))
+            return None
+
+    def save_cmc_list_snapshot(self) -> None:
+        write_parquet(
+            self.cmc_list,
+            self.cmc_list_snapshot_path,
+            metadata={b"fetched_at": str(time.time()).encode()},
+        )
+        logger.info(f"Saved CMC list snapshot to {self.cmc_list_snapshot_path}")
+
+    def index_cmc_list(self) -> None:
+        self.symbol_by_name = {}
+        for name, symbol in zip(self.cmc_list["name"], self.cmc_list["symbol"]):
+            self.symbol_by_name.setdefault(name, symbol)
+
+    def load_cmc_info(self) -> pd.DataFrame:
+        """
+        Loads the columns of the detailed CMC info needed for lookups.
+        The legacy csv file is converted to parquet on first start.
+        """
+        if not os.path.exists(self.cmc_detailed_info_path):
+            if not os.path.exists(self.cmc_detailed_info_csv_path):
+                return pd.DataFrame(columns=CMC_INFO_COLUMNS)
+            logger.info("Converting detailed CMC info from csv to parquet")
+            cmc_info = pd.read_csv(self.cmc_detailed_info_csv_path)
+            cmc_info["has_pdf_whitepaper"] = self.has_pdf_whitepaper(cmc_info)
+            write_parquet(cmc_info, self.cmc_detailed_info_path)
+        cmc_info = read_parquet(self.cmc_detailed_info_path, CMC_INFO_COLUMNS)
+        return cmc_info.to_pandas()
+
+    @staticmethod
+    def has_pdf_whitepaper(cmc_info: pd.DataFrame) -> pd.Series:
+        return cmc_info["technical_doc"].fillna("").astype(str).str.endswith(".pdf")
+
+    def index_cmc_info(self, start: int = 0) -> None:
+        """
+        Updates the name -> rows and symbol indexes with rows from `start` on.
+        """
+        if start == 0:
+            self.info_rows_by_name = {}
+            self.info_symbols = set()
+        names = self.cmc_detailed_info["name"].tolist()[start:]
+        symbols = self.cmc_detailed_info["symbol"].tolist()[start:]
+        for row, (name, symbol) in enumerate(zip(names, symbols), start):
+            self.info_rows_by_name.setdefault(name, []).append(row)
+            self.info_symbols.add(symbol)
+
     def get_wp_info(self, currency_name: str, pdf_link: str):
         return self.wp_loader.get_info(name=currency_name, link=pdf_link)
 
     def get_symbol_by_name(self, currency_name: str) -> None:
-        self.cmc_detailed_info = self.cmc_loader.get_info_by_name(
-            cmc_detailed_info=self.cmc_detailed_info,
-            cmc_list=self.cmc_list,
-            currency_name=currency_name,
-        )
+        self.get_symbols_by_names([currency_name])
+
+    def get_symbols_by_names(
+        self, currency_names: List[str], batch_size: int = 100
+    ) -> None:
+        """
+        Fetches detailed CMC info for the currencies that don't have it yet,
+        `batch_size` symbols per API call.
+        """
+        with self.lock:
+            symbols = []
+            for currency_name in currency_names:
+                sym = self.symbol_by_name.get(currency_name)
+                if sym is None:
+                    logger.warning(f"No symbol found for {currency_name}")
+                elif sym in self.info_symbols:
+                    logger.info(f"Already fetched info for {sym}")
+                else:
+                    symbols.append(sym)
+            symbols = list(dict.fromkeys(symbols))
+            if not symbols:
+                return
+            if len(symbols) == 1:
+                new_info = self.cmc_loader.fetch_info(symbols[0])
+            else:
+                new_info = self.cmc_loader.fetch_info_bulk(symbols, batch_size)
+            if new_info is None or new_info.empty:
+                return
+            new_info["has_pdf_whitepaper"] = self.has_pdf_whitepaper(new_info)
+            self.new_cmc_info.append(new_info)
+            start = len(self.cmc_detailed_info)
+            self.cmc_detailed_info = pd.concat(
+                [self.cmc_detailed_info, new_info[CMC_INFO_COLUMNS]],
+                ignore_index=True,
+            )
+            self.index_cmc_info(start)
 
     def save_cmc_info(self):
-        if self.cmc_list is not None:
-            self.cmc_list.to_csv(self.cmc_list_path, index=False)
-            logger.info(f"Saved CMC list to {self.cmc_list_path}")
-        else:
-            logger.warning("CMC list is None, not saving")
-
-        if self.cmc_detailed_info is not None:
-            self.cmc_detailed_info.to_csv(self.cmc_detailed_info_path, index=False)
-            logger.info(f"Saved detailed CMC info to {self.cmc_detailed_info_path}")
-        else:
-            logger.warning("Detailed CMC info is None, not saving")
+        with self.lock:
+            self._save_cmc_info()
+
+    def _save_cmc_info(self):
+        if not self.new_cmc_info:
+            logger.info("No new detailed CMC info, not saving")
+            return
+        # полные строки дописываем к файлу, в памяти только нужные колонки
+        frames = self.new_cmc_info
+        if os.path.exists(self.cmc_detailed_info_path):
+            frames = [pd.read_parquet(self.cmc_detailed_info_path)] + frames
+        write_parquet(pd.concat(frames, ignore_index=True), self.cmc_detailed_info_path)
+        self.new_cmc_info = []
+        logger.info(f"Saved detailed CMC info to {self.cmc_detailed_info_path}")
 
     def show_all_currency_names(self) -> List:
         return self.pdf_correct_names
         # return self.cmc_list["name"].tolist()
 
     def get_pdf_whitepaper_link(self, name: str) -> List:
-        result = self.cmc_detailed_info[
-            (self.cmc_detailed_info["name"] == name)
-            & (self.cmc_detailed_info["technical_doc"].str.endswith(".pdf"))
-        ][["name", "technical_doc"]].values.tolist()
-        return result[0] if result else [None, None]
+        for row in self.info_rows_by_name.get(name, []):
+            if self.cmc_detailed_info["has_pdf_whitepaper"].iat[row]:
+                return [name, self.cmc_detailed_info["technical_doc"].iat[row]]
+        return [None, None]
 
     def get_all_pdf_whitepapers(self) -> List:
-        return self.cmc_detailed_info[
-            self.cmc_detailed_info["technical_doc"].str.endswith(".pdf")
-        ][["name", "technical_doc"]].values.tolist()
+        return self.cmc_detailed_info[self.cmc_detailed_info["has_pdf_whitepaper"]][
+            ["name", "technical_doc"]
+        ].values.tolist()
 
     def get_description(self, name: str) -> List:
-        return self.cmc_detailed_info[(self.cmc_detailed_info["name"] == name)][
+        rows = self.info_rows_by_name.get(name, [])
+        return self.cmc_detailed_info.iloc[rows][
             ["name", "technical_doc"]
         ].values.tolist()
 
     def get_all_descriptions(self) -> List:
         return self.cmc_detailed_info[["name", "technical_doc"]].values.tolist()
+
+
+_storage = None
+_storage_lock = threading.Lock()
+
+
+def get_storage() -> FileStorage:
+    """
+    Returns the process-wide FileStorage, creating it on first use.
+    """
+    global _storage
+    with _storage_lock:
+        if _storage is None:
+            _storage = FileStorage()
+    return _storage
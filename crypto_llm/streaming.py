@@ -0,0 +1,73 @@
+import queue
+import threading
+from itertools import islice
+from typing import Iterable, Iterator, List, TypeVar
+
+T = TypeVar("T")
+
+_done = object()
+
+
+class _Failure:
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+def batched(items: Iterable[T], size: int) -> Iterator[List[T]]:
+    """
+    Groups items into lists of `size`, the last one may be shorter.
+    """
+    items = iter(items)
+    while True:
+        batch = list(islice(items, size))
+        if not batch:
+            return
+        yield batch
+
+
+def prefetch(items: Iterable[T], max_buffered: int = 4) -> Iterator[T]:
+    """
+    Iterates `items` in a background thread, keeping at most `max_buffered`
+    items ready ahead of the consumer, so producing the next items overlaps
+    with processing the current one. An exception of the producer is raised
+    in the consumer; if the consumer stops early, the producer stops too.
+    """
+    buffer = queue.Queue(maxsize=max_buffered)
+    stop = threading.Event()
+
+    def put(item) -> bool:
+        while not stop.is_set():
+            try:
+                buffer.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce() -> None:
+        try:
+            for item in items:
+                if not put(item):
+                    return
+            put(_done)
+        except BaseException as e:
+            put(_Failure(e))
+        finally:
+            # генератор закрываем в том же потоке, где он выполнялся
+            close = getattr(items, "close", None)
+            if close is not None:
+                close()
+
+    thread = threading.Thread(target=produce, name="prefetch", daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = buffer.get()
+            if item is _done:
+                return
+            if isinstance(item, _Failure):
+                raise item.error
+            yield item
+    finally:
+        stop.set()
+        thread.join()
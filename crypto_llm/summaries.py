@@ -0,0 +1,224 @@
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+logging.basicConfig(
+    level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+)
+logger = logging.getLogger(__name__)
+
+
+def whitepaper_digest(chunks_path: str) -> str:
+    """
+    Version of the chunk store of a whitepaper: the current version named in
+    `CURRENT`, for stores written before versioning the `digest` file or the
+    sha1 of `meta.json`. ChunkStore is not imported to keep startup light.
+
+    Returns:
+        str: the digest, "" if the whitepaper was not ingested
+    """
+    try:
+        with open(os.path.join(chunks_path, "CURRENT"), "r") as fp:
+            return fp.read().strip()
+    except FileNotFoundError:
+        pass
+    try:
+        with open(os.path.join(chunks_path, "digest"), "r") as fp:
+            return fp.read().strip()
+    except FileNotFoundError:
+        pass
+    try:
+        with open(os.path.join(chunks_path, "meta.json"), "rb") as fp:
+            return hashlib.sha1(fp.read()).hexdigest()
+    except FileNotFoundError:
+        return ""
+
+
+@dataclass(frozen=True)
+class SummaryKey:
+    """
+    A summary is valid only for the whitepaper version, the prompt and the
+    model it was generated with.
+    """
+
+    currency: str
+    whitepaper: str
+    prompt: str
+    model: str
+
+
+class SummaryStore:
+    """
+    Summary cache in one SQLite database in WAL mode, so readers don't block
+    the writer and several processes can share it.
+
+    Writes are single-statement upserts, so a reader sees either the old or
+    the new summary. Entries older than `ttl` seconds are not returned and,
+    like the least recently read entries beyond `max_entries`, are deleted by
+    evict(), which runs after every write.
+    """
+
+    def __init__(self, path: str, ttl: float = None, max_entries: int = None):
+        """
+        Args:
+            path (str): database file
+            ttl (float, optional): lifetime of a summary in seconds, None for
+                no limit
+            max_entries (int, optional): max number of summaries, None for no
+                limit
+        """
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        # ждем, пока другой процесс допишет, вместо ошибки "database is locked"
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS summaries ("
+            "currency TEXT NOT NULL, whitepaper TEXT NOT NULL, "
+            "prompt TEXT NOT NULL, model TEXT NOT NULL, summary TEXT NOT NULL, "
+            "created REAL NOT NULL, accessed REAL NOT NULL, "
+            "PRIMARY KEY (currency, whitepaper, prompt, model))"
+        )
+        self.conn.execute(
+            "CREATE INDEX IF NOT EXISTS summaries_accessed ON summaries (accessed)"
+        )
+        self.conn.commit()
+
+    def _min_created(self) -> float:
+        return time.time() - self.ttl if self.ttl is not None else 0.0
+
+    def get(self, key: SummaryKey) -> Optional[str]:
+        return self.get_many([key]).get(key.currency)
+
+    def get_many(self, keys: List[SummaryKey]) -> Dict[str, str]:
+        """
+        Reads the summaries of many currencies at once.
+
+        Returns:
+            Dict[str, str]: summary by currency, for the keys found
+        """
+        found = {}
+        now = time.time()
+        with self.lock:
+            # SQLite ограничивает число параметров в одном запросе
+            for start in range(0, len(keys), 200):
+                part = keys[start : start + 200]
+                rows = self.conn.execute(
+                    "SELECT currency, whitepaper, prompt, model, summary "
+                    "FROM summaries WHERE created >= ? AND (%s)"
+                    % " OR ".join(
+                        ["(currency=? AND whitepaper=? AND prompt=? AND model=?)"]
+                        * len(part)
+                    ),
+                    [self._min_created()]
+                    + [value for key in part for value in self._values(key)],
+                ).fetchall()
+                wanted = set(part)
+                for currency, whitepaper, prompt, model, summary in rows:
+                    if SummaryKey(currency, whitepaper, prompt, model) in wanted:
+                        found[currency] = summary
+                if rows:
+                    self.conn.executemany(
+                        "UPDATE summaries SET accessed=? WHERE currency=? "
+                        "AND whitepaper=? AND prompt=? AND model=?",
+                        [(now,) + tuple(row[:4]) for row in rows],
+                    )
+                    self.conn.commit()
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return found
+
+    def put(self, key: SummaryKey, summary: str) -> None:
+        now = time.time()
+        with self.lock:
+            self.conn.execute(
+                "INSERT INTO summaries "
+                "(currency, whitepaper, prompt, model, summary, created, accessed) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (currency, whitepaper, prompt, model) DO UPDATE SET "
+                "summary=excluded.summary, created=excluded.created, "
+                "accessed=excluded.accessed",
+                self._values(key) + (summary, now, now),
+            )
+            self.conn.commit()
+        self.evict()
+
+    def delete(
+        self, currency: str = None, prompt: str = None, model: str = None
+    ) -> int:
+        """
+        Deletes the summaries matching all the given fields, e.g. those of a
+        retired prompt or model.
+
+        Returns:
+            int: number of deleted summaries
+        """
+        conditions, values = [], []
+        for column, value in (
+            ("currency", currency),
+            ("prompt", prompt),
+            ("model", model),
+        ):
+            if value is not None:
+                conditions.append(column + "=?")
+                values.append(value)
+        where = " WHERE " + " AND ".join(conditions) if conditions else ""
+        with self.lock:
+            deleted = self.conn.execute(
+                "DELETE FROM summaries" + where, values
+            ).rowcount
+            self.conn.commit()
+        return deleted
+
+    def evict(self) -> int:
+        """
+        Deletes expired summaries and the least recently read ones beyond
+        `max_entries`.
+
+        Returns:
+            int: number of deleted summaries
+        """
+        deleted = 0
+        with self.lock:
+            if self.ttl is not None:
+                deleted += self.conn.execute(
+                    "DELETE FROM summaries WHERE created < ?", (self._min_created(),)
+                ).rowcount
+            if self.max_entries is not None:
+                deleted += self.conn.execute(
+                    "DELETE FROM summaries WHERE rowid IN (SELECT rowid FROM "
+                    "summaries ORDER BY accessed DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,),
+                ).rowcount
+            self.conn.commit()
+        if deleted:
+            logger.info("Evicted %d summaries", deleted)
+        return deleted
+
+    def __len__(self) -> int:
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM summaries").fetchone()[0]
+
+    def stats(self) -> Dict[str, float]:
+        with self.lock:
+            requests = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / requests if requests else 0.0,
+            }
+
+    @staticmethod
+    def _values(key: SummaryKey) -> tuple:
+        return (key.currency, key.whitepaper, key.prompt, key.model)
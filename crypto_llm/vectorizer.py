@@ -1,12 +1,39 @@
 import abc
 import os
-import pickle
 import logging
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from dataclasses import dataclass
 from tqdm import tqdm
-from typing import List
-from langchain.vectorstores import FAISS
-from langchain_nvidia_ai_endpoints import NVIDIAEmbeddings
-from crypto_llm.storage import FileStorage
+from typing import TYPE_CHECKING, Dict, Iterable, List, Optional, Tuple
+import faiss
+import numpy as np
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.vectorstores import FAISS
+from langchain_community.vectorstores.utils import DistanceStrategy
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.runnables import RunnableLambda
+from crypto_llm.cache import VectorStoreCache, dir_signature
+from crypto_llm.compression import (
+    IndexBuilder,
+    index_bytes,
+    index_type_of,
+    index_vectors,
+)
+from crypto_llm.chunkstore import ChunkDocstore, ChunkStore, ChunkStoreWriter, chunk_ids
+from crypto_llm.embedder import CachedEmbeddings, LocalEmbeddings, ScheduledEmbeddings
+from crypto_llm.global_index import GlobalIndex
+from crypto_llm.lexical import LexicalIndex
+from crypto_llm.locks import path_lock, swap_dir, swap_lock
+from crypto_llm.metrics import get_tracer
+from crypto_llm.streaming import batched, prefetch
+
+if TYPE_CHECKING:
+    from crypto_llm.storage import FileStorage
 
 # Настройка логгирования
 logging.basicConfig(
@@ -30,15 +57,211 @@ class BaseVectorizer(abc.ABC):
         pass
 
 
+@dataclass(frozen=True)
+class EmbeddingConfig:
+    """
+    How whitepaper chunks are embedded.
+
+    Attributes:
+        backend (str): "nvidia" calls the NVIDIA embeddings API, "local" runs
+            `model_name` on the CPU. Indexes have to be rebuilt after
+            switching, the vectors of the backends differ
+        model_name (str): model of the "local" backend
+        model_path (str, optional): directory of the local model, defaults to
+            the EMBEDDING_MODEL_PATH variable or DATA_PATH/models/<model_name>
+        threads (int, optional): torch threads of the local backend
+        quantize (bool): run the local model quantized to int8
+        batch_size (int): chunks per embedding call
+        max_buffered_batches (int): batches parsed ahead of the embedder when
+            a whitepaper is streamed
+    """
+
+    backend: str = "nvidia"
+    model_name: str = "cointegrated/LaBSE-en-ru"
+    model_path: Optional[str] = None
+    threads: Optional[int] = None
+    quantize: bool = False
+    batch_size: int = 50
+    max_buffered_batches: int = 4
+
+    def __post_init__(self):
+        if self.backend not in ("nvidia", "local"):
+            raise ValueError(f"Unknown embedding backend: {self.backend}")
+
+
+@dataclass(frozen=True)
+class IndexConfig:
+    """
+    Type of the whitepaper indexes and the budget of loaded ones.
+
+    Attributes:
+        index_type (str): "flat" float32 vectors, "fp16" scalar quantized to
+            float16 or "ivfpq" product quantized for documents of at least
+            `min_ivfpq_vectors` chunks, see IndexBuilder. Existing indexes
+            keep their type until converted with convert_index
+        pq_m (int): bytes per vector of the "ivfpq" index
+        min_ivfpq_vectors (int): smaller documents get the "fp16" index
+        cache_size (int): max number of indexes kept loaded
+        cache_bytes (int): max size of the loaded indexes, by their files
+    """
+
+    index_type: str = "flat"
+    pq_m: int = 64
+    min_ivfpq_vectors: int = 2048
+    cache_size: int = 32
+    cache_bytes: int = 1024**3
+
+    def builder(self) -> IndexBuilder:
+        return IndexBuilder(
+            self.index_type, pq_m=self.pq_m, min_ivfpq_vectors=self.min_ivfpq_vectors
+        )
+
+
+@dataclass(frozen=True)
+class HybridConfig:
+    """
+    Fusion of vector and BM25 scores in hybrid retrieval.
+
+    Attributes:
+        alpha (float): weight of the vector score, the BM25 score gets the rest
+        embed_timeout (float, optional): seconds to wait for a query embedding
+            before searching lexically only
+        embed_cooldown (float): seconds to search lexically only after the
+            embedder failed or timed out
+    """
+
+    alpha: float = 0.5
+    embed_timeout: Optional[float] = None
+    embed_cooldown: float = 30.0
+
+
 class FAISSVectorizer(BaseVectorizer):
-    def __init__(self, model_name: str = "cointegrated/LaBSE-en-ru"):
-        self.storage = FileStorage()
-        self.wp_path = os.getenv("DATA_PATH") + "sources/whitepapers/"
+    def __init__(
+        self,
+        storage: "FileStorage" = None,
+        embedder: Embeddings = None,
+        embedding: EmbeddingConfig = None,
+        index: IndexConfig = None,
+        hybrid: HybridConfig = None,
+        use_global_index: bool = False,
+        lazy: bool = False,
+    ):
+        """
+        Args:
+            storage (FileStorage, optional): storage to use instead of the
+                process-wide one
+            embedder (Embeddings): embeddings model to use instead of the
+                embedding backend, called without the request scheduler
+            embedding (EmbeddingConfig, optional): embedding settings
+            index (IndexConfig, optional): index settings
+            hybrid (HybridConfig, optional): hybrid retrieval settings
+            use_global_index (bool): search the global index for the
+                currencies it contains
+            lazy (bool): create the storage and the embedder and load the
+                global index on first use instead of right away
+        """
+        self._storage = storage
+        self._base_embedder = embedder
+        self._embedder = None
+        self._global_index_loaded = False
+        self._init_lock = threading.Lock()
+        self.embedding = embedding or EmbeddingConfig()
+        self.index = index or IndexConfig()
+        self.hybrid = hybrid or HybridConfig()
+        self.index_builder = self.index.builder()
+        self.index_cache = VectorStoreCache(
+            max_entries=self.index.cache_size, max_bytes=self.index.cache_bytes
+        )
+        self.lexical_cache = VectorStoreCache(
+            max_entries=self.index.cache_size, max_bytes=self.index.cache_bytes
+        )
+        self._embed_pool = None
+        self._embed_failed_at = None
         self.embedding_path = os.getenv("DATA_PATH") + "embeddings/"
-        self.embedder = NVIDIAEmbeddings(
+        self.global_index = GlobalIndex(os.getenv("DATA_PATH") + "global_index/")
+        self.use_global_index = use_global_index
+        self.tracer = get_tracer()
+        if not lazy:
+            self.load()
+        logger.info(
+            "FAISSVectorizer initialized with %s embeddings", self.embedding.backend
+        )
+
+    def load(self) -> None:
+        """
+        Creates the storage and the embedder and loads the global index right
+        away instead of on first use.
+        """
+        self._storage = self.storage
+        self._embedder = self.embedder
+        self.ensure_global_index()
+
+    @property
+    def storage(self) -> "FileStorage":
+        if self._storage is None:
+            with self._init_lock:
+                if self._storage is None:
+                    from crypto_llm.storage import get_storage
+
+                    self._storage = get_storage()
+        return self._storage
+
+    @property
+    def embedder(self) -> CachedEmbeddings:
+        if self._embedder is None:
+            with self._init_lock:
+                if self._embedder is None:
+                    self._embedder = CachedEmbeddings(
+                        self._base_embedder or self.create_backend(),
+                        path=os.getenv("DATA_PATH") + "embedding_cache.sqlite",
+                        batch_size=self.embedding.batch_size,
+                    )
+        return self._embedder
+
+    def create_backend(self) -> Embeddings:
+        if self.embedding.backend == "local":
+            return self.local_embedder()
+        return self.nvidia_embedder()
+
+    def local_embedder(self) -> Embeddings:
+        model_path = (
+            self.embedding.model_path
+            or os.getenv("EMBEDDING_MODEL_PATH")
+            or os.getenv("DATA_PATH") + "models/" + self.embedding.model_name
+        )
+        return LocalEmbeddings(
+            model_path,
+            model_name=self.embedding.model_name,
+            batch_size=self.embedding.batch_size,
+            quantize=self.embedding.quantize,
+            threads=self.embedding.threads,
+        )
+
+    def nvidia_embedder(self) -> Embeddings:
+        from langchain_nvidia_ai_endpoints import NVIDIAEmbeddings
+        from crypto_llm.model import get_http_pool
+
+        nvidia_embedder = NVIDIAEmbeddings(
             model="nvidia/nv-embed-v1", api_key=os.getenv("NVIDIA_API_KEY")
         )
-        logger.info("FAISSVectorizer initialized with model: %s", model_name)
+        get_http_pool().install(nvidia_embedder)
+        return ScheduledEmbeddings(nvidia_embedder)
+
+    def ensure_global_index(self) -> None:
+        """
+        Loads the global index from disk once, if it is used and built.
+        """
+        if self._global_index_loaded or not self.use_global_index:
+            return
+        with self._init_lock:
+            if not self._global_index_loaded:
+                if self.global_index.exists():
+                    self.global_index.load()
+                self._global_index_loaded = True
+
+    def in_global_index(self, name: str) -> bool:
+        self.ensure_global_index()
+        return self.use_global_index and name in self.global_index
 
     def calc_and_save_embedding(self, currency_name: str) -> bool:
         """
@@ -48,29 +271,261 @@ class FAISSVectorizer(BaseVectorizer):
             currency_name (str): The currency_name of the whitepaper.
 
         Returns:
-            None.
+            bool: False if there is no whitepaper for the currency.
         """
+        path = self.embedding_path + currency_name
+        if os.path.exists(path):
+            return True
+        # одновременные запросы по одной монете ждут одну сборку, а не
+        # собирают индекс наперегонки
+        with path_lock(path):
+            return self._calc_and_save_embedding(currency_name)
+
+    def _calc_and_save_embedding(self, currency_name: str) -> bool:
         logger.info("Calculating and saving embedding for: %s", currency_name)
         if os.path.exists(self.embedding_path + currency_name):
             logger.info("Embedding already exists for: %s", currency_name)
+        elif not self.storage.wp_loader.has_info(currency_name):
+            logger.warning("Whitepaper not found for: %s", currency_name)
+            with self.tracer.span("fetch_whitepaper"):
+                pdf_link = self.whitepaper_link(currency_name)
+            if not pdf_link:
+                logger.warning("PDF link not found for: %s", currency_name)
+                return False
+            with self.tracer.span("stream_embedding") as span:
+                chunks = self.stream_embedding(currency_name, pdf_link)
+                span.set(chunks=chunks)
+            if not chunks:
+                return False
         else:
-            if not os.path.exists(self.wp_path + currency_name):
-                logger.warning("Whitepaper not found for: %s", currency_name)
-                self.storage.get_symbol_by_name(currency_name)
-                self.storage.save_cmc_info()
-                _, pdf_link = self.storage.get_pdf_whitepaper_link(currency_name)
-                if not self.storage.get_wp_info(
-                    currency_name=currency_name, pdf_link=pdf_link
-                ):
-                    logger.warning("PDF link not found for: %s", currency_name)
-                    return False
-            with open(self.wp_path + currency_name + ".pkl", "rb") as fp:
-                whitepaper_raw = pickle.load(fp)
-            db = FAISS.from_documents(whitepaper_raw, self.embedder)
-            db.save_local(self.embedding_path + currency_name)
+            with self.tracer.span("embed_index") as span:
+                store = self.load_whitepaper(currency_name)
+                db = self.build_index(
+                    store.path, store.batches(self.embedding.batch_size)
+                )
+                self.save_index(db, currency_name)
+                span.set(chunks=len(store))
             logger.info("Embedding saved for: %s", currency_name)
         return True
 
+    def whitepaper_link(self, currency_name: str) -> Optional[str]:
+        self.storage.get_symbol_by_name(currency_name)
+        self.storage.save_cmc_info()
+        _, pdf_link = self.storage.get_pdf_whitepaper_link(currency_name)
+        return pdf_link
+
+    def fetch_whitepaper(self, currency_name: str) -> bool:
+        pdf_link = self.whitepaper_link(currency_name)
+        if not self.storage.get_wp_info(currency_name=currency_name, pdf_link=pdf_link):
+            logger.warning("PDF link not found for: %s", currency_name)
+            return False
+        return True
+
+    def build_index(
+        self,
+        store_path: Optional[str],
+        batches: Iterable[Tuple[List[str], List[Document]]],
+    ) -> Optional[FAISS]:
+        """
+        Builds a FAISS index batch by batch from (chunk ids, chunks) pairs.
+        The docstore of the index refers to the chunk store in `store_path`
+        instead of copying the chunks; with None the docstore is left empty
+        for the caller to set once the chunks are committed. Vectors are
+        collected in a flat index and compressed to `index_type` at the end,
+        since IVF-PQ is trained on all of them.
+
+        Returns:
+            FAISS: the index, or None if there were no chunks
+        """
+        index, index_to_docstore_id = None, {}
+        for ids, docs in batches:
+            vectors = np.array(
+                self.embedder.embed_documents([doc.page_content for doc in docs]),
+                dtype="float32",
+            )
+            if index is None:
+                # тот же тип индекса, что строит FAISS.from_documents
+                index = faiss.IndexFlatL2(vectors.shape[1])
+            index.add(vectors)
+            for chunk_id in ids:
+                index_to_docstore_id[len(index_to_docstore_id)] = chunk_id
+        if index is None:
+            return None
+        if self.index_builder.index_type != "flat":
+            index = self.index_builder.build(index_vectors(index))
+        return FAISS(
+            embedding_function=self.embedder,
+            index=index,
+            docstore=ChunkDocstore(store_path) if store_path else InMemoryDocstore(),
+            index_to_docstore_id=index_to_docstore_id,
+        )
+
+    def stream_embedding(self, currency_name: str, pdf_link: str) -> int:
+        """
+        Ingests and indexes a whitepaper in one pass. Pages are parsed and
+        split in a background thread, at most `embedding.max_buffered_batches` batches
+        ahead, while the previous batches are written to the chunk store and
+        embedded, so embedding starts before parsing finishes and memory
+        depends on the batch size rather than on the size of the document.
+
+        Returns:
+            int: number of indexed chunks, 0 if the whitepaper has no text or
+                could not be ingested
+        """
+        loader = self.storage.wp_loader
+        try:
+            file_path = loader.download(pdf_link)
+        except Exception as e:
+            logger.warning(f"Error downloading {pdf_link}. " + str(e))
+            return 0
+        try:
+            with ChunkStoreWriter(loader.chunks_path(currency_name)) as writer:
+                batches = prefetch(
+                    batched(
+                        loader.iter_chunks(file_path, pdf_link),
+                        self.embedding.batch_size,
+                    ),
+                    self.embedding.max_buffered_batches,
+                )
+                db = self.build_index(
+                    None, ((writer.add(batch), batch) for batch in batches)
+                )
+                if db is None:
+                    logger.warning("No text found in whitepaper of: %s", currency_name)
+                    return 0
+                # индекс ссылается на записанную версию чанков
+                db.docstore = ChunkDocstore(writer.commit().path)
+                loader.remove_legacy_info(currency_name)
+        except Exception as e:
+            logger.warning(f"Error ingesting {pdf_link}. " + str(e))
+            return 0
+        finally:
+            if file_path != pdf_link:
+                os.remove(file_path)
+        self.save_index(db, currency_name)
+        logger.info("Embedding saved for: %s", currency_name)
+        return len(writer)
+
+    def load_whitepaper(self, currency_name: str) -> ChunkStore:
+        return self.storage.wp_loader.load_info(currency_name)
+
+    def save_index(self, db: FAISS, currency_name: str) -> None:
+        """
+        Saves the index to a temporary directory of its own and swaps it into
+        place under the lock of the index, so readers never load a
+        half-written index and concurrent saves don't delete each other's
+        files. Versions of the chunk store the index no longer refers to are
+        deleted after the swap.
+        """
+        path = self.embedding_path + currency_name
+        with path_lock(path):
+            os.makedirs(self.embedding_path, exist_ok=True)
+            # суффикс .tmp исключает папку из index_names
+            tmp_path = tempfile.mkdtemp(
+                dir=self.embedding_path, prefix=currency_name + ".", suffix=".tmp"
+            )
+            try:
+                db.save_local(tmp_path)
+                self.build_lexical(db).save(tmp_path)
+                swap_dir(tmp_path, path)
+            except BaseException:
+                shutil.rmtree(tmp_path, ignore_errors=True)
+                raise
+            if isinstance(db.docstore, ChunkDocstore):
+                ChunkStore.prune(db.docstore.path)
+
+    def build_lexical(self, db: FAISS) -> LexicalIndex:
+        ids = list(db.index_to_docstore_id.values())
+        return LexicalIndex.build(
+            ids, [db.docstore.search(i).page_content for i in ids]
+        )
+
+    def load_lexical(self, path: str) -> LexicalIndex:
+        """
+        Loads the BM25 index saved next to a FAISS index. Indexes built before
+        it was introduced get it built from their chunks on first use.
+        """
+        if not LexicalIndex.exists(path):
+            logger.info("Building BM25 index for: %s", path)
+            lexical = self.build_lexical(self.load_index(path))
+            with swap_lock(path):
+                lexical.save(path)
+            return lexical
+        with swap_lock(path):
+            return LexicalIndex.load(path)
+
+    def update_embedding(self, currency_name: str) -> bool:
+        """
+        Brings the index of a currency up to date with its whitepaper chunks:
+        embeds only the new chunks and deletes the removed ones.
+
+        Args:
+            currency_name (str): The currency_name of the whitepaper.
+
+        Returns:
+            bool: False if there is no whitepaper for the currency.
+        """
+        with path_lock(self.embedding_path + currency_name):
+            return self._update_embedding(currency_name)
+
+    def _update_embedding(self, currency_name: str) -> bool:
+        if not os.path.exists(self.embedding_path + currency_name):
+            return self.calc_and_save_embedding(currency_name)
+        store = self.load_whitepaper(currency_name)
+        if store is None:
+            logger.warning("Whitepaper not found for: %s", currency_name)
+            return False
+
+        db = self.load_index(self.embedding_path + currency_name)
+        converted = not isinstance(db.docstore, ChunkDocstore)
+        if converted:
+            # в старых индексах чанки лежат в самом docstore, иногда под uuid:
+            # сопоставляем их по тексту и переводим индекс на хранилище чанков
+            docstore_ids = list(db.index_to_docstore_id.values())
+            keys = chunk_ids([db.docstore.search(i) for i in docstore_ids])
+            renamed = dict(zip(docstore_ids, keys))
+            db.index_to_docstore_id = {
+                position: renamed[i] for position, i in db.index_to_docstore_id.items()
+            }
+            db.docstore = ChunkDocstore(store.path)
+        # после обновления индекс совпадает с новой версией чанков, поэтому
+        # docstore переводится на нее без своих добавлений и удалений
+        repointed = db.docstore.path != store.path
+        if repointed:
+            db.docstore = ChunkDocstore(store.path)
+        existing = set(db.index_to_docstore_id.values())
+
+        to_delete = [key for key in existing if key not in store]
+        to_add = [key for key in store.ids if key not in existing]
+        if not to_delete and not to_add and not converted and not repointed:
+            logger.info("Embedding is up to date for: %s", currency_name)
+            return True
+        if index_type_of(db.index) == "ivfpq":
+            # IVF удаляет векторы без перенумерации, а docstore FAISS ждет
+            # сплошные позиции: пересобираем, векторы старых чанков в кэше
+            db = self.build_index(store.path, store.batches(self.embedding.batch_size))
+        else:
+            if to_delete:
+                db.delete(to_delete)
+            if to_add:
+                db.add_documents([store.get(key) for key in to_add], ids=to_add)
+        self.save_index(db, currency_name)
+        logger.info(
+            "Embedding updated for: %s, %d chunks added, %d deleted",
+            currency_name,
+            len(to_add),
+            len(to_delete),
+        )
+        return True
+
+    def refresh_embedding(self, currency_name: str) -> bool:
+        """
+        Downloads the current whitepaper of a currency and updates its index.
+        """
+        if not self.fetch_whitepaper(currency_name):
+            return False
+        return self.update_embedding(currency_name)
+
     def calc_and_save_embedding_batch(self, currency_names: List[str]) -> None:
         """
         Calculate and save embeddings for a list of currency_names.
@@ -86,12 +541,78 @@ class FAISSVectorizer(BaseVectorizer):
             self.calc_and_save_embedding(name)
         logger.info("Batch processing complete.")
 
+    def index_names(self) -> List[str]:
+        if not os.path.isdir(self.embedding_path):
+            return []
+        return sorted(
+            name
+            for name in os.listdir(self.embedding_path)
+            if os.path.isdir(self.embedding_path + name)
+            and not name.endswith((".tmp", ".old"))
+        )
+
+    def convert_index(
+        self, currency_name: str, builder: IndexBuilder = None
+    ) -> Tuple[int, int]:
+        """
+        Rebuilds the saved index of a currency as another index type from its
+        own vectors, without embedding the chunks again. Vectors of a
+        compressed index are decoded approximately, so converting it back to
+        "flat" does not restore the recall.
+
+        Args:
+            currency_name (str): The currency_name of the whitepaper.
+            builder (IndexBuilder, optional): Defaults to the `index_type` of
+                the vectorizer.
+
+        Returns:
+            Tuple[int, int]: size of the index in bytes before and after
+        """
+        builder = builder or self.index_builder
+        with path_lock(self.embedding_path + currency_name):
+            db = self.load_index(self.embedding_path + currency_name)
+            old_type, old_bytes = index_type_of(db.index), index_bytes(db.index)
+            db.index = builder.build(index_vectors(db.index))
+            self.save_index(db, currency_name)
+        new_bytes = index_bytes(db.index)
+        logger.info(
+            "Index of %s converted from %s to %s: %d -> %d bytes",
+            currency_name,
+            old_type,
+            index_type_of(db.index),
+            old_bytes,
+            new_bytes,
+        )
+        return old_bytes, new_bytes
+
+    def index_version(self, name: str):
+        """
+        Returns a value that changes whenever the index of a currency is rebuilt.
+        """
+        if self.in_global_index(name):
+            return dir_signature(self.global_index.path)
+        if os.path.exists(self.embedding_path + name):
+            return dir_signature(self.embedding_path + name)
+        return None
+
+    def load_index(self, path: str) -> FAISS:
+        logger.info("Loading index from: %s", path)
+        with self.tracer.span("index_load") as span, swap_lock(path):
+            db = FAISS.load_local(
+                path,
+                self.embedder,
+                allow_dangerous_deserialization=True,
+            )
+            span.set(vectors=db.index.ntotal)
+        return db
+
     def get_retriever(
         self,
         name: str,
         search_type: str = "similarity",
         is_summary: bool = False,
         k: int = 8,
+        mode: str = "vector",
     ):
         """
         Get a retriever for a given name.
@@ -99,27 +620,230 @@ class FAISSVectorizer(BaseVectorizer):
         Args:
             name (str): The name of the whitepaper.
             search_type (str, optional): The type of search to perform. Defaults to "similarity".
+            is_summary (bool, optional): return all chunks of the whitepaper
+                in document order instead of searching.
             k (int, optional): The number of results to return. Defaults to 8.
+            mode (str, optional): "vector" searches FAISS, "lexical" the BM25
+                index without embedding the query, "hybrid" fuses both and
+                falls back to BM25 when the embedder is unavailable. The
+                global index is always searched by vectors.
 
         Returns:
             langchain.vectorstores.faiss.FAISS: The FAISS retriever.
         """
-        if self.calc_and_save_embedding(name):
-            if is_summary:
-                k = 9999
+        if mode not in ("vector", "lexical", "hybrid"):
+            raise ValueError(f"Unknown retrieval mode: {mode}")
+        with self.tracer.span("get_retriever") as span:
+            if is_summary and self.in_global_index(name):
+                store = self.load_whitepaper(name)
+                if store is not None:
+                    span.set(index="chunks")
+                    return RunnableLambda(
+                        lambda _: list(store), name="summary_retrieval"
+                    )
+            if self.in_global_index(name):
+                if is_summary:
+                    k = 1000
+                span.set(index="global")
+                logger.info("Getting global index retriever for: %s", name)
+                return RunnableLambda(
+                    lambda query: [
+                        doc
+                        for doc, _ in self.global_index.search(
+                            self.embedder.embed_query(query), k=k, currency_name=name
+                        )
+                    ],
+                    name="global_retrieval",
+                )
+            with self.tracer.span("ensure_embedding"):
+                exists = self.calc_and_save_embedding(name)
+            if not exists:
+                logger.warning("Embedding not found for: %s", name)
+                return None
             logger.info(
-                "Getting retriever for: %s with search type: %s and k: %d",
+                "Getting retriever for: %s with search type: %s, mode: %s and k: %d",
                 name,
                 search_type,
+                mode,
                 k,
             )
-            db = FAISS.load_local(
-                self.embedding_path + name,
-                self.embedder,
-                allow_dangerous_deserialization=True,
-            )
+            span.set(index="currency", mode=mode)
+            if is_summary:
+                # для саммари нужен весь текст по порядку, ранжировать нечего
+                return RunnableLambda(
+                    lambda _: self.all_documents(name), name="summary_retrieval"
+                )
+            if mode != "vector":
+                return RunnableLambda(
+                    lambda query: self.hybrid_search(name, query, k, mode),
+                    name=mode + "_retrieval",
+                )
+            db = self.index_cache.get(name, self.embedding_path + name, self.load_index)
             logger.info("Retriever obtained for: %s", name)
-            return db.as_retriever(search_type="similarity", search_kwargs={"k": 1000})
-        else:
-            logger.warning("Embedding not found for: %s", name)
+            return db.as_retriever(search_type="similarity", search_kwargs={"k": k})
+
+    def all_documents(self, name: str) -> List[Document]:
+        """
+        Chunks of the whitepaper of a currency in document order.
+        """
+        db = self.index_cache.get(name, self.embedding_path + name, self.load_index)
+        if isinstance(db.docstore, ChunkDocstore) and not db.docstore.added:
+            # порядок хранилища - порядок текста, в индексе добавленные
+            # при обновлении чанки идут в конце
+            deleted = db.docstore.deleted
+            return [doc for doc in db.docstore.store if doc.id not in deleted]
+        return [db.docstore.search(i) for i in db.index_to_docstore_id.values()]
+
+    def embed_query(self, query: str) -> Optional[List[float]]:
+        """
+        Embeds a query for hybrid retrieval.
+
+        Returns:
+            List[float]: the embedding, or None if the embedder failed, took
+                longer than `hybrid.embed_timeout` or failed less than
+                `hybrid.embed_cooldown` seconds ago.
+        """
+        failed_at = self._embed_failed_at
+        if (
+            failed_at is not None
+            and time.monotonic() - failed_at < self.hybrid.embed_cooldown
+        ):
             return None
+        try:
+            if self.hybrid.embed_timeout is None:
+                embedding = self.embedder.embed_query(query)
+            else:
+                if self._embed_pool is None:
+                    with self._init_lock:
+                        if self._embed_pool is None:
+                            self._embed_pool = ThreadPoolExecutor(
+                                max_workers=4, thread_name_prefix="embed_query"
+                            )
+                # опоздавший ответ все равно попадет в кэш запросов эмбеддера
+                future = self._embed_pool.submit(self.embedder.embed_query, query)
+                embedding = future.result(timeout=self.hybrid.embed_timeout)
+        except TimeoutError:
+            logger.warning(
+                "Query embedding took over %ss, searching lexically",
+                self.hybrid.embed_timeout,
+            )
+            self._embed_failed_at = time.monotonic()
+            return None
+        except Exception as e:
+            logger.warning("Query embedding failed, searching lexically. " + str(e))
+            self._embed_failed_at = time.monotonic()
+            return None
+        self._embed_failed_at = None
+        return embedding
+
+    def hybrid_search(
+        self, name: str, query: str, k: int = 8, mode: str = "hybrid"
+    ) -> List[Document]:
+        """
+        Ranks the chunks of a currency by BM25 and, in "hybrid" mode, by vector
+        similarity. Both scores are min-max normalized over the candidates and
+        summed with the weights `hybrid.alpha` (vector) and 1 - `hybrid.alpha`.
+
+        Args:
+            name (str): The name of the whitepaper.
+            query (str): The question to search for.
+            k (int, optional): The number of results to return. Defaults to 8.
+            mode (str, optional): "hybrid" or "lexical".
+
+        Returns:
+            List[Document]: the best chunks, best first.
+        """
+        path = self.embedding_path + name
+        with self.tracer.span("hybrid_search", mode=mode) as span:
+            db = self.index_cache.get(name, path, self.load_index)
+            lexical = self.lexical_cache.get(name, path, self.load_lexical)
+            # кандидатов берем с запасом, чтобы слияние было из чего выбирать
+            n_candidates = max(1, min(max(4 * k, 32), len(lexical)))
+            scores = {"lexical": dict(lexical.search(query, n_candidates))}
+            embedding = self.embed_query(query) if mode == "hybrid" else None
+            if embedding is not None:
+                distances, positions = db.index.search(
+                    np.array([embedding], dtype="float32"), n_candidates
+                )
+                sign = (
+                    1
+                    if db.distance_strategy == DistanceStrategy.MAX_INNER_PRODUCT
+                    else -1
+                )
+                scores["vector"] = {
+                    db.index_to_docstore_id[position]: sign * float(distance)
+                    for distance, position in zip(distances[0], positions[0])
+                    if position != -1
+                }
+            span.set(
+                mode_used="hybrid" if embedding is not None else "lexical",
+                lexical_hits=len(scores["lexical"]),
+                vector_hits=len(scores.get("vector", ())),
+            )
+            weights = {"lexical": 1.0 - self.hybrid.alpha, "vector": self.hybrid.alpha}
+            if embedding is None:
+                weights["lexical"] = 1.0
+            fused: Dict[str, float] = {}
+            for source, source_scores in scores.items():
+                if not source_scores:
+                    continue
+                low, high = min(source_scores.values()), max(source_scores.values())
+                for key, score in source_scores.items():
+                    normalized = (score - low) / (high - low) if high > low else 1.0
+                    fused[key] = fused.get(key, 0.0) + weights[source] * normalized
+            best = sorted(fused, key=fused.get, reverse=True)[:k]
+            return [db.docstore.search(key) for key in best]
+
+    def build_global_index(
+        self,
+        currency_names: List[str] = None,
+        index_type: str = "hnsw",
+        n_shards: int = 4,
+    ) -> None:
+        """
+        Builds the global index from the existing per-currency indexes
+        without embedding the whitepapers again.
+
+        Args:
+            currency_names (List[str], optional): currencies to include.
+                Defaults to every index in the embeddings directory.
+            index_type (str, optional): "hnsw" or "ivf". Defaults to "hnsw".
+            n_shards (int, optional): number of shards. Defaults to 4.
+
+        Returns:
+            None.
+        """
+        if currency_names is None:
+            currency_names = self.index_names()
+        logger.info("Building global index for %d currencies", len(currency_names))
+        self.global_index = GlobalIndex(
+            self.global_index.path, index_type=index_type, n_shards=n_shards
+        )
+        self._global_index_loaded = True
+        stores = (
+            (name, self.load_index(self.embedding_path + name))
+            for name in tqdm(currency_names)
+        )
+        self.global_index.build(stores, n_currencies=len(currency_names))
+
+    def search_all(self, query: str, k: int = 8) -> List[Document]:
+        """
+        Searches the whitepapers of all currencies in the global index.
+
+        Args:
+            query (str): The question to search for.
+            k (int, optional): The number of results to return. Defaults to 8.
+
+        Returns:
+            List[Document]: chunks with the currency name in metadata["currency"].
+        """
+        self.ensure_global_index()
+        if not self.global_index.currencies:
+            logger.warning("Global index is not built")
+            return []
+        return [
+            doc
+            for doc, _ in self.global_index.search(
+                self.embedder.embed_query(query), k=k
+            )
+        ]
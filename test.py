@@ -5,6 +5,8 @@ load_dotenv("./.env")
 # test FileStorage
 # storage = FileStorage()
 # storage.get_symbol_by_name("ChatCoin")
+# storage.get_symbol_by_name("Shill Guard Token")
+# storage.get_symbols_by_names(storage.show_all_currency_names())
 # storage.get_all_cmc_list()
 # storage.get_pdf_whitepaper_link("ChatCoin")
 # storage.save_cmc_info()
@@ -15,19 +17,20 @@ load_dotenv("./.env")
 # loader.get_all_cmc_list()
 # loader.save_info()
 # loader.get_info_batch()
-# loader.get_info_by_name("Shill Guard Token")
 # loader.save_info()
 
 # test WhitePaperLoader
 # whitepapers_list = loader.get_all_pdf_whitepapers()
 # wp_loader = WhitePaperLoader()
 # wp_loader.get_info_batch(list_of_links=whitepapers_list)
+# wp_loader.get_info_batch(list_of_links=whitepapers_list, parallel=True)
 
 # test FAISSVectorizer
 # vectorizer = FAISSVectorizer()
 # vectorizer.calc_and_save_embedding('USDC')
 # vectorizer.calc_and_save_embedding_batch(["Solana", "USDC", "XRP"])
 # vectorizer.get_retriever('Blocknet')
+# vectorizer.refresh_embedding('USDC')
 
 # test LlmChainer
 # chainer = LlmChainer()
@@ -35,3 +38,4 @@ load_dotenv("./.env")
 # chainer.run_chain("ChatCoin", is_summary=True)
 # chainer.run_chain("Lition", is_summary=True)
 # chainer.run_chain("Lition", "Какой алгоритм консенсуса?")
+# asyncio.run(chainer.arun_chain("Lition", "Какой алгоритм консенсуса?"))
@@ -0,0 +1,54 @@
+import random
+
+import pytest
+
+from benchmarks.corpus import make_text, write_pdf
+from benchmarks.fakes import HashEmbeddings
+
+
+@pytest.fixture
+def data_path(tmp_path, monkeypatch):
+    path = str(tmp_path) + "/"
+    monkeypatch.setenv("DATA_PATH", path)
+    return path
+
+
+@pytest.fixture
+def pdf_path(tmp_path):
+    rng = random.Random(0)
+    path = str(tmp_path / "whitepaper.pdf")
+    write_pdf(path, [make_text(rng, 300) for _ in range(6)])
+    return path
+
+
+class FakeStorage:
+    """
+    FileStorage without CoinMarketCap: every currency has the same local PDF.
+    """
+
+    def __init__(self, pdf_path: str):
+        from crypto_llm.loader import WhitePaperLoader
+
+        self.pdf_path = pdf_path
+        self.wp_loader = WhitePaperLoader()
+
+    def get_symbol_by_name(self, name):
+        pass
+
+    def save_cmc_info(self):
+        pass
+
+    def get_pdf_whitepaper_link(self, name):
+        return None, self.pdf_path
+
+    def get_wp_info(self, currency_name, pdf_link):
+        return self.wp_loader.get_info(currency_name, pdf_link)
+
+
+@pytest.fixture
+def vectorizer(data_path, pdf_path):
+    from crypto_llm.vectorizer import FAISSVectorizer
+
+    return FAISSVectorizer(
+        lazy=True, embedder=HashEmbeddings(dim=64), storage=FakeStorage(pdf_path)
+    )
@@ -0,0 +1,95 @@
+from crypto_llm.cache import StaleIndexError, VectorStoreCache
+
+
+def test_reload_when_index_changes_during_load(tmp_path):
+    (tmp_path / "index.faiss").write_bytes(b"v1")
+    loads = []
+
+    def load(path):
+        loads.append(path)
+        if len(loads) == 1:
+            raise StaleIndexError("version deleted")
+        return "index"
+
+    cache = VectorStoreCache()
+    assert cache.get("Coin", str(tmp_path), load) == "index"
+    assert len(loads) == 2
+    assert cache.get("Coin", str(tmp_path), load) == "index"
+    assert len(loads) == 2
+
+
+def test_lru_eviction_and_reload(tmp_path):
+    paths = {}
+    for name in ("A", "B", "C"):
+        paths[name] = tmp_path / name
+        paths[name].mkdir()
+        (paths[name] / "index.faiss").write_bytes(b"x" * 100)
+    loads = []
+
+    def load(path):
+        loads.append(path)
+        return path
+
+    cache = VectorStoreCache(max_entries=2)
+    cache.get("A", str(paths["A"]), load)
+    cache.get("B", str(paths["B"]), load)
+    cache.get("A", str(paths["A"]), load)
+    # вытесняется B, к которому обращались раньше всех
+    cache.get("C", str(paths["C"]), load)
+    assert list(cache.entries) == ["A", "C"]
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 3
+    assert cache.stats()["evictions"] == 1
+    assert cache.stats()["bytes"] == 200
+
+    # файлы индекса изменились: загружаем заново
+    (paths["A"] / "index.faiss").write_bytes(b"y" * 150)
+    cache.get("A", str(paths["A"]), load)
+    assert loads.count(str(paths["A"])) == 2
+    assert cache.stats()["bytes"] == 250
+
+    cache = VectorStoreCache(max_bytes=250)
+    for name in ("A", "B", "C"):
+        cache.get(name, str(paths[name]), load)
+    assert list(cache.entries) == ["B", "C"]
+
+
+def test_retriever_reuses_loaded_index(vectorizer, data_path):
+    assert vectorizer.calc_and_save_embedding("Coin")
+    vectorizer.index_cache.clear()
+    for _ in range(3):
+        assert len(vectorizer.get_retriever("Coin", k=2).invoke("token")) == 2
+    stats = vectorizer.index_cache.stats()
+    assert (stats["hits"], stats["misses"]) == (2, 1)
+
+    # пересохраненный индекс читается с диска
+    db = vectorizer.load_index(data_path + "embeddings/Coin")
+    vectorizer.save_index(db, "Coin")
+    vectorizer.get_retriever("Coin", k=2)
+    assert vectorizer.index_cache.stats()["misses"] == 2
+
+
+def test_answer_cache_ttl_and_lru(monkeypatch):
+    import time
+
+    from crypto_llm.cache import AnswerCache
+
+    cache = AnswerCache(threshold=0.9, max_entries=2, ttl=60)
+    cache.put("Coin", [1.0, 0.0], "first", version=1)
+    cache.put("Coin", [0.0, 1.0], "second", version=1)
+    assert cache.get("Coin", [1.0, 0.1], version=1) == "first"
+    assert cache.get("Coin", [1.0, 0.1], version=2) is None
+    assert cache.get("Other", [1.0, 0.0], version=1) is None
+
+    cache.put("Coin", [1.0, 0.0], "first", version=1)
+    cache.put("Coin", [0.0, 1.0], "second", version=1)
+    cache.get("Coin", [1.0, 0.0], version=1)
+    # вытесняется давно не использованный ответ
+    cache.put("Coin", [-1.0, 0.0], "third", version=1)
+    assert cache.get("Coin", [0.0, 1.0], version=1) is None
+    assert cache.get("Coin", [1.0, 0.0], version=1) == "first"
+
+    now = time.time()
+    monkeypatch.setattr(time, "time", lambda: now + 61)
+    assert cache.get("Coin", [1.0, 0.0], version=1) is None
+    assert cache.stats()["entries"] == 0
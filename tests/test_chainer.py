@@ -0,0 +1,160 @@
+import asyncio
+
+import pytest
+from langchain_core.documents import Document
+
+from crypto_llm.cache import AnswerCache
+from crypto_llm.chainer import LlmChainer, RetrievalConfig, SummaryConfig
+from crypto_llm.packer import estimate_tokens
+
+
+def test_summary_sample_covers_whole_document():
+    docs = [Document(page_content="x" * 400, metadata={"page": i}) for i in range(100)]
+
+    assert LlmChainer.sample_docs(docs, 100_000) == docs
+    sample = LlmChainer.sample_docs(docs, 1010)
+    assert [doc.metadata["page"] for doc in sample] == list(range(0, 100, 10))
+
+
+def test_arun_chain_in_several_event_loops(data_path, vectorizer):
+    from benchmarks.fakes import fake_llm
+
+    chainer = LlmChainer(
+        lazy=True, llm=fake_llm("answer"), vectorizer=vectorizer, max_concurrency=1
+    )
+
+    async def ask_twice():
+        return await asyncio.gather(
+            chainer.arun_chain("Coin", "token?"),
+            chainer.arun_chain("Coin", "block?"),
+        )
+
+    # каждый asyncio.run создает новый event loop
+    assert asyncio.run(ask_twice()) == ["answer", "answer"]
+    assert asyncio.run(ask_twice()) == ["answer", "answer"]
+
+
+class CountingLLM:
+    """
+    Chat model stand-in that answers every prompt with `reply` and counts the
+    calls.
+    """
+
+    def __init__(self, reply: str):
+        from langchain_core.runnables import RunnableLambda
+
+        self.calls = 0
+        self.reply = reply
+        self.runnable = RunnableLambda(self.invoke)
+
+    def invoke(self, prompt):
+        from langchain_core.messages import AIMessage
+
+        self.calls += 1
+        return AIMessage(content=self.reply)
+
+
+def map_reduce_chainer(data_path, reply: str):
+    llm = CountingLLM(reply)
+    chainer = LlmChainer(
+        lazy=True,
+        llm=llm.runnable,
+        summary=SummaryConfig(mode="map_reduce", batch_tokens=100),
+    )
+    return chainer, llm
+
+
+def chunks(n: int):
+    return [
+        Document(
+            page_content=" ".join(f"w{i}_{j}" for j in range(50)), metadata={"page": i}
+        )
+        for i in range(n)
+    ]
+
+
+def test_map_summaries_in_several_rounds(data_path):
+    # каждый чанк занимает свой батч, три коротких summary помещаются в один
+    chainer, llm = map_reduce_chainer(data_path, "s" * 100)
+
+    result = chainer.map_summaries(chunks(20))
+    assert llm.calls == 20 + 7 + 3
+    assert result == "\n\n".join(["s" * 100] * 3)
+
+
+def test_map_summaries_stop_without_progress(data_path):
+    # summary длиннее половины бюджета: по два в батч не собрать
+    chainer, llm = map_reduce_chainer(data_path, "s" * 300)
+
+    result = chainer.map_summaries(chunks(20))
+    assert llm.calls == 20
+    assert estimate_tokens(result) <= 100
+    assert result.count("\n\n") == 19
+
+
+def test_map_summaries_skip_short_documents(data_path):
+    chainer, llm = map_reduce_chainer(data_path, "summary")
+
+    assert chainer.map_summaries(chunks(1)) == chunks(1)[0].page_content
+    assert llm.calls == 0
+
+
+def test_map_reduce_summary(data_path, vectorizer):
+    llm = CountingLLM("summary")
+    chainer = LlmChainer(
+        lazy=True,
+        llm=llm.runnable,
+        vectorizer=vectorizer,
+        summary=SummaryConfig(mode="map_reduce", batch_tokens=500),
+    )
+
+    assert chainer.run_chain("Coin", is_summary=True) == "summary"
+    # батчи чанков и итоговое summary
+    assert llm.calls > 1
+    assert chainer.get_summary("Coin") == "summary"
+
+
+def test_run_stream_and_arun_share_the_caches(data_path, vectorizer):
+    llm = CountingLLM("summary")
+    chainer = LlmChainer(lazy=True, llm=llm.runnable, vectorizer=vectorizer)
+
+    assert "".join(chainer.stream_chain("Coin", is_summary=True)) == "summary"
+    assert chainer.run_chain("Coin", is_summary=True) == "summary"
+    assert asyncio.run(chainer.arun_chain("Coin", is_summary=True)) == "summary"
+    assert llm.calls == 1
+    assert chainer.run_chain("Coin", "token?") == "summary"
+    assert "".join(chainer.stream_chain("Coin", "token?")) == "summary"
+    assert asyncio.run(chainer.arun_chain("Coin", "token?")) == "summary"
+    assert llm.calls == 2
+
+
+def test_configs_reject_unknown_modes():
+    with pytest.raises(ValueError):
+        SummaryConfig(mode="refine")
+    with pytest.raises(ValueError):
+        RetrievalConfig(mode="graph")
+
+
+def test_answer_cache_serves_reworded_questions(data_path, vectorizer):
+    llm = CountingLLM("answer")
+    chainer = LlmChainer(
+        lazy=True,
+        llm=llm.runnable,
+        vectorizer=vectorizer,
+        answer_cache=AnswerCache(threshold=0.9),
+    )
+
+    assert chainer.run_chain("Coin", "what is the token supply") == "answer"
+    assert chainer.run_chain("Coin", "what is the token supply please") == "answer"
+    assert llm.calls == 1
+    chainer.run_chain("Coin", "consensus algorithm")
+    assert llm.calls == 2
+    chainer.run_chain("Other", "what is the token supply")
+    assert llm.calls == 3
+    assert chainer.answer_cache.stats()["hits"] == 1
+
+    # после пересборки индекса ответы монеты устаревают
+    db = vectorizer.load_index(data_path + "embeddings/Coin")
+    vectorizer.save_index(db, "Coin")
+    chainer.run_chain("Coin", "what is the token supply")
+    assert llm.calls == 4
@@ -0,0 +1,74 @@
+import os
+import pickle
+
+import pytest
+from langchain_core.documents import Document
+
+from crypto_llm.cache import StaleIndexError
+from crypto_llm.chunkstore import ChunkDocstore, ChunkStore, chunk_ids
+
+
+def make_docs(n, prefix="chunk"):
+    return [
+        Document(page_content=f"{prefix} {i}", metadata={"page": i // 2})
+        for i in range(n)
+    ]
+
+
+def test_round_trip(tmp_path):
+    path = str(tmp_path / "Coin.chunks")
+    docs = make_docs(5)
+    store = ChunkStore.write(path, docs)
+
+    store = ChunkStore.open(path)
+    assert store.ids == chunk_ids(docs)
+    assert len(store) == 5
+    assert [doc.page_content for doc in store] == [doc.page_content for doc in docs]
+    assert store.get(store.ids[3]).metadata == {"page": 1}
+    assert store.get("missing") is None
+    batches = list(store.batches(2))
+    assert [len(ids) for ids, _ in batches] == [2, 2, 1]
+
+
+def test_versions_and_prune(tmp_path):
+    path = str(tmp_path / "Coin.chunks")
+    old = ChunkStore.write(path, make_docs(3))
+    new = ChunkStore.write(path, make_docs(2, prefix="new"))
+
+    assert old.path != new.path
+    assert ChunkStore.current_path(path) == new.path
+    # прежняя версия остается, пока на нее ссылается индекс
+    assert ChunkStore(old.path).get(old.ids[0]).page_content == "chunk 0"
+    assert ChunkStore.prune(new.path) == 1
+    assert not os.path.exists(old.path)
+    assert ChunkStore.prune(new.path) == 0
+
+
+def test_docstore_pickle(tmp_path):
+    store = ChunkStore.write(str(tmp_path / "Coin.chunks"), make_docs(3))
+    docstore = ChunkDocstore(store.path)
+    docstore.add({"extra": Document(page_content="extra")})
+    docstore.delete([store.ids[0]])
+
+    restored = pickle.loads(pickle.dumps(docstore))
+    assert restored.path == store.path
+    assert restored.search("extra").page_content == "extra"
+    assert restored.search(store.ids[1]).page_content == "chunk 1"
+    assert restored.search(store.ids[0]) == f"ID {store.ids[0]} not found."
+
+
+def test_docstore_of_pruned_version(tmp_path):
+    path = str(tmp_path / "Coin.chunks")
+    old = ChunkStore.write(path, make_docs(3))
+    docstore = ChunkDocstore(old.path)
+    state = pickle.dumps(docstore)
+    new = ChunkStore.write(path, make_docs(3, prefix="new"))
+    ChunkStore.prune(new.path)
+
+    # открытая версия читается и после удаления
+    assert docstore.search(old.ids[1]).page_content == "chunk 1"
+    # а загрузка индекса со ссылкой на нее не подменяет ее текущей
+    with pytest.raises(StaleIndexError):
+        pickle.loads(state)
+    with pytest.raises(StaleIndexError):
+        ChunkDocstore(old.path)
@@ -0,0 +1,52 @@
+import faiss
+import numpy as np
+import pytest
+
+from crypto_llm.compression import IndexBuilder, index_type_of, recall_at_k
+
+
+def vectors(n, dim=32, seed=0):
+    return np.random.default_rng(seed).standard_normal((n, dim)).astype("float32")
+
+
+def test_ivfpq_falls_back_to_fp16_for_small_documents():
+    builder = IndexBuilder("ivfpq", pq_m=8, min_ivfpq_vectors=500)
+
+    assert index_type_of(builder.build(vectors(499))) == "fp16"
+    index = builder.build(vectors(500))
+    assert index_type_of(index) == "ivfpq"
+    assert index.ntotal == 500
+
+
+def test_unknown_index_type():
+    with pytest.raises(ValueError):
+        IndexBuilder("hnsw")
+
+
+def test_fp16_keeps_recall():
+    data = vectors(300)
+    exact = faiss.IndexFlatL2(data.shape[1])
+    exact.add(data)
+    index = IndexBuilder("fp16").build(data)
+
+    assert recall_at_k(index, exact, vectors(20, seed=1), k=5) > 0.95
+
+
+def test_convert_index_round_trip(vectorizer, data_path):
+    assert vectorizer.calc_and_save_embedding("Coin")
+    path = data_path + "embeddings/Coin"
+    before = vectorizer.load_index(path)
+    query = before.similarity_search("token", k=3)
+
+    old_bytes, new_bytes = vectorizer.convert_index("Coin", IndexBuilder("fp16"))
+    converted = vectorizer.load_index(path)
+    assert index_type_of(converted.index) == "fp16"
+    assert new_bytes < old_bytes
+    assert converted.index.ntotal == before.index.ntotal
+    assert converted.index_to_docstore_id == before.index_to_docstore_id
+    assert converted.similarity_search("token", k=3) == query
+
+    vectorizer.convert_index("Coin", IndexBuilder("flat"))
+    restored = vectorizer.load_index(path)
+    assert index_type_of(restored.index) == "flat"
+    assert restored.similarity_search("token", k=3) == query
@@ -0,0 +1,34 @@
+import threading
+
+from benchmarks.fakes import HashEmbeddings
+from crypto_llm.embedder import CachedEmbeddings
+
+
+def test_cache_shared_by_connections(tmp_path):
+    path = str(tmp_path / "embeddings.sqlite")
+    caches = [CachedEmbeddings(HashEmbeddings(dim=8), path) for _ in range(4)]
+    assert caches[0].conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+
+    errors = []
+
+    def embed(cache, worker):
+        try:
+            for i in range(20):
+                cache.embed_documents([f"text {worker} {i}", "shared text"])
+        except Exception as e:
+            errors.append(e)
+
+    threads = [
+        threading.Thread(target=embed, args=(cache, i))
+        for i, cache in enumerate(caches)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+
+    # новое подключение находит векторы, записанные другими
+    cache = CachedEmbeddings(HashEmbeddings(dim=8), path)
+    cache.embed_documents(["text 3 19", "shared text"])
+    assert cache.computed == 0
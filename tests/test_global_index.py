@@ -0,0 +1,65 @@
+import pytest
+from langchain_community.vectorstores import FAISS
+
+from benchmarks.fakes import HashEmbeddings
+from crypto_llm.global_index import GlobalIndex
+
+
+def stores(embedder):
+    for name, word in (("Apple", "apple"), ("Banana", "banana"), ("Cherry", "cherry")):
+        texts = [f"{word} chunk {i} {word}" for i in range(10)]
+        yield name, FAISS.from_texts(
+            texts, embedder, metadatas=[{"page": i} for i in range(10)]
+        )
+
+
+@pytest.mark.parametrize("index_type", ["hnsw", "ivf"])
+def test_search_is_restricted_to_one_currency(tmp_path, index_type):
+    embedder = HashEmbeddings(dim=32)
+    index = GlobalIndex(str(tmp_path / "global"), index_type=index_type, n_shards=2)
+    index.build(stores(embedder), n_currencies=3)
+    query = embedder.embed_query("banana chunk")
+
+    hits = index.search(query, k=5, currency_name="Apple")
+    assert len(hits) == 5
+    assert {doc.metadata["currency"] for doc, _ in hits} == {"Apple"}
+    # валюта во втором шарде
+    hits = index.search(query, k=20, currency_name="Cherry")
+    assert len(hits) == 10
+    assert {doc.metadata["currency"] for doc, _ in hits} == {"Cherry"}
+    assert index.search(query, k=5, currency_name="Missing") == []
+    hits = index.search(query, k=3)
+    assert {doc.metadata["currency"] for doc, _ in hits} == {"Banana"}
+
+    loaded = GlobalIndex(str(tmp_path / "global"))
+    loaded.load()
+    assert loaded.index_type == index_type
+    assert loaded.currencies == index.currencies
+
+
+def test_migration_from_per_currency_indexes(vectorizer, data_path):
+    from crypto_llm.vectorizer import FAISSVectorizer
+
+    for name in ("Coin", "Other"):
+        assert vectorizer.calc_and_save_embedding(name)
+    vectorizer.build_global_index(n_shards=2)
+    per_currency = vectorizer.load_index(data_path + "embeddings/Coin")
+
+    migrated = FAISSVectorizer(
+        storage=vectorizer.storage,
+        embedder=vectorizer._base_embedder,
+        use_global_index=True,
+        lazy=True,
+    )
+    assert migrated.in_global_index("Coin")
+    assert migrated.global_index.currencies["Coin"][2] == per_currency.index.ntotal
+    docs = migrated.get_retriever("Coin", k=4).invoke("token")
+    assert len(docs) == 4
+    assert {doc.metadata["currency"] for doc in docs} == {"Coin"}
+    assert [doc.page_content for doc in docs] == [
+        doc.page_content for doc in per_currency.similarity_search("token", k=4)
+    ]
+    assert {doc.metadata["currency"] for doc in migrated.search_all("token", k=8)} == {
+        "Coin",
+        "Other",
+    }
@@ -0,0 +1,68 @@
+import pytest
+
+from crypto_llm.ingestion import IngestionQueue
+
+
+@pytest.fixture
+def queue(tmp_path):
+    # без воркеров задачи остаются в очереди, пока их не заберет тест
+    return IngestionQueue(lambda name: True, str(tmp_path / "jobs.sqlite"), workers=0)
+
+
+def test_requests_before_prefetch(queue):
+    queue.prefetch(["A", "B"])
+    queue.submit("C")
+    queue.submit("B")
+
+    assert [queue.claim() for _ in range(4)] == ["B", "C", "A", None]
+
+
+def test_requeue_stale(queue):
+    queue.submit("A")
+    assert queue.claim() == "A"
+    assert queue.requeue_stale() == 0
+
+    queue.stale_after = 0
+    assert queue.requeue_stale() == 1
+    assert queue.status("A") == "queued"
+    assert queue.claim() == "A"
+
+
+def test_most_requested(queue):
+    for name, requests in (("A", 1), ("B", 3), ("C", 2)):
+        for _ in range(requests):
+            queue.submit(name)
+    queue.prefetch(["D"])
+    queue.submit("C", count=False)
+    for _ in range(50):
+        queue.status("A")
+
+    assert queue.most_requested(3) == ["B", "C", "A"]
+    queue.claim()
+    queue.run_job("B")
+    assert queue.status("B") == "done"
+
+    queue.ingest = lambda name: False
+    queue.claim()
+    queue.run_job("C")
+    assert queue.status("C") == "failed"
+    assert queue.most_requested(3) == ["B", "A"]
+
+
+def test_requeue_when_index_is_deleted(tmp_path):
+    indexed = set()
+
+    def ingest(name):
+        indexed.add(name)
+        return True
+
+    queue = IngestionQueue(
+        ingest, str(tmp_path / "jobs.sqlite"), ready=indexed.__contains__, workers=0
+    )
+    assert queue.submit("A") == "queued"
+    queue.run_job(queue.claim())
+    assert queue.submit("A") == "ready"
+
+    indexed.clear()
+    assert queue.submit("A") == "queued"
+    assert queue.claim() == "A"
@@ -0,0 +1,51 @@
+from crypto_llm.ingestion import PREPARING_MESSAGE
+
+
+class FakeChainer:
+    """
+    LlmChainer with background ingestion: "Slow" is never indexed in time,
+    "Missing" has no whitepaper.
+    """
+
+    def __init__(self):
+        self.polls = {}
+
+    def cached_summaries(self, names):
+        return {}
+
+    def poll_ingestion(self, name):
+        self.polls[name] = self.polls.get(name, 0) + 1
+        if name == "Slow" or self.polls[name] < 2:
+            return "running"
+        return "ready"
+
+    def run_chain(self, name, is_summary=False):
+        if name == "Missing":
+            return None
+        if name == "Slow" or name not in self.polls:
+            return PREPARING_MESSAGE
+        return f"summary of {name}"
+
+
+def test_preparing_message_is_not_a_summary(data_path):
+    from crypto_llm.jobs import SummaryPrecomputeJob
+
+    chainer = FakeChainer()
+    job = SummaryPrecomputeJob(
+        chainer, workers=2, ingestion_timeout=0.5, poll_interval=0.01
+    )
+    report = job.run(["Coin", "Slow", "Missing"])
+
+    assert report["done"] == 1
+    assert report["pending"] == ["Slow"]
+    assert report["failed"] == {"Missing": "whitepaper not found"}
+    assert job.load_checkpoint() == {
+        "Coin": "done",
+        "Slow": "pending",
+        "Missing": "failed",
+    }
+
+    # следующий запуск повторяет ожидающие, но не упавшие
+    report = job.run(["Slow", "Missing"])
+    assert report["pending"] == ["Slow"]
+    assert report["skipped"] == 1
@@ -0,0 +1,48 @@
+from langchain_core.documents import Document
+
+from crypto_llm.lexical import LexicalIndex
+
+TEXTS = [
+    "Proof of History orders transactions before consensus",
+    "Validators stake SOL to vote on blocks",
+    "Fees are paid in SOL and partly burned",
+    "The ledger is replicated by archivers",
+]
+
+
+def test_bm25_search(tmp_path):
+    index = LexicalIndex.build(["a", "b", "c", "d"], TEXTS)
+
+    assert index.search("poh proof history")[0][0] == "a"
+    # оба чанка со словом sol, но во втором его вес выше из-за длины
+    assert [key for key, _ in index.search("SOL")] == ["b", "c"]
+    assert [key for key, _ in index.search("SOL", k=1)] == ["b"]
+    assert index.search("unknown words") == []
+
+    index.save(str(tmp_path))
+    loaded = LexicalIndex.load(str(tmp_path))
+    assert len(loaded) == 4
+    assert loaded.search("SOL fees") == index.search("SOL fees")
+
+
+def test_hybrid_search(vectorizer):
+    docs = [
+        Document(page_content=text, metadata={"page": i})
+        for i, text in enumerate(TEXTS)
+    ]
+    vectorizer.storage.wp_loader.save_info("Coin", docs)
+    assert vectorizer.calc_and_save_embedding("Coin")
+
+    found = vectorizer.hybrid_search("Coin", "archivers replicate the ledger", k=2)
+    assert found[0].page_content == TEXTS[3]
+    found = vectorizer.hybrid_search("Coin", "burned fees", k=1, mode="lexical")
+    assert [doc.page_content for doc in found] == [TEXTS[2]]
+
+    # без эмбеддера гибридный поиск остается лексическим
+    def fail(query):
+        raise RuntimeError("embedder is down")
+
+    vectorizer.embedder.embed_query = fail
+    found = vectorizer.hybrid_search("Coin", "validators vote", k=1)
+    assert [doc.page_content for doc in found] == [TEXTS[1]]
+    assert vectorizer._embed_failed_at is not None
@@ -0,0 +1,46 @@
+def test_parse_local_pdf(data_path, pdf_path):
+    from crypto_llm.loader import WhitePaperLoader
+
+    loader = WhitePaperLoader()
+    assert loader.get_info("Coin", pdf_path)
+
+    store = loader.load_info("Coin")
+    docs = list(store)
+    assert len(docs) >= 6
+    assert {doc.metadata["page"] for doc in docs} == set(range(6))
+    assert all(doc.metadata["source"] == pdf_path for doc in docs)
+    assert all(len(doc.page_content) <= 500 for doc in docs)
+    # локальный файл не удаляется как скачанный
+    assert loader.download(pdf_path) == pdf_path
+
+
+def test_parallel_ingestion(data_path, pdf_path):
+    from crypto_llm.loader import WhitePaperLoader
+
+    loader = WhitePaperLoader()
+    links = [("A", pdf_path), ("B", pdf_path), ("C", data_path + "missing.pdf")]
+    results = loader.get_info_batch(links, parallel=True, parse_workers=2)
+
+    statuses = {result.name: result.status for result in results}
+    assert statuses == {"A": "done", "B": "done", "C": "failed"}
+    assert len(loader.load_info("A")) == len(loader.load_info("B")) > 0
+    assert loader.load_info("C") is None
+
+    # повторный запуск пропускает уже разобранные whitepaper
+    results = loader.get_info_batch(links[:2], parallel=True, parse_workers=2)
+    assert [result.status for result in results] == ["skipped", "skipped"]
+
+
+def test_fetch_info_of_unknown_symbol():
+    from benchmarks.fakes import FakeCMCClient
+    from crypto_llm.loader import CMCLoader
+    from crypto_llm.scheduler import RequestScheduler
+
+    loader = CMCLoader(
+        scheduler=RequestScheduler(limits={"cmc": {"rate": 100, "burst": 100}})
+    )
+    loader.cmc_client = FakeCMCClient([("Coin", "COIN", "coin.pdf")])
+
+    assert loader.fetch_info("COIN")["technical_doc"].tolist() == ["coin.pdf"]
+    # API пропускает неизвестные символы вместо ошибки
+    assert loader.fetch_info("NONE") is None
@@ -0,0 +1,51 @@
+import math
+import os
+
+import pytest
+
+torch = pytest.importorskip("torch")
+transformers = pytest.importorskip("transformers")
+
+from crypto_llm.embedder import LocalEmbeddings  # noqa: E402
+
+WORDS = ["proof", "of", "stake", "history", "token", "fees", "validators"]
+
+
+@pytest.fixture(scope="module")
+def model_path(tmp_path_factory):
+    # крошечная BERT со случайными весами вместо настоящей модели
+    path = tmp_path_factory.mktemp("tiny-bert")
+    vocab = path / "vocab.txt"
+    vocab.write_text(
+        "\n".join(["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"] + WORDS) + "\n"
+    )
+    transformers.BertTokenizer(str(vocab)).save_pretrained(str(path))
+    config = transformers.BertConfig(
+        vocab_size=5 + len(WORDS),
+        hidden_size=32,
+        num_hidden_layers=1,
+        num_attention_heads=2,
+        intermediate_size=64,
+        max_position_embeddings=64,
+    )
+    torch.manual_seed(0)
+    transformers.BertModel(config).save_pretrained(str(path))
+    return str(path)
+
+
+@pytest.mark.parametrize("pooling", ["pooler", "cls", "mean"])
+def test_batches_keep_order(model_path, pooling):
+    texts = ["proof of stake", "token", "fees of validators history", "stake"]
+    embedder = LocalEmbeddings(model_path, batch_size=2, pooling=pooling)
+
+    vectors = embedder.embed_documents(texts)
+    assert len(vectors) == 4 and all(len(v) == 32 for v in vectors)
+    assert all(math.isclose(sum(x * x for x in v), 1.0, rel_tol=1e-4) for v in vectors)
+    # результат не зависит от того, с какими текстами текст попал в батч
+    for text, vector in zip(texts, vectors):
+        assert embedder.embed_query(text) == pytest.approx(vector, abs=1e-5)
+
+
+def test_model_name(model_path):
+    assert LocalEmbeddings(model_path).model == os.path.basename(model_path)
+    assert LocalEmbeddings(model_path, model_name="m", quantize=True).model == "m-int8"
@@ -0,0 +1,83 @@
+import logging
+
+import pytest
+
+from crypto_llm.metrics import PrometheusTextFileSink, Span, Tracer
+
+
+def test_spans_are_nested_and_recorded():
+    tracer = Tracer()
+    with tracer.span("run_chain") as parent:
+        with tracer.span("retrieval", chunks=8) as child:
+            assert tracer.current() is child
+        parent.set(outcome="generated")
+    with pytest.raises(KeyError):
+        with tracer.span("llm"):
+            raise KeyError("boom")
+
+    spans = {span.name: span for span in tracer.memory.spans}
+    assert spans["retrieval"].parent == "run_chain"
+    assert spans["run_chain"].parent is None
+    assert spans["llm"].error == "KeyError"
+    assert tracer.current() is None
+    summary = tracer.memory.summary()
+    assert summary["retrieval"]["chunks_mean"] == 8
+    assert summary["llm"]["errors"] == 1
+
+
+def test_prometheus_text_format(tmp_path):
+    path = str(tmp_path / "metrics.prom")
+    sink = PrometheusTextFileSink(path, flush_interval=3600)
+    sink.record(Span("retrieval", duration=0.003, attributes={"chunks": 8}))
+    sink.record(Span("retrieval", duration=0.2, attributes={"chunks": 4}))
+    sink.record(Span("llm", duration=2.0, error="TimeoutError"))
+    sink.flush()
+
+    with open(path) as f:
+        lines = f.read().splitlines()
+    name = "crypto_llm_stage_duration_seconds"
+    assert lines[0] == f"# TYPE {name} histogram"
+    # корзины накопительные
+    assert f'{name}_bucket{{stage="retrieval",le="0.005"}} 1' in lines
+    assert f'{name}_bucket{{stage="retrieval",le="0.25"}} 2' in lines
+    assert f'{name}_bucket{{stage="retrieval",le="+Inf"}} 2' in lines
+    assert f'{name}_count{{stage="retrieval"}} 2' in lines
+    assert f'{name}_sum{{stage="retrieval"}} 0.203' in lines
+    assert f'{name}_bucket{{stage="llm",le="1"}} 0' in lines
+    assert "# TYPE crypto_llm_stage_errors_total counter" in lines
+    assert 'crypto_llm_stage_errors_total{stage="llm"} 1' in lines
+    assert (
+        'crypto_llm_stage_counter_total{stage="retrieval",counter="chunks"} 12.0'
+        in lines
+    )
+
+
+def test_payloads_are_logged_only_when_enabled(data_path, caplog):
+    from crypto_llm.chainer import LlmChainer
+
+    question = "Какой алгоритм консенсуса?"
+    with caplog.at_level(logging.INFO, logger="crypto_llm.chainer"):
+        LlmChainer(lazy=True).log_payload("Question: %s", question)
+        LlmChainer(lazy=True, log_payloads=True).log_payload("Question: %s", question)
+
+    messages = [r.getMessage() for r in caplog.records if "Question" in r.message]
+    assert messages == [f"Question: <{len(question)} chars>", f"Question: {question}"]
+
+
+def test_chain_stages_are_recorded(data_path, vectorizer):
+    from benchmarks.fakes import fake_llm
+    from crypto_llm.chainer import LlmChainer
+    from crypto_llm.metrics import get_tracer
+
+    chainer = LlmChainer(lazy=True, llm=fake_llm("answer"), vectorizer=vectorizer)
+    tracer = get_tracer()
+    tracer.memory.clear()
+    assert chainer.run_chain("Coin", "token?") == "answer"
+
+    spans = {span.name: span for span in tracer.memory.spans}
+    for stage in ("retrieval", "format_docs", "prompt", "llm"):
+        assert spans[stage].parent == "run_chain"
+    assert spans["retrieval"].attributes["chunks"] == 8
+    assert spans["prompt"].attributes["prompt_tokens"] > 0
+    assert spans["llm"].attributes["answer_chars"] == len("answer")
+    assert spans["run_chain"].attributes["outcome"] == "generated"
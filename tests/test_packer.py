@@ -0,0 +1,41 @@
+from langchain_core.documents import Document
+
+from crypto_llm.packer import ContextPacker
+
+
+def words(start, stop):
+    return " ".join(f"word{i}" for i in range(start, stop))
+
+
+def test_duplicates_and_overlap_are_packed_once():
+    # соседние чанки пересекаются на word8..word11, как после сплиттера
+    first, second = words(0, 12), words(8, 20)
+    docs = [Document(page_content=t) for t in (first, second, first)]
+
+    packed = ContextPacker(max_tokens=None).pack(docs)
+    assert packed.fragments == [first, words(12, 20)]
+    assert packed.duplicates == 1
+    assert packed.tokens_saved > 0
+
+
+def test_overlap_with_a_later_chunk_is_cut():
+    first, second = words(0, 12), words(8, 20)
+    docs = [Document(page_content=t) for t in (second, first)]
+
+    packed = ContextPacker(max_tokens=None).pack(docs, order="document")
+    assert packed.fragments == [words(0, 8), second]
+
+
+def test_token_budget():
+    docs = [Document(page_content=f"chunk {i} " + "x" * 400) for i in range(5)]
+    packer = ContextPacker(max_tokens=250, count_tokens=len)
+
+    packed = packer.pack(docs)
+    assert packed.chunks == 0
+    assert packed.dropped == 5
+
+    packed = packer.pack(docs, max_tokens=1000)
+    assert packed.chunks == 2
+    assert packed.dropped == 3
+    assert packed.tokens <= 1000
+    assert packed.fragments[0].startswith("chunk 0")
@@ -0,0 +1,176 @@
+import asyncio
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from crypto_llm.model import HttpPool, ScheduledChatNVIDIA
+from crypto_llm.scheduler import HTTPStatusError, RequestScheduler
+
+COMPLETION = {
+    "id": "1",
+    "object": "chat.completion",
+    "model": "test/model",
+    "choices": [
+        {
+            "index": 0,
+            "message": {"role": "assistant", "content": "hello"},
+            "finish_reason": "stop",
+        }
+    ],
+}
+
+
+class FakeServer(ThreadingHTTPServer):
+    """
+    Answers POST requests with the scripted (status, headers) pairs in turn,
+    then with 200 and a chat completion.
+    """
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), FakeHandler)
+        self.script = []
+        self.requests = 0
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}/v1"
+
+
+class FakeHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def reply(self, status, headers, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        self.reply(200, {}, {"data": [{"id": "test/model", "object": "model"}]})
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.server.requests += 1
+        if self.server.script:
+            status, headers = self.server.script.pop(0)
+            self.reply(status, headers, {"status": status, "title": "error"})
+        else:
+            self.reply(200, {}, COMPLETION)
+
+
+@pytest.fixture
+def server():
+    server = FakeServer()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def scheduler():
+    # без Retry-After тест ждал бы backoff в минуты
+    return RequestScheduler(
+        limits={"test": {"rate": 1000, "burst": 1000}}, base_delay=60, max_delay=60
+    )
+
+
+def post(pool, url):
+    return pool.get_session().post(url + "/chat/completions", json={}).json()
+
+
+def test_retry_after_is_honoured(server, scheduler):
+    server.script = [(429, {"Retry-After": "0"}), (429, {"Retry-After": "0"})]
+    assert scheduler.call("test", post, HttpPool(), server.url) == COMPLETION
+    assert server.requests == 3
+    assert scheduler.metrics()["test"]["retries"] == 2
+
+
+def test_server_error_is_retried(server, scheduler):
+    server.script = [(500, {"Retry-After": "0"})]
+    assert scheduler.call("test", post, HttpPool(), server.url) == COMPLETION
+    assert server.requests == 2
+
+
+def test_client_error_is_not_retried(server, scheduler):
+    server.script = [(401, {})]
+    with pytest.raises(HTTPStatusError) as error:
+        scheduler.call("test", post, HttpPool(), server.url)
+    assert error.value.status_code == 401
+    assert server.requests == 1
+    assert scheduler.metrics()["test"]["failures"] == 1
+
+
+def test_error_without_response_is_not_retried(scheduler):
+    calls = []
+
+    def fail():
+        calls.append(1)
+        raise ValueError("bug")
+
+    with pytest.raises(ValueError):
+        scheduler.call("test", fail)
+    assert len(calls) == 1
+
+
+def test_async_retry(server, scheduler):
+    server.script = [(429, {"Retry-After": "0"}), (401, {})]
+    pool = HttpPool()
+
+    async def apost():
+        async with pool.get_async_session() as session:
+            async with session.post(server.url + "/chat/completions", json={}) as r:
+                return await r.json()
+
+    with pytest.raises(HTTPStatusError) as error:
+        asyncio.run(scheduler.acall("test", apost))
+    assert error.value.status_code == 401
+    assert server.requests == 2
+
+
+def test_chat_model_is_retried(server, scheduler):
+    llm = ScheduledChatNVIDIA(
+        base_url=server.url, model="test/model", api_key="key", endpoint="test"
+    )
+    llm._scheduler = scheduler
+    HttpPool().install(llm)
+
+    server.script = [(429, {"Retry-After": "0"})]
+    assert llm.invoke("hi").content == "hello"
+    assert server.requests == 2
+
+    server.script = [(503, {"Retry-After": "0"})]
+    assert asyncio.run(llm.ainvoke("hi")).content == "hello"
+    assert server.requests == 4
+
+    server.script = [(401, {})]
+    with pytest.raises(HTTPStatusError):
+        llm.invoke("hi")
+    assert server.requests == 5
+
+
+def test_pool_keeps_sdk_session_settings(server):
+    llm = ScheduledChatNVIDIA(
+        base_url=server.url, model="test/model", api_key="key", verify_ssl=False
+    )
+    pool = HttpPool()
+    pool.install(llm)
+
+    session = llm._client.get_session_fn()
+    assert session is llm._client.get_session_fn()
+    assert session.verify is False
+    assert session.get_adapter("https://example.com") is pool.adapter
+
+    async def connector_ssl():
+        async with llm._client.get_async_session_fn() as session:
+            return session.connector._ssl
+
+    assert asyncio.run(connector_ssl()) is False
@@ -0,0 +1,46 @@
+import json
+import os
+import subprocess
+import sys
+
+from benchmarks.startup import CURRENCY, HEAVY_MODULES, PROBE
+
+
+def test_cached_summary_does_not_load_heavy_modules(data_path):
+    from crypto_llm.chainer import LlmChainer
+
+    os.makedirs(data_path + "summaries", exist_ok=True)
+    LlmChainer(lazy=True).save_summary(CURRENCY, "Синтетическое саммари.")
+
+    # отдельный процесс: в текущем тяжелые модули уже импортированы тестами
+    env = {
+        key: value
+        for key, value in os.environ.items()
+        if key not in ("NVIDIA_API_KEY", "CMC_API_KEY")
+    }
+    repo_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env["PYTHONPATH"] = os.pathsep.join(
+        filter(None, [repo_path, env.get("PYTHONPATH")])
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", PROBE.format(currency=CURRENCY, heavy=HEAVY_MODULES)],
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    sample = json.loads(result.stdout.strip().splitlines()[-1])
+    assert sample["cached"]
+    assert sample["heavy_modules"] == []
+
+
+def test_cached_summary_does_not_create_clients(data_path):
+    from crypto_llm.chainer import LlmChainer
+
+    os.makedirs(data_path + "summaries", exist_ok=True)
+    LlmChainer(lazy=True).save_summary(CURRENCY, "Синтетическое саммари.")
+
+    chainer = LlmChainer(lazy=True)
+    assert chainer.run_chain(CURRENCY, is_summary=True) == "Синтетическое саммари."
+    assert chainer._llm is None
+    assert chainer._vectorizer is None
@@ -0,0 +1,116 @@
+import os
+import shutil
+
+
+class FailingCMCLoader:
+    """
+    CMCLoader with the API down.
+    """
+
+    def get_all_cmc_list(self, *args):
+        return None
+
+
+def copy_currency_names(data_path):
+    os.makedirs(data_path + "sources/cmc", exist_ok=True)
+    repo_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    shutil.copy(
+        os.path.join(repo_path, "data/sources/cmc/pdf_correct_names.csv"),
+        data_path + "sources/cmc/",
+    )
+
+
+def test_fresh_install_without_api(data_path):
+    from crypto_llm.storage import CMC_LIST_COLUMNS, FileStorage
+
+    copy_currency_names(data_path)
+    storage = FileStorage(cmc_loader=FailingCMCLoader())
+    assert list(storage.cmc_list.columns) == CMC_LIST_COLUMNS
+    assert storage.cmc_list.empty
+    assert storage.symbol_by_name == {}
+
+
+def test_lookups_by_name(data_path):
+    import pandas as pd
+    from benchmarks.fakes import FakeCMCClient
+    from crypto_llm.loader import CMCLoader
+    from crypto_llm.scheduler import RequestScheduler
+    from crypto_llm.storage import FileStorage
+
+    copy_currency_names(data_path)
+    # старый csv с монетой того же названия без pdf
+    pd.DataFrame(
+        [{"name": "Twin", "symbol": "TWB", "technical_doc": "https://twin.org"}]
+    ).to_csv(data_path + "sources/cmc/cmc_info.csv", index=False)
+    loader = CMCLoader(
+        scheduler=RequestScheduler(limits={"cmc": {"rate": 100, "burst": 100}})
+    )
+    loader.cmc_client = FakeCMCClient(
+        [("Coin", "COIN", "coin.pdf"), ("Twin", "TWA", "twa.pdf"), ("Twin", "TWB", "")]
+    )
+
+    storage = FileStorage(cmc_loader=loader)
+    assert storage.symbol_by_name == {"Coin": "COIN", "Twin": "TWA"}
+    calls = loader.cmc_client.calls
+    storage.get_symbols_by_names(["Coin", "Twin", "Missing", "Coin"])
+    # один запрос детальной информации на оба символа
+    calls += 1
+    assert loader.cmc_client.calls == calls
+    assert {name: len(rows) for name, rows in storage.info_rows_by_name.items()} == {
+        "Twin": 2,
+        "Coin": 1,
+    }
+    assert storage.get_pdf_whitepaper_link("Twin") == ["Twin", "twa.pdf"]
+    assert storage.get_pdf_whitepaper_link("Coin") == ["Coin", "coin.pdf"]
+    assert storage.get_pdf_whitepaper_link("Missing") == [None, None]
+
+    storage.get_symbols_by_names(["Coin", "Twin"])
+    assert loader.cmc_client.calls == calls
+
+    # листинг берется из снимка, информация из parquet
+    storage.save_cmc_info()
+    reloaded = FileStorage(cmc_loader=loader)
+    assert loader.cmc_client.calls == calls
+    assert reloaded.info_rows_by_name == storage.info_rows_by_name
+    assert reloaded.get_pdf_whitepaper_link("Twin") == ["Twin", "twa.pdf"]
+
+
+def test_cmc_list_snapshot(data_path, monkeypatch):
+    from benchmarks.fakes import FakeCMCClient
+    from crypto_llm import storage as storage_module
+    from crypto_llm.loader import CMCLoader
+    from crypto_llm.scheduler import RequestScheduler
+    from crypto_llm.storage import FileStorage
+
+    copy_currency_names(data_path)
+    loader = CMCLoader(
+        scheduler=RequestScheduler(limits={"cmc": {"rate": 100, "burst": 100}})
+    )
+    loader.cmc_client = FakeCMCClient([("Coin", "COIN", "coin.pdf")])
+
+    FileStorage(cmc_loader=loader)
+    calls = loader.cmc_client.calls
+    assert calls > 0
+    # в пределах TTL листинг читается с диска
+    storage = FileStorage(cmc_loader=loader)
+    assert loader.cmc_client.calls == calls
+    assert storage.symbol_by_name == {"Coin": "COIN"}
+
+    loader.cmc_client.coins.append(("New", "NEW", "new.pdf"))
+    storage = FileStorage(refresh=True, cmc_loader=loader)
+    assert loader.cmc_client.calls > calls
+    assert storage.symbol_by_name == {"Coin": "COIN", "New": "NEW"}
+
+    calls = loader.cmc_client.calls
+    FileStorage(cmc_list_ttl=0, cmc_loader=loader)
+    assert loader.cmc_client.calls > calls
+
+    # API недоступен: используется устаревший снимок
+    storage = FileStorage(cmc_list_ttl=0, cmc_loader=FailingCMCLoader())
+    assert storage.symbol_by_name == {"Coin": "COIN", "New": "NEW"}
+
+    monkeypatch.setattr(storage_module, "_storage", None)
+    monkeypatch.setattr(storage_module, "CMCLoader", lambda: loader)
+    calls = loader.cmc_client.calls
+    assert storage_module.get_storage() is storage_module.get_storage()
+    assert loader.cmc_client.calls == calls
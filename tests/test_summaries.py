@@ -0,0 +1,85 @@
+import time
+
+from langchain_core.documents import Document
+
+from crypto_llm.chunkstore import ChunkStore
+from crypto_llm.summaries import SummaryKey, SummaryStore, whitepaper_digest
+
+
+def test_versions_are_separate(tmp_path):
+    store = SummaryStore(str(tmp_path / "summaries.sqlite"))
+    key = SummaryKey("Coin", "v1", "prompt", "model")
+    store.put(key, "old summary")
+
+    assert store.get(key) == "old summary"
+    for changed in (
+        SummaryKey("Coin", "v2", "prompt", "model"),
+        SummaryKey("Coin", "v1", "prompt2", "model"),
+        SummaryKey("Coin", "v1", "prompt", "model2"),
+    ):
+        assert store.get(changed) is None
+    store.put(key, "new summary")
+    assert store.get(key) == "new summary"
+    assert store.hits == 2
+
+    assert store.delete(prompt="prompt") == 1
+    assert store.get(key) is None
+
+
+def test_shared_between_connections(tmp_path):
+    path = str(tmp_path / "summaries.sqlite")
+    key = SummaryKey("Coin", "v1", "prompt", "model")
+    SummaryStore(path).put(key, "summary")
+    assert SummaryStore(path).get_many(
+        [key, SummaryKey("Other", "v1", "prompt", "model")]
+    ) == {"Coin": "summary"}
+
+
+def test_ttl_and_max_entries(tmp_path):
+    store = SummaryStore(str(tmp_path / "summaries.sqlite"), max_entries=2)
+    keys = [SummaryKey(f"Coin{i}", "v1", "prompt", "model") for i in range(3)]
+    store.put(keys[0], "0")
+    store.put(keys[1], "1")
+    time.sleep(0.01)
+    store.get(keys[0])
+    store.put(keys[2], "2")
+    # вытесняется давно не читанная запись
+    assert store.get_many(keys) == {"Coin0": "0", "Coin2": "2"}
+
+    store.ttl = 0
+    assert store.get(keys[0]) is None
+
+
+def test_whitepaper_digest_follows_chunk_store(tmp_path):
+    path = str(tmp_path / "Coin.chunks")
+    assert whitepaper_digest(path) == ""
+    ChunkStore.write(path, [Document(page_content="first version")])
+    first = whitepaper_digest(path)
+    ChunkStore.write(path, [Document(page_content="second version")])
+    assert first and whitepaper_digest(path) not in ("", first)
+
+
+def test_legacy_summary_waits_for_whitepaper_version(data_path):
+    import os
+    import pickle
+
+    from crypto_llm.chainer import LlmChainer
+
+    os.makedirs(data_path + "summaries")
+    os.makedirs(data_path + "sources/whitepapers")
+    with open(data_path + "summaries/Coin.txt", "w") as f:
+        f.write("legacy summary")
+    chainer = LlmChainer(lazy=True)
+
+    # без whitepaper ключ неизвестен, файл остается на месте
+    assert chainer.get_summary("Coin") is None
+    assert os.path.exists(data_path + "summaries/Coin.txt")
+
+    # whitepaper старого формата сначала переводится в хранилище чанков
+    with open(data_path + "sources/whitepapers/Coin.pkl", "wb") as f:
+        pickle.dump([Document(page_content="legacy chunk")], f)
+    assert chainer.get_summary("Coin") == "legacy summary"
+    assert not os.path.exists(data_path + "summaries/Coin.txt")
+    key = chainer.summary_key("Coin")
+    assert key.whitepaper
+    assert chainer.summary_store.get(key) == "legacy summary"
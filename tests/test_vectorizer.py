@@ -0,0 +1,101 @@
+import os
+import threading
+
+
+def test_concurrent_builds_of_one_currency(vectorizer, data_path):
+    results = []
+    threads = [
+        threading.Thread(
+            target=lambda: results.append(vectorizer.calc_and_save_embedding("Coin"))
+        )
+        for _ in range(4)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results == [True] * 4
+    # одна версия чанков и указатель на нее, без временных папок
+    chunks = os.listdir(data_path + "sources/whitepapers/Coin.chunks")
+    assert sorted(name for name in chunks if name != "CURRENT") == [
+        vectorizer.load_whitepaper("Coin").path.rsplit("/", 1)[1]
+    ]
+    assert len(vectorizer.get_retriever("Coin", k=3).invoke("token")) == 3
+
+
+def test_concurrent_saves_and_reads(vectorizer, data_path):
+    assert vectorizer.calc_and_save_embedding("Coin")
+    path = data_path + "embeddings/Coin"
+    db = vectorizer.load_index(path)
+    errors = []
+    done = threading.Event()
+
+    def save():
+        try:
+            for _ in range(5):
+                vectorizer.save_index(db, "Coin")
+        except Exception as e:
+            errors.append(e)
+
+    def read():
+        while not done.is_set():
+            try:
+                assert vectorizer.load_index(path).index.ntotal == db.index.ntotal
+                vectorizer.index_version("Coin")
+            except Exception as e:
+                errors.append(e)
+                return
+
+    readers = [threading.Thread(target=read) for _ in range(2)]
+    writers = [threading.Thread(target=save) for _ in range(4)]
+    for thread in readers + writers:
+        thread.start()
+    for thread in writers:
+        thread.join()
+    done.set()
+    for thread in readers:
+        thread.join()
+
+    assert errors == []
+    assert vectorizer.index_names() == ["Coin"]
+    assert sorted(os.listdir(data_path + "embeddings")) == ["Coin", "Coin.lock"]
+    assert sorted(os.listdir(path)) == ["bm25.npz", "index.faiss", "index.pkl"]
+
+
+def test_refresh_keeps_old_index_readable(vectorizer, data_path):
+    from langchain_core.documents import Document
+
+    assert vectorizer.calc_and_save_embedding("Coin")
+    old_db = vectorizer.load_index(data_path + "embeddings/Coin")
+    old_path = old_db.docstore.path
+    old_text = old_db.docstore.search(old_db.index_to_docstore_id[0]).page_content
+
+    # whitepaper переписан, индекс еще не обновлен
+    loader = vectorizer.storage.wp_loader
+    new_docs = [Document(page_content=f"new chunk {i}") for i in range(3)]
+    loader.save_info("Coin", new_docs)
+    assert loader.load_info("Coin").path != old_path
+    assert len(old_db.similarity_search("token", k=3)) == 3
+    assert (
+        old_db.docstore.search(old_db.index_to_docstore_id[0]).page_content == old_text
+    )
+
+    assert vectorizer.update_embedding("Coin")
+    new_db = vectorizer.load_index(data_path + "embeddings/Coin")
+    assert new_db.docstore.path == loader.load_info("Coin").path
+    assert sorted(d.page_content for d in new_db.similarity_search("chunk", k=3)) == [
+        d.page_content for d in new_docs
+    ]
+    # старая версия удалена после сохранения нового индекса
+    assert not os.path.exists(old_path)
+
+
+def test_summary_reads_chunks_in_document_order(vectorizer):
+    assert vectorizer.calc_and_save_embedding("Coin")
+    docs = vectorizer.get_retriever("Coin", is_summary=True).invoke(" ")
+
+    store = vectorizer.load_whitepaper("Coin")
+    assert [doc.id for doc in docs] == store.ids
+    pages = [doc.metadata["page"] for doc in docs]
+    assert pages == sorted(pages)